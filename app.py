@@ -1,11 +1,19 @@
 import os
 import logging
-import tempfile
 import base64
+import functools
+import hmac
 import io
-from typing import List, Dict, Any, Optional
+import json
+import math
+import queue
+import select
+import socket
+import threading
+import time
+from dataclasses import asdict
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Iterator, Tuple
 import numpy as np
-import requests
 import random
 
 # Load environment variables
@@ -13,15 +21,32 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import flask
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g, send_file, stream_with_context, url_for
 from flask_cors import CORS
 
-# Required imports - fail fast if not available
-from boson_multimodal.serve.serve_engine import HiggsAudioServeEngine
+# Required imports - fail fast if not available. torch, transformers and whisper are imported by load_models() in the
+# background, so that the port is bound right away
+from boson_multimodal.serve.scheduler import (
+    PRIORITY_CLASSES, PRIORITY_INTERACTIVE, AdmissionRejectedError, DeadlineExceededError, HiggsAudioRequestScheduler,
+    SchedulerQueueFullError
+)
+from boson_multimodal.serve.audio_encoding import (
+    AUDIO_CONTENT_TYPES, AUDIO_SAMPLE_RATES, AudioEncoder, AudioEncoderPool, create_audio_encoder
+)
+from boson_multimodal.serve.audio_store import AudioResultStore
+from boson_multimodal.serve.batches import BatchManager
+from boson_multimodal.serve.coalescing import StreamCoalescer
+from boson_multimodal.serve.flight_recorder import FlightRecorder, sanitize_request_body
+from boson_multimodal.serve.llm_client import UpstreamLLMClient
+from boson_multimodal.serve.metrics import MetricsRegistry
+from boson_multimodal.serve.profiling import ProfilerBusyError, ProfilerCapture, ProfilerUnavailableError
+from boson_multimodal.serve.result_cache import AudioResultCache, make_cache_key
+from boson_multimodal.serve.timing import RequestTimings
+from boson_multimodal.serve.worker_pool import EngineWorkerPool
 from boson_multimodal.data_types import ChatMLSample, Message, AudioContent
-import whisper
-import torch
-import torchaudio
+
+if TYPE_CHECKING:
+    from boson_multimodal.serve.serve_engine import HiggsAudioStreamer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -30,25 +55,303 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
+# Shared keep-alive client for the text LLM upstream
+LLM_UPSTREAM_URL = os.getenv("LLM_UPSTREAM_URL", "https://text.pollinations.ai/openai")
+# Fixed seed for the text LLM; when set, identical prompts are answered from the response cache
+LLM_SEED = int(os.environ["LLM_SEED"]) if os.getenv("LLM_SEED") else None
+llm_client = UpstreamLLMClient(
+    LLM_UPSTREAM_URL,
+    read_timeout=float(os.getenv("LLM_TIMEOUT", "30")),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+    hedge_delay=float(os.environ["LLM_HEDGE_DELAY"]) if os.getenv("LLM_HEDGE_DELAY") else None,
+    cache_size=int(os.getenv("LLM_CACHE_SIZE", "1024"))
+)
+
+# Prometheus metrics served on /metrics
+metrics = MetricsRegistry(namespace="audio_service")
+REQUEST_DURATION = metrics.histogram(
+    "request_duration_seconds", "End-to-end request latency, until the last byte of the response was sent",
+    [0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120], ("endpoint", "status")
+)
+REQUEST_ERRORS = metrics.counter("request_errors_total", "Responses with an error status", ("endpoint", "status"))
+PARTIAL_ERRORS = metrics.counter("partial_errors_total", "Errors inside a response that had already started, e.g. a failed sentence of a reply", ("endpoint",))
+TIME_TO_FIRST_AUDIO = metrics.histogram(
+    "time_to_first_audio_seconds", "Time from receiving the request to the first decoded audio chunk",
+    [0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10], ("endpoint",)
+)
+TTS_REAL_TIME_FACTOR = metrics.histogram(
+    "tts_real_time_factor", "Generation service time divided by the duration of the generated audio",
+    [0.1, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 2, 3, 5], ("priority",)
+)
+TTS_PREFILL_THROUGHPUT = metrics.histogram(
+    "tts_prefill_tokens_per_second", "Prompt tokens per second of the prefill of a generation",
+    [100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000]
+)
+TTS_DECODE_THROUGHPUT = metrics.histogram(
+    "tts_decode_tokens_per_second", "Decode steps per second of a generation, lower when other generations are interleaved with it",
+    [5, 10, 20, 30, 50, 75, 100, 150, 250, 500]
+)
+TTS_CODEC_DECODE = metrics.histogram(
+    "tts_codec_decode_seconds", "Time spent decoding audio codes into a waveform, per generation (full) or per streamed request (stream)",
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5], ("mode",)
+)
+TTS_QUEUE_DEPTH = metrics.gauge("tts_queue_depth", "TTS requests waiting for a KV cache slot", ("priority",))
+TTS_ACTIVE_GENERATIONS = metrics.gauge("tts_active_generations", "TTS generations in progress")
+TTS_FREE_KV_SLOTS = metrics.gauge("tts_free_kv_slots", "KV cache slots available to new generations")
+TTS_KV_BUCKET_SEQUENCES = metrics.gauge("tts_kv_bucket_sequences", "Running generations per KV cache bucket length", ("bucket",))
+TTS_KV_BUCKET_PROMOTIONS = metrics.counter("tts_kv_bucket_promotions_total", "Generations that outgrew their KV cache bucket, by the bucket they moved to", ("bucket",))
+TTS_REQUESTS = metrics.counter("tts_requests_total", "TTS generation requests by outcome", ("outcome",))
+TTS_CANCELLED_STEPS = metrics.counter("tts_cancelled_decode_steps_total", "Decode steps spent on generations that were cancelled")
+TTS_CACHE_LOOKUPS = metrics.counter("tts_cache_lookups_total", "TTS result cache lookups by result", ("result",))
+TTS_COALESCED = metrics.counter("tts_coalesced_requests_total", "Speech requests that started a generation (leader) or joined one (follower)", ("role",))
+READY = metrics.gauge("ready", "1 once the models are loaded and warmed up")
+STT_QUEUE_DEPTH = metrics.gauge("stt_queue_depth", "Clips waiting for transcription")
+LLM_UPSTREAM_CALLS = metrics.counter("llm_upstream_calls_total", "Text LLM upstream call counters", ("outcome",))
+AUDIO_ENCODER_STARTS = metrics.counter("audio_encoder_starts_total", "Compressed audio encoder processes taken from the spares (warm) or started on demand (cold)", ("start",))
+
 # Global model instances
 tts_model = None
+tts_scheduler = None
+voice_registry = None
+tts_cache = None
+tts_coalescer = None
+tts_batches = None
+result_store = None
+audio_encoder_pool = None
+flight_recorder = None
 stt_model = None
+stt_service = None
+
+# Startup progress: "loading", then "warming_up", then "ready" (or "failed"), reported by /health/ready
+startup_state = "loading"
+startup_timings = RequestTimings()
+# Representative generations and codec round trips run before reporting ready
+WARMUP_GENERATIONS = int(os.getenv("WARMUP_GENERATIONS", "1"))
+WARMUP_TEXT = os.getenv("WARMUP_TEXT", "Hello! Thanks for calling, how can I help you today?")
+# Stand-in engine and transcriber profile for load tests without the models, e.g. "gpu" or "cpu,decode_step_seconds=0.05"
+STAND_IN_PROFILE = os.getenv("STAND_IN_PROFILE") or None
+# Endpoints served while the models load
+STARTUP_EXEMPT_PATHS = ("/health", "/health/live", "/health/ready", "/metrics")
+# Bearer token of the /admin endpoints, which are disabled (404) without one
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+# On-demand torch.profiler captures armed through POST /admin/profiler
+profiler_capture = ProfilerCapture(
+    os.getenv("PROFILER_DIR", "profiles"),
+    max_seconds=float(os.getenv("PROFILER_MAX_SECONDS", "120"))
+)
 
 def load_models():
     """Load models - fail fast if any dependency is missing"""
-    global tts_model, stt_model
+    global tts_model, tts_scheduler, voice_registry, tts_cache, tts_coalescer, tts_batches, result_store, audio_encoder_pool, flight_recorder, stt_model, stt_service
     
     logger.info("Loading TTS model...")
-    tts_model = HiggsAudioServeEngine(
-        "bosonai/higgs-audio-v2-generation-3B-base", 
-        "bosonai/higgs-audio-v2-tokenizer"
+    with startup_timings.stage("import"):
+        from boson_multimodal.serve.serve_engine import HiggsAudioServeEngine
+        from boson_multimodal.serve.voices import VoiceRegistry
+    engine_class = HiggsAudioServeEngine
+    engine_options = {}
+    if STAND_IN_PROFILE:
+        # Load tests: a stand-in engine with synthetic latencies, no checkpoint or GPU needed
+        from boson_multimodal.serve.stand_in import StandInServeEngine
+        engine_class = StandInServeEngine
+        engine_options = dict(profile=STAND_IN_PROFILE)
+        logger.warning(f"Serving with the stand-in engine and transcriber (STAND_IN_PROFILE={STAND_IN_PROFILE})")
+    scheduler_kwargs = dict(
+        max_queue_size=int(os.getenv("TTS_QUEUE_SIZE", "64")),
+        max_queue_delay=float(os.environ["TTS_MAX_QUEUE_DELAY"]) if os.getenv("TTS_MAX_QUEUE_DELAY") else None,
+        reserved_interactive_slots=int(os.getenv("TTS_RESERVED_INTERACTIVE_SLOTS", "1")),
+        bulk_step_interval=int(os.getenv("TTS_BULK_STEP_INTERVAL", "4")),
+        on_complete=record_generation_metrics
+    )
+    num_cpu_workers = int(os.getenv("TTS_CPU_WORKERS", "0"))
+    if num_cpu_workers > 0:
+        # CPU hosts: generations run in pinned worker processes that map one shared copy of the weights, this
+        # process only keeps the tokenizers and the codec (mapping the same weight snapshots)
+        engine_kwargs = dict(
+            model_name_or_path="bosonai/higgs-audio-v2-generation-3B-base",
+            audio_tokenizer_name_or_path="bosonai/higgs-audio-v2-tokenizer",
+            device="cpu",
+            shared_weights_dir=os.getenv("SHARED_WEIGHTS_DIR", "weights"),
+            **engine_options
+        )
+        with startup_timings.stage("tts_model"):
+            tts_model = engine_class(**engine_kwargs, max_batch_size=0)
+        with startup_timings.stage("tts_workers"):
+            tts_scheduler = EngineWorkerPool(
+                tts_model,
+                num_cpu_workers,
+                engine_kwargs=dict(engine_kwargs, max_batch_size=int(os.getenv("TTS_MAX_BATCH_SIZE", "1"))),
+                threads_per_worker=int(os.environ["TTS_THREADS_PER_WORKER"]) if os.getenv("TTS_THREADS_PER_WORKER") else None,
+                engine_class=engine_class,
+                **scheduler_kwargs
+            )
+    else:
+        with startup_timings.stage("tts_model"):
+            tts_model = engine_class(
+                "bosonai/higgs-audio-v2-generation-3B-base", 
+                "bosonai/higgs-audio-v2-tokenizer",
+                max_batch_size=int(os.getenv("TTS_MAX_BATCH_SIZE", "1")),
+                **engine_options
+            )
+        # All generations go through a single worker that batches them across the engine's KV cache slots
+        tts_scheduler = HiggsAudioRequestScheduler(tts_model, **scheduler_kwargs)
+    # Cloned voices are stored as precomputed reference audio codes
+    voice_registry = VoiceRegistry(os.getenv("VOICES_DIR", "voices"), tts_model)
+    # Seeded generations are cached in memory and, optionally, on disk
+    cache_memory_mb = int(os.getenv("TTS_CACHE_MEMORY_MB", "0"))
+    cache_dir = os.getenv("TTS_CACHE_DIR") or None
+    if cache_memory_mb > 0 or cache_dir:
+        tts_cache = AudioResultCache(
+            max_memory_bytes=cache_memory_mb << 20,
+            disk_dir=cache_dir,
+            max_disk_bytes=int(os.getenv("TTS_CACHE_DISK_MB", "1024")) << 20
+        )
+    # Identical requests arriving while a generation runs share it instead of starting their own
+    if os.getenv("TTS_COALESCE", "1") == "1":
+        tts_coalescer = StreamCoalescer()
+    # Generated audio delivered by URL ("delivery": "url") instead of inline
+    result_store = AudioResultStore(
+        os.getenv("RESULT_STORE_DIR", "results"),
+        max_bytes=int(os.getenv("RESULT_STORE_MAX_MB", "2048")) << 20,
+        ttl=float(os.getenv("RESULT_STORE_TTL", "3600"))
+    )
+    # Requests slower than the threshold are kept with their full inputs, for replay_flight_record.py
+    if os.getenv("FLIGHT_RECORDER_THRESHOLD_MS"):
+        flight_recorder = FlightRecorder(
+            os.getenv("FLIGHT_RECORDER_DIR", "flight_records"),
+            threshold=float(os.environ["FLIGHT_RECORDER_THRESHOLD_MS"]) / 1000,
+            capacity=int(os.getenv("FLIGHT_RECORDER_CAPACITY", "100")),
+            audio=os.getenv("FLIGHT_RECORDER_AUDIO", "hash")
+        )
+    # mp3/opus/aac are encoded by ffmpeg processes started ahead of the requests that use them
+    audio_encoder_pool = AudioEncoderPool(
+        spares=int(os.getenv("AUDIO_ENCODER_SPARES", "2")),
+        ffmpeg=os.getenv("FFMPEG_BINARY", "ffmpeg")
+    )
+    # Offline batches run at bulk priority, unfinished ones resume here
+    tts_batches = BatchManager(
+        os.getenv("BATCHES_DIR", "batches"),
+        tts_scheduler,
+        prepare=prepare_batch_job,
+        encode=audio_to_wav_bytes,
+        max_in_flight=int(os.environ["BATCH_MAX_IN_FLIGHT"]) if os.getenv("BATCH_MAX_IN_FLIGHT") else None
     )
     logger.info("TTS model loaded successfully")
     
     logger.info("Loading STT model...")
-    stt_model = whisper.load_model("small")
+    with startup_timings.stage("import"):
+        import whisper
+        from boson_multimodal.serve.transcriber import WhisperTranscriptionService
+    stt_kwargs = dict(
+        max_batch_size=int(os.getenv("STT_MAX_BATCH_SIZE", "8")),
+        max_batch_wait=float(os.getenv("STT_BATCH_WAIT_MS", "10")) / 1000
+    )
+    if STAND_IN_PROFILE:
+        from boson_multimodal.serve.stand_in import StandInTranscriptionService
+        stt_service = StandInTranscriptionService(STAND_IN_PROFILE, **stt_kwargs)
+    else:
+        with startup_timings.stage("stt_model"):
+            stt_model = whisper.load_model("small")
+        # Clips from concurrent requests are micro-batched into single Whisper forward passes
+        stt_service = WhisperTranscriptionService(stt_model, **stt_kwargs)
     logger.info("STT model loaded successfully")
 
+def record_generation_metrics(generation, response) -> None:
+    """Record the throughput metrics of a completed TTS generation, called on the scheduler worker"""
+    timings = response.timings or {}
+    if timings.get("prefill"):
+        TTS_PREFILL_THROUGHPUT.observe(response.usage["prompt_tokens"] / timings["prefill"])
+    # The first step is the prefill
+    if timings.get("decode") and generation.num_steps > 1:
+        TTS_DECODE_THROUGHPUT.observe((generation.num_steps - 1) / timings["decode"])
+    if "codec_decode" in timings:
+        TTS_CODEC_DECODE.observe(timings["codec_decode"], mode="full")
+    if response.audio is not None and len(response.audio) > 0:
+        priority = next(name for name, value in PRIORITY_CLASSES.items() if value == generation.priority)
+        TTS_REAL_TIME_FACTOR.observe(generation.service_time / (len(response.audio) / response.sampling_rate), priority=priority)
+
+def collect_component_metrics() -> None:
+    """Copy the queue, KV cache and cache state of the components into the metrics before a scrape"""
+    if tts_scheduler is not None:
+        stats = tts_scheduler.stats()
+        for name, num_queued in stats["queued"].items():
+            TTS_QUEUE_DEPTH.set(num_queued, priority=name)
+        TTS_ACTIVE_GENERATIONS.set(stats["active"])
+        for outcome in ("completed", "failed", "cancelled", "rejected", "shed", "deadline_exceeded"):
+            TTS_REQUESTS.set(stats[outcome], outcome=outcome)
+        TTS_CANCELLED_STEPS.set(stats["cancelled_steps"])
+    if tts_scheduler is not None:
+        kv_stats = tts_scheduler.kv_cache_stats()
+        TTS_FREE_KV_SLOTS.set(kv_stats["free_slots"])
+        for bucket, num_sequences in kv_stats["buckets_in_use"].items():
+            TTS_KV_BUCKET_SEQUENCES.set(num_sequences, bucket=bucket)
+        for bucket, num_promotions in kv_stats["bucket_promotions"].items():
+            TTS_KV_BUCKET_PROMOTIONS.set(num_promotions, bucket=bucket)
+    if tts_cache is not None:
+        stats = tts_cache.stats()
+        TTS_CACHE_LOOKUPS.set(stats["memory_hits"], result="memory_hit")
+        TTS_CACHE_LOOKUPS.set(stats["disk_hits"], result="disk_hit")
+        TTS_CACHE_LOOKUPS.set(stats["misses"], result="miss")
+    if tts_coalescer is not None:
+        stats = tts_coalescer.stats()
+        TTS_COALESCED.set(stats["leaders"], role="leader")
+        TTS_COALESCED.set(stats["followers"], role="follower")
+    READY.set(1 if startup_state == "ready" else 0)
+    if stt_service is not None:
+        STT_QUEUE_DEPTH.set(stt_service.stats()["queue_depth"])
+    if audio_encoder_pool is not None:
+        stats = audio_encoder_pool.stats()
+        AUDIO_ENCODER_STARTS.set(stats["warm_starts"], start="warm")
+        AUDIO_ENCODER_STARTS.set(stats["cold_starts"], start="cold")
+    stats = llm_client.stats()
+    for outcome in ("calls", "failures", "retries", "hedges", "rejected", "cache_hits", "cache_misses"):
+        LLM_UPSTREAM_CALLS.set(stats[outcome], outcome=outcome)
+
+metrics.add_collector(collect_component_metrics)
+
+def warm_up_models() -> None:
+    """Run representative generations, codec round trips and a transcription, so that the first real requests do not pay for lazy initialization"""
+    sample_rate = tts_model.audio_tokenizer.sampling_rate
+    # Consecutive generations are spread over the engine workers, warm up every one of them
+    num_generations = max(WARMUP_GENERATIONS, getattr(tts_scheduler, "num_workers", 1)) if WARMUP_GENERATIONS > 0 else 0
+    for i in range(num_generations):
+        with startup_timings.stage("warmup_tts"):
+            # Streamed like a live request, so both the streaming and the full codec decode run
+            audio_chunks = list(submit_text_to_speech(WARMUP_TEXT, "alloy", None, 1.0, seed=None, priority=PRIORITY_INTERACTIVE, deadline=None, enforce_slo=False, stop_signal=None, cache_key=None))
+        if not audio_chunks:
+            continue
+        audio = np.concatenate(audio_chunks)
+        with startup_timings.stage("warmup_encode"):
+            wav_bytes = audio_to_wav_bytes(audio, sample_rate)
+            # Also leaves spare mp3 encoder processes started for the first requests
+            try:
+                create_audio_encoder("mp3", sample_rate, pool=audio_encoder_pool).encode(audio)
+            except Exception as e:
+                # Only compressed speech formats depend on it, not worth failing the startup for
+                logger.warning(f"Compressed audio encoder unavailable: {e}")
+        # Reference audio of cloned voices goes through the codec encoder and its semantic model
+        with startup_timings.stage("warmup_codec_encode"):
+            tts_model.encode_audio(wav_bytes)
+        with startup_timings.stage("warmup_stt"):
+            stt_service.transcribe(wav_bytes)
+
+def load_and_warm_up() -> None:
+    """Load and warm up the models in the background, exiting on failure so that the service manager restarts us"""
+    global startup_state
+    try:
+        load_models()
+        startup_state = "warming_up"
+        logger.info(f"Warming up with {WARMUP_GENERATIONS} generations...")
+        warm_up_models()
+    except Exception:
+        startup_state = "failed"
+        logger.exception("Model loading failed")
+        os._exit(1)
+    startup_timings.mark("ready")
+    startup_state = "ready"
+    logger.info(f"Ready: {json.dumps(startup_timings.as_dict())}")
+
 def decode_base64_audio(b64_string: str) -> bytes:
     """Decode base64 audio data"""
     try:
@@ -65,125 +368,362 @@ def decode_base64_audio(b64_string: str) -> bytes:
     except Exception as e:
         raise ValueError(f"Invalid base64 audio data: {e}")
 
-def text_to_speech(text: str, voice: str = "alloy", voice_reference_audio: Optional[bytes] = None) -> bytes:
-    """Convert text to speech with specified voice or voice cloning"""
-    try:
-        # Voice-specific system prompts to simulate different voices
-        voice_prompts = {
-            "alloy": (
-                "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
-                "Generate audio following instruction.\n"
-                "<|scene_desc_start|>\n"
-                "Speak with natural conversational warmth and genuine human connection. "
-                "Use a balanced, expressive voice with organic pacing and authentic emotional undertones.\n"
-                "<|scene_desc_end|>"
-            ),
-            "echo": (
-                "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
-                "Generate audio following instruction.\n"
-                "<|scene_desc_start|>\n"
-                "Speak with a clear, resonant voice that has depth and authority. "
-                "Use confident pacing with strong articulation and professional tone.\n"
-                "<|scene_desc_end|>"
-            ),
-            "fable": (
-                "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
-                "Generate audio following instruction.\n"
-                "<|scene_desc_start|>\n"
-                "Speak with a storytelling voice that is engaging and narrative. "
-                "Use expressive intonation with dramatic pauses and captivating delivery.\n"
-                "<|scene_desc_end|>"
-            ),
-            "onyx": (
-                "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
-                "Generate audio following instruction.\n"
-                "<|scene_desc_start|>\n"
-                "Speak with a deep, rich voice that conveys strength and reliability. "
-                "Use steady pacing with authoritative tone and grounded delivery.\n"
-                "<|scene_desc_end|>"
-            ),
-            "nova": (
-                "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
-                "Generate audio following instruction.\n"
-                "<|scene_desc_start|>\n"
-                "Speak with a bright, energetic voice that is youthful and dynamic. "
-                "Use lively pacing with enthusiastic tone and vibrant delivery.\n"
-                "<|scene_desc_end|>"
-            ),
-            "shimmer": (
-                "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
-                "Generate audio following instruction.\n"
-                "<|scene_desc_start|>\n"
-                "Speak with a gentle, melodic voice that is soothing and harmonious. "
-                "Use flowing pacing with soft tone and graceful delivery.\n"
-                "<|scene_desc_end|>"
-            )
-        }
-        
-        # Handle voice cloning if reference audio is provided
-        if voice_reference_audio:
-            logger.info(f"Using voice cloning with {len(voice_reference_audio)} bytes of reference audio")
-            
-            # Convert reference audio to base64
-            reference_audio_b64 = base64.b64encode(voice_reference_audio).decode('utf-8')
-            
-            # Create voice cloning system prompt
-            system_prompt = (
-                "Generate audio following instruction.\n"
-                "<|scene_desc_start|>\n"
-                "Clone the voice characteristics from the provided reference audio. "
-                "Match the speaker's tone, accent, speaking style, and vocal qualities. "
-                "Maintain natural expression while preserving the unique voice identity.\n"
-                "<|scene_desc_end|>"
-            )
-            
-            # Create messages following the correct voice cloning pattern
-            messages = [
-                Message(role="system", content=system_prompt),
-                Message(role="user", content="Please clone this voice."),
-                Message(role="assistant", content=[AudioContent(raw_audio=reference_audio_b64, audio_url="")]),
-                Message(role="user", content=text)
-            ]
-        else:
-            # Use the specified voice prompt, fallback to alloy if voice not found
-            system_prompt = voice_prompts.get(voice, voice_prompts["alloy"])
-            logger.info(f"Generating TTS with voice: {voice}")
-            
-            messages = [
-                Message(role="system", content=system_prompt),
-                Message(role="user", content=text)
-            ]
-        
-        # Create chat template
-        chat_template = ChatMLSample(messages=messages)
-        
-        # Generate audio
-        response = tts_model.generate(
-            chat_ml_sample=chat_template,
-            max_new_tokens=1024,
-            temperature=0.7,
-            force_audio_gen=True,
-            top_k=50,
-            top_p=0.95
-        )
-        
-        if response.audio is None:
-            raise RuntimeError("No audio generated by model")
+# Voice-specific system prompts to simulate different voices
+VOICE_PROMPTS = {
+    "alloy": (
+        "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
+        "Generate audio following instruction.\n"
+        "<|scene_desc_start|>\n"
+        "Speak with natural conversational warmth and genuine human connection. "
+        "Use a balanced, expressive voice with organic pacing and authentic emotional undertones.\n"
+        "<|scene_desc_end|>"
+    ),
+    "echo": (
+        "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
+        "Generate audio following instruction.\n"
+        "<|scene_desc_start|>\n"
+        "Speak with a clear, resonant voice that has depth and authority. "
+        "Use confident pacing with strong articulation and professional tone.\n"
+        "<|scene_desc_end|>"
+    ),
+    "fable": (
+        "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
+        "Generate audio following instruction.\n"
+        "<|scene_desc_start|>\n"
+        "Speak with a storytelling voice that is engaging and narrative. "
+        "Use expressive intonation with dramatic pauses and captivating delivery.\n"
+        "<|scene_desc_end|>"
+    ),
+    "onyx": (
+        "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
+        "Generate audio following instruction.\n"
+        "<|scene_desc_start|>\n"
+        "Speak with a deep, rich voice that conveys strength and reliability. "
+        "Use steady pacing with authoritative tone and grounded delivery.\n"
+        "<|scene_desc_end|>"
+    ),
+    "nova": (
+        "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
+        "Generate audio following instruction.\n"
+        "<|scene_desc_start|>\n"
+        "Speak with a bright, energetic voice that is youthful and dynamic. "
+        "Use lively pacing with enthusiastic tone and vibrant delivery.\n"
+        "<|scene_desc_end|>"
+    ),
+    "shimmer": (
+        "You are a voice synthesis engine. Speak the user's text naturally and expressively. "
+        "Generate audio following instruction.\n"
+        "<|scene_desc_start|>\n"
+        "Speak with a gentle, melodic voice that is soothing and harmonious. "
+        "Use flowing pacing with soft tone and graceful delivery.\n"
+        "<|scene_desc_end|>"
+    )
+}
+
+# Sampling parameters shared by every TTS generation
+TTS_GENERATION_KWARGS = dict(
+    max_new_tokens=1024,
+    temperature=0.7,
+    force_audio_gen=True,
+    top_k=50,
+    top_p=0.95
+)
+
+# Number of codec frames decoded per streamed audio chunk
+AUDIO_STREAM_CHUNK_FRAMES = int(os.getenv("AUDIO_STREAM_CHUNK_FRAMES", "10"))
+# Sentence grouping of streamed replies for pipelined TTS (word counts, see serve.utils.split_paragraph)
+TTS_SPLITTER_KWARGS = dict(lang="en", token_max_n=60, token_min_n=30, merge_len=10)
+# Seed for requests that do not set one; only seeded generations are reproducible and cached
+TTS_SEED = int(os.environ["TTS_SEED"]) if os.getenv("TTS_SEED") else None
+
+def build_tts_sample(text: str, voice: str = "alloy", voice_reference_audio: Optional[bytes] = None, speed: float = 1.0) -> ChatMLSample:
+    """Build the ChatML prompt for speaking text with a built-in voice or a cloned reference voice"""
+    # The model has no rate control, so speed is passed as a pacing instruction
+    pacing = ""
+    if speed != 1.0:
+        pacing = f"Speak at about {speed:g} times your normal speaking rate.\n"
+    
+    # Registered voices carry precomputed reference audio codes
+    if is_registered_voice(voice):
+        logger.info(f"Using registered voice: {voice}")
+        reference_audio = AudioContent(audio_url="", audio_codes=voice_registry.load_codes(voice))
+    elif voice_reference_audio:
+        logger.info(f"Using voice cloning with {len(voice_reference_audio)} bytes of reference audio")
         
-        # Convert to WAV bytes
-        audio_tensor = torch.from_numpy(response.audio).unsqueeze(0)
-        sample_rate = getattr(response, 'sampling_rate', 24000)
+        # The engine loads the encoded bytes directly, no base64 round trip
+        reference_audio = AudioContent(raw_audio=voice_reference_audio, audio_url="")
+    else:
+        reference_audio = None
+    
+    # Handle voice cloning if reference audio is provided
+    if reference_audio is not None:
         
-        buffer = io.BytesIO()
-        torchaudio.save(buffer, audio_tensor, sample_rate, format="WAV")
-        audio_bytes = buffer.getvalue()
+        # Create voice cloning system prompt
+        system_prompt = (
+            "Generate audio following instruction.\n"
+            "<|scene_desc_start|>\n"
+            "Clone the voice characteristics from the provided reference audio. "
+            "Match the speaker's tone, accent, speaking style, and vocal qualities. "
+            "Maintain natural expression while preserving the unique voice identity.\n"
+            + pacing +
+            "<|scene_desc_end|>"
+        )
         
-        logger.info(f"Generated audio: {len(audio_bytes)} bytes at {sample_rate}Hz")
-        return audio_bytes
+        # Create messages following the correct voice cloning pattern
+        messages = [
+            Message(role="system", content=system_prompt),
+            Message(role="user", content="Please clone this voice."),
+            Message(role="assistant", content=[reference_audio]),
+            Message(role="user", content=text)
+        ]
+    else:
+        # Use the specified voice prompt, fallback to alloy if voice not found
+        system_prompt = VOICE_PROMPTS.get(voice, VOICE_PROMPTS["alloy"])
+        if pacing:
+            system_prompt = system_prompt.replace("<|scene_desc_end|>", pacing + "<|scene_desc_end|>")
+        logger.info(f"Generating TTS with voice: {voice}")
         
+        messages = [
+            Message(role="system", content=system_prompt),
+            Message(role="user", content=text)
+        ]
+    
+    return ChatMLSample(messages=messages)
+
+def prepare_batch_job(body: Dict[str, Any]) -> Tuple[ChatMLSample, Dict[str, Any]]:
+    """Generation inputs of a batch job, whose body takes the /v1/audio/speech parameters"""
+    voice = body.get("voice_id") or body.get("voice", "alloy")
+    if voice.startswith("voice_") and not is_registered_voice(voice):
+        raise ValueError(f"Unknown voice '{voice}'")
+    speed = float(body.get("speed", 1.0))
+    seed = body.get("seed", TTS_SEED)
+    chat_template = build_tts_sample(body["input"], voice=voice, speed=speed)
+    return chat_template, dict(seed=seed, **TTS_GENERATION_KWARGS)
+
+def tts_cache_key(text: str, voice: str, voice_reference_audio: Optional[bytes], speed: float, seed: Optional[int]) -> Optional[str]:
+    """Cache key of a TTS request, None if caching is disabled or the generation is not seeded"""
+    if tts_cache is None or seed is None:
+        return None
+    return make_cache_key(text, voice, voice_reference_audio, speed=speed, seed=seed, **TTS_GENERATION_KWARGS)
+
+def stream_text_to_speech(text: str, voice: str = "alloy", voice_reference_audio: Optional[bytes] = None, speed: float = 1.0, seed: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None, enforce_slo: bool = True, stop_signal: Optional[threading.Event] = None, timings: Optional[RequestTimings] = None) -> Iterator[np.ndarray]:
+    """
+    Queue a streaming TTS generation and return an iterator over its float PCM chunks, setting stop_signal cancels it.
+    The stages of the generation are recorded in timings.
+    A request identical to one that is still generating attaches to its stream instead, and its wait for the shared
+    chunks is recorded as the "coalesced" stage. A request leaves a shared generation when its stop_signal is set or
+    its iterator is closed, the generation is cancelled once all of its requests have left.
+    """
+    seed = TTS_SEED if seed is None else seed
+    cache_key = tts_cache_key(text, voice, voice_reference_audio, speed, seed)
+    if cache_key:
+        audio = tts_cache.get(cache_key)
+        if audio is not None:
+            logger.info(f"TTS cache hit for {len(text)} characters")
+            return iter_cached_audio(audio)
+    
+    def start_generation(stop_signal: Optional[threading.Event]) -> Iterator[np.ndarray]:
+        return submit_text_to_speech(text, voice, voice_reference_audio, speed, seed, priority, deadline, enforce_slo, stop_signal, cache_key, timings)
+    
+    if tts_coalescer is None:
+        return start_generation(stop_signal)
+    # Unseeded requests are coalesced too, a shared random take is as good as a separate one. Followers run at the
+    # leader's priority, so only requests of the same priority class share a generation
+    request_key = (priority, cache_key or make_cache_key(text, voice, voice_reference_audio, speed=speed, seed=seed, **TTS_GENERATION_KWARGS))
+    audio_chunks = tts_coalescer.subscribe(request_key, start_generation, stop_signal=stop_signal)
+    if audio_chunks.leader or timings is None:
+        return audio_chunks
+    # The stages of the shared generation are recorded on the leader's timings
+    return iter_coalesced_audio(audio_chunks, timings)
+
+def iter_coalesced_audio(audio_chunks: Iterator[np.ndarray], timings: RequestTimings) -> Iterator[np.ndarray]:
+    """Replay a shared generation for a request that joined it, recording the time spent waiting for its chunks"""
+    waited = 0.0
+    try:
+        while True:
+            wait_start = time.monotonic()
+            audio_chunk = next(audio_chunks, None)
+            waited += time.monotonic() - wait_start
+            if audio_chunk is None:
+                return
+            timings.mark("first_audio")
+            yield audio_chunk
+    finally:
+        timings.add("coalesced", waited)
+        audio_chunks.close()
+
+def submit_text_to_speech(text: str, voice: str, voice_reference_audio: Optional[bytes], speed: float, seed: Optional[int], priority: int, deadline: Optional[float], enforce_slo: bool, stop_signal: Optional[threading.Event], cache_key: Optional[str], timings: Optional[RequestTimings] = None) -> Iterator[np.ndarray]:
+    """Submit a streaming TTS generation to the scheduler and return an iterator over its float PCM chunks"""
+    from boson_multimodal.serve.serve_engine import HiggsAudioStreamer
+    chat_template = build_tts_sample(text, voice=voice, voice_reference_audio=voice_reference_audio, speed=speed)
+    if seed is None and flight_recorder is not None:
+        # A recorded generation can only be replayed exactly with the seed it was sampled with
+        seed = random.randrange(1 << 31)
+    streamer = HiggsAudioStreamer(
+        tts_model.tokenizer,
+        audio_num_codebooks=tts_model.audio_num_codebooks,
+        skip_prompt=True,
+        skip_special_tokens=True
+    )
+    # Submit eagerly so that a full queue is reported before the response starts
+    generation = tts_scheduler.submit(
+        chat_template,
+        streamer=streamer,
+        seed=seed,
+        priority=priority,
+        deadline=deadline,
+        enforce_slo=enforce_slo,
+        stop_signal=stop_signal,
+        **TTS_GENERATION_KWARGS
+    )
+    generate_kwargs = dict(chat_ml_sample=chat_template, seed=seed, **TTS_GENERATION_KWARGS)
+    return iter_audio_chunks(generation, streamer, cache_key=cache_key, timings=timings, generate_kwargs=generate_kwargs)
+
+def iter_cached_audio(audio: np.ndarray, chunk_frames: int = AUDIO_STREAM_CHUNK_FRAMES) -> Iterator[np.ndarray]:
+    """Replay a cached waveform in chunks of the same size as a live stream"""
+    chunk_size = chunk_frames * tts_model.samples_per_token
+    for start in range(0, len(audio), chunk_size):
+        yield audio[start:start + chunk_size]
+
+def iter_audio_chunks(generation, streamer: "HiggsAudioStreamer", chunk_frames: int = AUDIO_STREAM_CHUNK_FRAMES, cache_key: Optional[str] = None, timings: Optional[RequestTimings] = None, generate_kwargs: Optional[Dict[str, Any]] = None) -> Iterator[np.ndarray]:
+    """
+    Decode streamed audio tokens into overlap-added PCM chunks as soon as enough codec frames are complete.
+    With generate_kwargs, the generation is attached to the request's flight record.
+    """
+    if timings is None:
+        timings = RequestTimings()
+    decoder = tts_model.create_streaming_decoder(chunk_frames=chunk_frames)
+    try:
+        for delta in streamer:
+            if delta.audio_tokens is None:
+                continue
+            with timings.stage("stream_codec_decode"):
+                audio_chunk = decoder.push(delta.audio_tokens)
+            if audio_chunk is not None:
+                timings.mark("first_audio")
+                yield audio_chunk
+    except GeneratorExit:
+        # The consumer went away, free the generation's KV cache slot instead of decoding for nobody
+        generation.cancel()
+        raise
+    
+    # Surface generation errors once the stream has ended
+    try:
+        response = generation.result()
     except Exception as e:
-        logger.error(f"TTS error: {e}")
-        raise RuntimeError(f"Text-to-speech failed: {e}")
+        if flight_recorder is not None and generate_kwargs is not None:
+            flight_recorder.add_generation(timings, generate_kwargs, generation, error=e)
+        raise
+    if flight_recorder is not None and generate_kwargs is not None:
+        flight_recorder.add_generation(timings, generate_kwargs, generation, response)
+    if cache_key and response.audio is not None:
+        tts_cache.put(cache_key, response.audio)
+    timings.add("tts_queue", generation.queue_wait)
+    timings.add_all(response.timings, prefix="tts_")
+    logger.info(f"TTS stream queue wait: {generation.queue_wait:.3f}s, service time: {generation.service_time:.3f}s")
+    with timings.stage("stream_codec_decode"):
+        audio_chunk = decoder.flush()
+    if audio_chunk is not None:
+        yield audio_chunk
+
+def audio_to_wav_bytes(audio: np.ndarray, sample_rate: int) -> bytes:
+    """Encode a float waveform as a WAV file"""
+    return create_audio_encoder("wav", sample_rate).encode(audio)
+
+def open_audio_encoder(response_format: str, sample_rate: Optional[int] = None) -> AudioEncoder:
+    """Streaming encoder of generated audio into a response format, resampled to sample_rate if given"""
+    return create_audio_encoder(response_format, tts_model.audio_tokenizer.sampling_rate, sample_rate, pool=audio_encoder_pool)
+
+def encode_audio_stream(encoder: AudioEncoder, audio_chunks: Iterator[np.ndarray], timings: Optional[RequestTimings] = None) -> Iterator[bytes]:
+    """Encode float PCM chunks as they are generated, yielding the encoded bytes. The encoding time is recorded in timings"""
+    if timings is None:
+        timings = RequestTimings()
+    try:
+        for audio_chunk in audio_chunks:
+            with timings.stage("encode"):
+                data = encoder.push(audio_chunk)
+            if data:
+                yield data
+        with timings.stage("encode"):
+            data = encoder.finish()
+        if data:
+            yield data
+    finally:
+        # Stops the encoder process of an abandoned stream, and the generation (or leaves a shared one) right away
+        # instead of whenever the iterator gets garbage collected
+        encoder.close()
+        close = getattr(audio_chunks, "close", None)
+        if close is not None:
+            close()
+
+def write_audio_stream(file, encoder: AudioEncoder, audio_chunks: Iterator[np.ndarray], timings: Optional[RequestTimings] = None) -> int:
+    """Encode float PCM chunks into a seekable file as they are generated, fixing the header up at the end. Returns the number of samples"""
+    start = file.tell()
+    for data in encode_audio_stream(encoder, audio_chunks, timings):
+        file.write(data)
+    encoder.finalize(file, start)
+    return encoder.num_samples
+
+def parse_output_sample_rate(value: Any) -> Optional[int]:
+    """Validate a requested output sample rate, None keeps the model's"""
+    if value is None:
+        return None
+    try:
+        sample_rate = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("'sample_rate' must be an integer")
+    if sample_rate not in AUDIO_SAMPLE_RATES and sample_rate != tts_model.audio_tokenizer.sampling_rate:
+        raise ValueError(f"'sample_rate' must be one of {', '.join(str(rate) for rate in AUDIO_SAMPLE_RATES)}")
+    return sample_rate
+
+def stored_audio_object(stored, response_format: str) -> Dict[str, Any]:
+    """Response description of an audio file in the result store"""
+    return {
+        "url": url_for("get_audio_result", file_name=stored.file_name, _external=True),
+        "format": response_format,
+        "bytes": stored.size,
+        "expires_at": int(stored.expires_at)
+    }
+
+def extract_user_message(messages: List[Dict[str, Any]]) -> str:
+    """Extract the user's actual message content"""
+    user_message = ""
+    for msg in messages:
+        if msg.get("role") == "user":
+            content = msg.get("content", "")
+            if isinstance(content, str):
+                user_message = content
+            elif isinstance(content, list):
+                # Handle OpenAI format with content array
+                for item in content:
+                    if isinstance(item, dict) and item.get("type") == "text":
+                        user_message = item.get("text", "")
+                        break
+            break
+    return user_message
+
+def build_llm_payload(user_message: str) -> Dict[str, Any]:
+    """Prepare payload for text.pollinations.ai"""
+    return {
+        "model": os.getenv("MODEL", "openai"),
+        "messages": [
+            {
+                "role": "system",
+                "content": "You are a helpful, intelligent, and conversational AI assistant. Provide thoughtful, accurate, and engaging responses to user questions and requests. Be natural, friendly, and informative in your communication style."
+            },
+            {
+                "role": "user",
+                "content": user_message
+            }
+        ],
+        "temperature": 0.7,
+        "stream": False,
+        "private": True,
+        "token": os.getenv("POLLI_TOKEN"),
+        "referrer": os.getenv("REFERRER", "simple-audio-service"),
+        "max_tokens": 1024,
+        "seed": LLM_SEED if LLM_SEED is not None else random.randint(1000, 9999)
+    }
 
 def generate_text_response(messages: List[Dict[str, Any]]) -> str:
     """Generate intelligent text response using text.pollinations.ai"""
@@ -191,21 +731,7 @@ def generate_text_response(messages: List[Dict[str, Any]]) -> str:
     try:
         logger.info(f"Generating intelligent response using text.pollinations.ai for {len(messages)} messages")
         
-        # Extract the user's actual message content
-        user_message = ""
-        for msg in messages:
-            if msg.get("role") == "user":
-                content = msg.get("content", "")
-                if isinstance(content, str):
-                    user_message = content
-                elif isinstance(content, list):
-                    # Handle OpenAI format with content array
-                    for item in content:
-                        if isinstance(item, dict) and item.get("type") == "text":
-                            user_message = item.get("text", "")
-                            break
-                break
-        
+        user_message = extract_user_message(messages)
         logger.info(f"Extracted user message: {user_message}")
         
         # Check if user wants verbatim speech
@@ -219,33 +745,8 @@ def generate_text_response(messages: List[Dict[str, Any]]) -> str:
         
         # For other requests, use text.pollinations.ai for intelligent responses
         if user_message.strip():
-            # Prepare payload for text.pollinations.ai
-            payload = {
-                "model": os.getenv("MODEL", "openai"),
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are a helpful, intelligent, and conversational AI assistant. Provide thoughtful, accurate, and engaging responses to user questions and requests. Be natural, friendly, and informative in your communication style."
-                    },
-                    {
-                        "role": "user",
-                        "content": user_message
-                    }
-                ],
-                "temperature": 0.7,
-                "stream": False,
-                "private": True,
-                "token": os.getenv("POLLI_TOKEN"),
-                "referrer": os.getenv("REFERRER", "simple-audio-service"),
-                "max_tokens": 1024,
-                "seed": random.randint(1000, 9999)
-            }
-            
             # Make request to text.pollinations.ai
-            response = requests.post("https://text.pollinations.ai/openai", json=payload, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = llm_client.chat_completion(build_llm_payload(user_message), cache=LLM_SEED is not None)
             generated_text = data["choices"][0]["message"]["content"]
             
             logger.info(f"Generated intelligent response: {generated_text[:100]}...")
@@ -262,39 +763,621 @@ def generate_text_response(messages: List[Dict[str, Any]]) -> str:
             return verbatim_text
         return "I encountered an error while generating a response. Please try again."
 
-def speech_to_text(audio_bytes: bytes) -> str:
-    """Convert speech to text"""
+def stream_text_response(messages: List[Dict[str, Any]]) -> Iterator[str]:
+    """Yield the text response in pieces as text.pollinations.ai generates it"""
+    user_message = extract_user_message(messages)
+    
+    # Verbatim and empty requests are answered without the upstream, as in generate_text_response
+    if not user_message.strip() or "say verbatim:" in user_message.lower():
+        yield generate_text_response(messages)
+        return
+    
+    emitted = False
     try:
-        # Save audio to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-            temp_file.write(audio_bytes)
-            temp_audio_path = temp_file.name
+        # Closing the stream on the way out frees its upstream slot when the reader stops early
+        with llm_client.stream_chat_completion(build_llm_payload(user_message)) as chunks:
+            for chunk in chunks:
+                choices = chunk.get("choices") or [{}]
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    emitted = True
+                    yield content
+    except Exception as e:
+        logger.error(f"Response streaming error: {e}")
+        if not emitted:
+            yield "I encountered an error while generating a response. Please try again."
+
+def pipeline_text_to_speech(text_deltas: Iterator[str], voice: str = "alloy", voice_reference_audio: Optional[bytes] = None, seed: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None, stop_signal: Optional[threading.Event] = None, timings: Optional[RequestTimings] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    Overlap text generation and speech synthesis: every complete sentence of the streamed text is queued for TTS
+    while the rest of the text is still being generated.
+    
+    Yields ("text", str) events as text arrives, ("audio", np.ndarray) chunks in sentence order and ("error", Exception)
+    events for sentences that could not be synthesized. Setting stop_signal, or closing the iterator, stops the text
+    stream and cancels every queued and running sentence. The upstream LLM and TTS stages are recorded in timings.
+    """
+    from boson_multimodal.serve.utils import StreamingParagraphSplitter
+    if timings is None:
+        timings = RequestTimings()
+    events = queue.Queue()
+    units = queue.Queue()
+    stop = stop_signal if stop_signal is not None else threading.Event()
+    
+    def feed_text():
+        splitter = StreamingParagraphSplitter(str.split, **TTS_SPLITTER_KWARGS)
+        
+        def submit(unit_texts: List[str]):
+            for unit_text in unit_texts:
+                try:
+                    # The request was admitted as a whole, its later sentences are not shed
+                    units.put(stream_text_to_speech(
+                        unit_text,
+                        voice=voice,
+                        voice_reference_audio=voice_reference_audio,
+                        seed=seed,
+                        priority=priority,
+                        deadline=deadline,
+                        enforce_slo=False,
+                        stop_signal=stop,
+                        timings=timings
+                    ))
+                except Exception as e:
+                    events.put(("error", e))
         
+        llm_start = time.monotonic()
         try:
-            # Transcribe audio
-            result = stt_model.transcribe(temp_audio_path)
-            transcription = result["text"].strip()
-            logger.info(f"Transcribed: {transcription}")
-            return transcription
+            for delta in text_deltas:
+                if stop.is_set():
+                    break
+                timings.mark("llm_first_token")
+                events.put(("text", delta))
+                submit(splitter.push(delta))
+            if not stop.is_set():
+                submit(splitter.flush())
+        except Exception as e:
+            events.put(("error", e))
         finally:
-            # Clean up temp file
-            if os.path.exists(temp_audio_path):
-                os.unlink(temp_audio_path)
-                
+            timings.add("llm", time.monotonic() - llm_start)
+            units.put(None)
+            events.put(("text_done", None))
+    
+    def pump_audio():
+        # Audio is forwarded one sentence at a time so chunks stay in order
+        try:
+            while not stop.is_set():
+                audio_chunks = units.get()
+                if audio_chunks is None:
+                    break
+                try:
+                    for audio_chunk in audio_chunks:
+                        if stop.is_set():
+                            break
+                        events.put(("audio", audio_chunk))
+                except Exception as e:
+                    events.put(("error", e))
+                finally:
+                    audio_chunks.close()
+        finally:
+            # Let go of the sentences that will not be played, shared generations only stop with their last listener
+            while True:
+                try:
+                    audio_chunks = units.get_nowait()
+                except queue.Empty:
+                    break
+                if audio_chunks is not None:
+                    audio_chunks.close()
+            events.put(("audio_done", None))
+    
+    threading.Thread(target=feed_text, name="tts-pipeline-text", daemon=True).start()
+    threading.Thread(target=pump_audio, name="tts-pipeline-audio", daemon=True).start()
+    
+    try:
+        num_running = 2
+        while num_running:
+            kind, value = events.get()
+            if kind in ("text_done", "audio_done"):
+                num_running -= 1
+            else:
+                yield kind, value
+    finally:
+        stop.set()
+
+def speech_to_text(audio_bytes: bytes, language: Optional[str] = None) -> str:
+    """Convert speech to text"""
+    try:
+        transcription = stt_service.transcribe(audio_bytes, language=language)
+        logger.info(f"Transcribed: {transcription}")
+        return transcription
+    except SchedulerQueueFullError:
+        raise
     except Exception as e:
         logger.error(f"STT error: {e}")
         raise RuntimeError(f"Speech-to-text failed: {e}")
 
+def speech_to_text_batch(clips: List[bytes]) -> List[Optional[str]]:
+    """Transcribe several clips in one batch, returning None for clips that could not be processed"""
+    pending = []
+    for audio_bytes in clips:
+        try:
+            pending.append(stt_service.submit(audio_bytes))
+        except Exception as e:
+            logger.error(f"STT error: {e}")
+            pending.append(None)
+    
+    transcriptions = []
+    for transcription_request in pending:
+        try:
+            transcriptions.append(transcription_request.result() if transcription_request else None)
+        except Exception as e:
+            logger.error(f"STT error: {e}")
+            transcriptions.append(None)
+    return transcriptions
+
+def client_disconnected() -> bool:
+    """Whether the client of the current request has closed its connection"""
+    # Only the Werkzeug server exposes the connection; elsewhere a disconnect surfaces when the response is written
+    sock = request.environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # The request body has been read, so a readable connection without data left has been closed
+        return bool(readable) and not sock.recv(1, socket.MSG_PEEK)
+    except ValueError:
+        # TLS sockets cannot peek
+        return False
+    except OSError:
+        return True
+
+def parse_scheduling_options(data: Dict[str, Any]) -> Tuple[int, Optional[float]]:
+    """Read the priority class and deadline of a request from the X-Priority / X-Deadline-Ms headers or the body"""
+    priority_name = request.headers.get("X-Priority") or data.get("priority") or "interactive"
+    if priority_name not in PRIORITY_CLASSES:
+        raise ValueError(f"'priority' must be one of {', '.join(PRIORITY_CLASSES)}")
+    
+    # Deadlines are relative to the arrival of the request
+    deadline_ms = request.headers.get("X-Deadline-Ms") or data.get("deadline_ms")
+    deadline = None
+    if deadline_ms is not None:
+        try:
+            deadline = time.monotonic() + float(deadline_ms) / 1000
+        except (TypeError, ValueError):
+            raise ValueError("'deadline_ms' must be a number of milliseconds")
+    return PRIORITY_CLASSES[priority_name], deadline
+
+def overloaded_response(e: SchedulerQueueFullError):
+    """429 with Retry-After when the latency objective would be missed, 503 when a queue is full"""
+    logger.warning(f"Rejecting request: {e}")
+    if isinstance(e, AdmissionRejectedError):
+        response = jsonify({"error": {"message": str(e), "type": "rate_limit_exceeded"}})
+        response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+        return response, 429
+    return jsonify({"error": {"message": str(e), "type": "server_overloaded"}}), 503
+
+def is_registered_voice(voice: str) -> bool:
+    """Whether a voice name refers to a voice in the registry"""
+    return voice_registry is not None and voice_registry.exists(voice)
+
+def parse_request_body() -> Tuple[Dict[str, Any], Dict[str, bytes]]:
+    """
+    Parameters and binary audio parts of a request. multipart/form-data requests carry the JSON parameters in a
+    "request" field and audio as file parts, referenced from the JSON by part name ({"file": "<name>"}) instead of
+    base64 "data".
+    """
+    if request.mimetype == "multipart/form-data":
+        if "request" not in request.form:
+            raise ValueError("Multipart requests need a 'request' field with the JSON parameters")
+        try:
+            data = json.loads(request.form["request"])
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON in the 'request' field: {e}")
+        return data, {name: part.read() for name, part in request.files.items()}
+    return request.get_json(force=True), {}
+
+def resolve_audio(source: Dict[str, Any], files: Dict[str, bytes]) -> Optional[bytes]:
+    """Audio bytes referenced by multipart part name ("file") or inlined as base64 ("data")"""
+    if source.get("file"):
+        if source["file"] not in files:
+            raise ValueError(f"Missing multipart part '{source['file']}'")
+        return files[source["file"]]
+    if source.get("data"):
+        return decode_base64_audio(source["data"])
+    return None
+
+def wants_multipart_response() -> bool:
+    """Whether the client asked for JSON plus binary audio parts (Accept: multipart/mixed) instead of base64"""
+    return request.accept_mimetypes.best_match(["application/json", "multipart/mixed"]) == "multipart/mixed"
+
+def multipart_mixed_response(parts: List[Tuple[Dict[str, str], bytes]]) -> Response:
+    """multipart/mixed response of (headers, body) parts, written without copying the bodies into one buffer"""
+    boundary = os.urandom(16).hex()
+    chunks = []
+    for headers, body in parts:
+        head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        chunks.append(f"--{boundary}\r\n{head}Content-Length: {len(body)}\r\n\r\n".encode("utf-8"))
+        chunks.append(body)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode("utf-8"))
+    response = Response(chunks, mimetype="multipart/mixed")
+    response.headers["Content-Type"] = f"multipart/mixed; boundary={boundary}"
+    response.headers["Content-Length"] = str(sum(len(chunk) for chunk in chunks))
+    return response
+
+def parse_audio_config(audio_config: Dict[str, Any], files: Optional[Dict[str, bytes]] = None) -> Tuple[str, Optional[bytes]]:
+    """Extract the voice and optional voice cloning reference audio (audio.data or an audio.file part) from a request's audio config"""
+    voice = audio_config.get("voice_id") or audio_config.get("voice", "alloy")
+    voice_reference_audio = None
+    
+    # Check if voice cloning data is provided in audio.data or as a multipart part
+    if "data" in audio_config or "file" in audio_config:
+        try:
+            voice_reference_audio = resolve_audio(audio_config, files or {})
+            logger.info(f"Voice cloning requested with {len(voice_reference_audio)} bytes of reference audio")
+        except Exception as e:
+            logger.error(f"Failed to decode voice reference audio: {e}")
+            # Continue with default voice if reference audio is invalid
+    
+    return voice, voice_reference_audio
+
+def stream_chat_completion(completion_id: str, model: str, events: Iterator[Tuple[str, Any]], timings: Optional[RequestTimings] = None, sample_rate: Optional[int] = None) -> Iterator[str]:
+    """
+    Yield OpenAI-style chat.completion.chunk server-sent events, with text as content deltas and audio as base64 pcm16
+    deltas, resampled to sample_rate if given. With timings, the last chunk carries the latency breakdown of the request.
+    """
+    def chunk_event(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra: Any) -> str:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(os.path.getmtime(__file__)),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "delta": delta,
+                "finish_reason": finish_reason
+            }],
+            **extra
+        }
+        return f"data: {json.dumps(chunk)}\n\n"
+    
+    yield chunk_event({"role": "assistant", "content": ""})
+    
+    audio_id = f"audio_{os.urandom(8).hex()}"
+    # One encoder for the whole reply, so that the resampler carries over from one sentence to the next
+    encoder = open_audio_encoder("pcm", sample_rate)
+    
+    def audio_event(pcm16: bytes) -> str:
+        return chunk_event({"audio": {"id": audio_id, "data": base64.b64encode(pcm16).decode('utf-8'), "format": "pcm16"}})
+    
+    for kind, value in events:
+        if kind == "text":
+            yield chunk_event({"content": value})
+        elif kind == "audio":
+            pcm16 = encoder.push(value)
+            if pcm16:
+                yield audio_event(pcm16)
+        elif kind == "error":
+            PARTIAL_ERRORS.inc(endpoint="/v1/chat/completions")
+            logger.error(f"Audio streaming error: {value}")
+            yield f"data: {json.dumps({'error': {'message': str(value), 'type': 'server_error'}})}\n\n"
+    pcm16 = encoder.finish()
+    if pcm16:
+        yield audio_event(pcm16)
+    
+    if timings is not None:
+        yield chunk_event({}, finish_reason="stop", timings=timings.as_dict())
+    else:
+        yield chunk_event({}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+@app.before_request
+def require_ready():
+    """Answer 503 with Retry-After until the models are loaded and warmed up"""
+    if startup_state != "ready" and request.path not in STARTUP_EXEMPT_PATHS:
+        response = jsonify({"error": {"message": f"Service is starting ({startup_state})", "type": "server_unavailable"}})
+        response.headers["Retry-After"] = "10"
+        return response, 503
+
+@app.before_request
+def start_timings():
+    g.timings = RequestTimings()
+    # Labels the handler in a running profiler capture, which counts API requests only
+    if request.path not in STARTUP_EXEMPT_PATHS and not request.path.startswith("/admin/"):
+        g.profiled_request = profiler_capture.begin_request(f"flask.{request.endpoint or 'unmatched'}")
+
+@app.teardown_request
+def end_profiled_request(error: Optional[BaseException]):
+    """Close the profiler label of the request, after the last chunk for responses streamed with their context"""
+    profiler_capture.end_request(g.pop("profiled_request", None))
+
+@app.after_request
+def report_timings(response: Response) -> Response:
+    """Send the stages timed so far as Server-Timing, and log and record the full breakdown once the response is done"""
+    timings = g.get("timings")
+    if timings is None or request.path in ("/health", "/metrics"):
+        return response
+    response.headers["Server-Timing"] = timings.server_timing()
+    # Streamed responses are still running here, their later stages only make it into the log line and the metrics
+    method, path, status = request.method, request.path, response.status_code
+    # The route pattern keeps the endpoint label bounded, unlike paths with ids in them
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    # The body is parsed (or cached) here, the request context is gone once a streamed response closes
+    request_body = request_body_for_record() if flight_recorder is not None else None
+
+    def on_close():
+        durations = timings.as_dict()
+        logger.info("request_timings " + json.dumps({"method": method, "path": path, "status": status, "timings": durations}))
+        REQUEST_DURATION.observe(durations["total"] / 1000, endpoint=endpoint, status=status)
+        if status >= 400:
+            REQUEST_ERRORS.inc(endpoint=endpoint, status=status)
+        if "first_audio" in durations:
+            TIME_TO_FIRST_AUDIO.observe(durations["first_audio"] / 1000, endpoint=endpoint)
+        if "stream_codec_decode" in durations:
+            TTS_CODEC_DECODE.observe(durations["stream_codec_decode"] / 1000, mode="stream")
+        if flight_recorder is not None:
+            request_info = {"method": method, "path": path, "status": status, "request": request_body, "timings": durations}
+            flight_recorder.finish(timings, durations["total"] / 1000, request_info, engine_state=engine_state_snapshot)
+
+    response.call_on_close(on_close)
+    return response
+
+def request_body_for_record() -> Any:
+    """The request parameters for a flight record, with base64 audio reduced to its hash unless FLIGHT_RECORDER_AUDIO=full"""
+    if request.mimetype == "multipart/form-data":
+        body = {"form": request.form.to_dict(), "files": {name: file.filename for name, file in request.files.items()}}
+    else:
+        body = request.get_json(silent=True)
+    return sanitize_request_body(body, audio=flight_recorder.audio)
+
+def engine_state_snapshot() -> Dict[str, Any]:
+    """The scheduler and KV cache state at the end of a recorded request"""
+    if tts_scheduler is None:
+        return {}
+    return {"scheduler": tts_scheduler.stats(), "kv_cache": tts_scheduler.kv_cache_stats()}
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type=metrics.content_type)
+
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    """Liveness probe, ok as long as the process serves requests"""
+    return jsonify({"status": "ok"})
+
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    """Readiness probe, ok once the models are loaded and warmed up"""
+    status = {"status": "ok" if startup_state == "ready" else startup_state, "startup": startup_timings.as_dict()}
+    return jsonify(status), 200 if startup_state == "ready" else 503
+
 @app.route("/health", methods=["GET"])
 def health():
-    """Health endpoint"""
-    return jsonify({"status": "ok"})
+    """Health endpoint, with the readiness status and the state of every component"""
+    status = {"status": "ok" if startup_state == "ready" else startup_state}
+    if STAND_IN_PROFILE:
+        status["stand_in_profile"] = STAND_IN_PROFILE
+    if tts_scheduler is not None:
+        status["tts_queue"] = tts_scheduler.stats()
+    if tts_scheduler is not None:
+        status["tts_kv_cache"] = tts_scheduler.kv_cache_stats()
+    if tts_cache is not None:
+        status["tts_cache"] = tts_cache.stats()
+    if tts_coalescer is not None:
+        status["tts_coalescing"] = tts_coalescer.stats()
+    if result_store is not None:
+        status["result_store"] = result_store.stats()
+    if audio_encoder_pool is not None:
+        status["audio_encoders"] = audio_encoder_pool.stats()
+    if flight_recorder is not None:
+        status["flight_recorder"] = flight_recorder.stats()
+    if stt_service is not None:
+        status["stt_queue"] = stt_service.stats()
+    status["llm_upstream"] = llm_client.stats()
+    return jsonify(status), 200 if startup_state == "ready" else 503
+
+def admin_required(view):
+    """Restrict an endpoint to requests with the admin token in an `Authorization: Bearer` header"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if ADMIN_TOKEN is None:
+            return jsonify({"error": {"message": "Not found", "type": "invalid_request_error"}}), 404
+        authorization = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {ADMIN_TOKEN}".encode("utf-8")):
+            response = jsonify({"error": {"message": "Invalid admin token", "type": "authentication_error"}})
+            response.headers["WWW-Authenticate"] = "Bearer"
+            return response, 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route("/admin/profiler", methods=["POST"])
+@admin_required
+def start_profiler_capture():
+    """Arm torch.profiler for the next "seconds" or the next "requests" API requests, whichever ends first"""
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = data.get("seconds")
+        requests_limit = data.get("requests")
+        capture = profiler_capture.start(
+            seconds=float(seconds) if seconds is not None else None,
+            requests=int(requests_limit) if requests_limit is not None else None,
+            with_stack=bool(data.get("with_stack", True))
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": {"message": str(e), "type": "invalid_request_error"}}), 400
+    except ProfilerBusyError as e:
+        return jsonify({"error": {"message": str(e), "type": "invalid_request_error"}}), 409
+    except ProfilerUnavailableError as e:
+        return jsonify({"error": {"message": str(e), "type": "server_error"}}), 501
+    return jsonify(profiler_capture_object(asdict(capture))), 202
+
+@app.route("/admin/profiler", methods=["GET"])
+@admin_required
+def list_profiler_captures():
+    """List the running and past profiler captures, latest first"""
+    return jsonify({"object": "list", "data": [profiler_capture_object(capture) for capture in profiler_capture.captures()]})
+
+@app.route("/admin/profiler/<capture_id>/<artifact>", methods=["GET"])
+@admin_required
+def profiler_capture_file(capture_id: str, artifact: str):
+    """Download the Chrome/Perfetto trace ("trace") or the top-operators summary ("summary") of a finished capture"""
+    capture = profiler_capture.get(capture_id)
+    path = None
+    if capture is not None and artifact == "trace":
+        path, mimetype = capture.trace_path, "application/json"
+    elif capture is not None and artifact == "summary":
+        path, mimetype = capture.summary_path, "text/plain"
+    if path is None:
+        return jsonify({"error": {"message": f"No {artifact} for capture '{capture_id}'", "type": "invalid_request_error"}}), 404
+    return send_file(os.path.abspath(path), mimetype=mimetype, max_age=0)
+
+def profiler_capture_object(capture: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON object for a profiler capture, with the download URLs in place of the server-side paths"""
+    capture = dict(capture)
+    for artifact in ("trace", "summary"):
+        path = capture.pop(f"{artifact}_path")
+        capture[f"{artifact}_url"] = url_for("profiler_capture_file", capture_id=capture["id"], artifact=artifact) if path else None
+    return capture
+
+def voice_object(profile) -> Dict[str, Any]:
+    """OpenAI-style JSON object for a registered voice"""
+    return {
+        "id": profile.id,
+        "object": "voice",
+        "name": profile.name,
+        "created_at": profile.created_at,
+        "duration": round(profile.duration, 3)
+    }
+
+@app.route("/v1/voices", methods=["POST"])
+def create_voice():
+    """Register a cloned voice from a reference clip (multipart 'file' or JSON base64 'data')"""
+    try:
+        if "file" in request.files:
+            audio_bytes = request.files["file"].read()
+            name = request.form.get("name")
+        else:
+            data = request.get_json(force=True, silent=True) or {}
+            if not data.get("data"):
+                return jsonify({"error": {"message": "Missing reference audio: upload 'file' or send base64 'data'", "type": "invalid_request_error"}}), 400
+            audio_bytes = decode_base64_audio(data["data"])
+            name = data.get("name")
+        
+        profile = voice_registry.create(audio_bytes, name=name)
+        return jsonify(voice_object(profile)), 201
+        
+    except Exception as e:
+        logger.error(f"Voice registration error: {e}")
+        return jsonify({"error": {"message": str(e), "type": "server_error"}}), 500
+
+@app.route("/v1/voices", methods=["GET"])
+def list_voices():
+    """List the registered voices"""
+    return jsonify({"object": "list", "data": [voice_object(profile) for profile in voice_registry.list()]})
+
+@app.route("/v1/voices/<voice_id>", methods=["GET"])
+def get_voice(voice_id: str):
+    """Look up a registered voice"""
+    profile = voice_registry.get(voice_id)
+    if profile is None:
+        return jsonify({"error": {"message": f"Unknown voice '{voice_id}'", "type": "invalid_request_error"}}), 404
+    return jsonify(voice_object(profile))
+
+@app.route("/v1/voices/<voice_id>", methods=["DELETE"])
+def delete_voice(voice_id: str):
+    """Delete a registered voice"""
+    if not voice_registry.delete(voice_id):
+        return jsonify({"error": {"message": f"Unknown voice '{voice_id}'", "type": "invalid_request_error"}}), 404
+    return jsonify({"id": voice_id, "object": "voice.deleted", "deleted": True})
+
+@app.route("/v1/batches", methods=["POST"])
+def create_batch():
+    """Queue an offline TTS batch from a JSONL file of speech jobs (multipart 'file' or the raw request body)"""
+    try:
+        if "file" in request.files:
+            data = request.files["file"].read()
+            metadata = json.loads(request.form["metadata"]) if request.form.get("metadata") else None
+        else:
+            data = request.get_data()
+            metadata = None
+        batch = tts_batches.create(data, metadata=metadata)
+    except ValueError as e:
+        return jsonify({"error": {"message": str(e), "type": "invalid_request_error"}}), 400
+    return jsonify(batch), 201
+
+@app.route("/v1/batches", methods=["GET"])
+def list_batches():
+    """List the batches"""
+    return jsonify({"object": "list", "data": tts_batches.list()})
+
+@app.route("/v1/batches/<batch_id>", methods=["GET"])
+def get_batch(batch_id: str):
+    """Look up a batch and its progress"""
+    batch = tts_batches.get(batch_id)
+    if batch is None:
+        return jsonify({"error": {"message": f"Unknown batch '{batch_id}'", "type": "invalid_request_error"}}), 404
+    return jsonify(batch)
+
+@app.route("/v1/batches/<batch_id>/cancel", methods=["POST"])
+def cancel_batch(batch_id: str):
+    """Cancel a queued or running batch"""
+    batch = tts_batches.cancel(batch_id)
+    if batch is None:
+        return jsonify({"error": {"message": f"Unknown batch '{batch_id}'", "type": "invalid_request_error"}}), 404
+    return jsonify(batch)
+
+@app.route("/v1/batches/<batch_id>/results", methods=["GET"])
+def batch_results(batch_id: str):
+    """Download the results manifest of a batch (JSONL, one line per finished job)"""
+    if not tts_batches.exists(batch_id):
+        return jsonify({"error": {"message": f"Unknown batch '{batch_id}'", "type": "invalid_request_error"}}), 404
+    path = tts_batches.results_path(batch_id)
+    if path is None:
+        return Response("", mimetype="application/jsonl")
+    return send_file(path, mimetype="application/jsonl", max_age=0)
+
+@app.route("/v1/batches/<batch_id>/audio/<file_name>", methods=["GET"])
+def batch_audio(batch_id: str, file_name: str):
+    """Download a generated file of a batch"""
+    path = tts_batches.audio_path(batch_id, file_name)
+    if path is None:
+        return jsonify({"error": {"message": f"Unknown file '{file_name}'", "type": "invalid_request_error"}}), 404
+    return send_file(path, mimetype="audio/wav")
+
+@app.route("/v1/audio/transcriptions", methods=["POST"])
+def audio_transcriptions():
+    """OpenAI Audio Transcriptions API compatible endpoint (multipart upload of the audio file)"""
+    try:
+        audio_file = request.files.get("file")
+        if audio_file is None:
+            return jsonify({"error": {"message": "Missing required 'file' parameter", "type": "invalid_request_error"}}), 400
+        
+        language = request.form.get("language") or None
+        response_format = request.form.get("response_format", "json")
+        if response_format not in ("json", "text"):
+            return jsonify({"error": {"message": f"Unsupported response_format '{response_format}'", "type": "invalid_request_error"}}), 400
+        
+        with g.timings.stage("stt"):
+            transcription = speech_to_text(audio_file.read(), language=language)
+        
+        if response_format == "text":
+            return Response(transcription, mimetype="text/plain")
+        return jsonify({"text": transcription})
+        
+    except SchedulerQueueFullError as e:
+        return overloaded_response(e)
+    except Exception as e:
+        logger.error(f"Transcription error: {e}")
+        return jsonify({"error": {"message": str(e), "type": "server_error"}}), 500
 
 @app.route("/v1/chat/completions", methods=["POST"])
 def chat_completions():
     """OpenAI Chat Completions API compatible endpoint with multimodal audio support"""
     try:
-        data = request.get_json(force=True)
+        try:
+            with g.timings.stage("parse"):
+                data, files = parse_request_body()
+        except ValueError as e:
+            return jsonify({"error": {"message": str(e), "type": "invalid_request_error"}}), 400
         
         # Extract parameters
         messages = data.get("messages", [])
@@ -304,46 +1387,150 @@ def chat_completions():
         
         if not messages:
             return jsonify({"error": {"message": "Missing required 'messages' parameter", "type": "invalid_request_error"}}), 400
+        try:
+            priority, deadline = parse_scheduling_options(data)
+            output_rate = parse_output_sample_rate(audio_config.get("sample_rate"))
+        except ValueError as e:
+            return jsonify({"error": {"message": str(e), "type": "invalid_request_error"}}), 400
+        audio_format = audio_config.get("format", "wav")
+        if "audio" in modalities and audio_format not in CHAT_AUDIO_FORMATS:
+            return jsonify({"error": {"message": f"Unsupported audio format '{audio_format}'", "type": "invalid_request_error"}}), 400
         
         # Process the conversation and prepare messages for text generation
-        processed_messages = []
+        message_parts = []
+        # Audio clips from all messages are transcribed together: (content_parts, index, audio_bytes)
+        audio_inputs = []
         
         # Process all messages for context
         for msg in messages:
-            processed_msg = {"role": msg.get("role", "user"), "content": ""}
+            content_parts = []
             
             content = msg.get("content")
             if isinstance(content, str):
                 # Simple text content
-                processed_msg["content"] = content
+                content_parts.append(content)
             elif isinstance(content, list):
-                # Multimodal content - extract text and transcribe audio
-                content_parts = []
-                
+                # Multimodal content - extract text and collect audio for transcription
                 for item in content:
                     if item.get("type") == "text":
                         content_parts.append(item.get("text", ""))
                     elif item.get("type") == "input_audio":
                         # Handle audio input by transcribing it (OpenAI format)
                         input_audio = item.get("input_audio", {})
-                        audio_data = input_audio.get("data")
-                        if audio_data:
+                        if input_audio.get("data") or input_audio.get("file"):
                             try:
-                                audio_bytes = base64.b64decode(audio_data)
-                                transcription = speech_to_text(audio_bytes)
-                                content_parts.append(f"[Audio transcription: {transcription}]")
-                                logger.info(f"Transcribed input audio: {transcription}")
+                                with g.timings.stage("audio_decode"):
+                                    audio_bytes = resolve_audio(input_audio, files)
+                                audio_inputs.append((content_parts, len(content_parts), audio_bytes))
+                                content_parts.append("")
                             except Exception as e:
                                 logger.error(f"Audio processing error: {e}")
                                 content_parts.append("[Audio could not be processed]")
-                
-                processed_msg["content"] = " ".join(content_parts)
             
+            message_parts.append((msg.get("role", "user"), content_parts))
+        
+        if audio_inputs:
+            with g.timings.stage("stt"):
+                transcriptions = speech_to_text_batch([audio_bytes for _, _, audio_bytes in audio_inputs])
+            for (content_parts, index, _), transcription in zip(audio_inputs, transcriptions):
+                if transcription is None:
+                    content_parts[index] = "[Audio could not be processed]"
+                else:
+                    content_parts[index] = f"[Audio transcription: {transcription}]"
+                    logger.info(f"Transcribed input audio: {transcription}")
+        
+        processed_messages = []
+        for role, content_parts in message_parts:
+            processed_msg = {"role": role, "content": " ".join(content_parts)}
             if processed_msg["content"].strip():
                 processed_messages.append(processed_msg)
         
-        # Generate intelligent text response using Pollinations AI
-        response_text = generate_text_response(processed_messages)
+        completion_id = f"chatcmpl-{os.urandom(16).hex()}"
+        # Set when the client goes away, cancels the response's pending and running generations
+        stop_signal = threading.Event()
+        
+        # With audio, the reply is streamed from Pollinations AI and synthesized sentence by sentence as it arrives
+        if "audio" in modalities:
+            # Shed the request up front rather than after the response has started
+            tts_scheduler.check_admission(priority)
+            # Extract voice and voice cloning data from audio config
+            with g.timings.stage("audio_decode"):
+                voice, voice_reference_audio = parse_audio_config(audio_config, files)
+            events = pipeline_text_to_speech(
+                stream_text_response(processed_messages),
+                voice=voice,
+                voice_reference_audio=voice_reference_audio,
+                seed=data.get("seed"),
+                priority=priority,
+                deadline=deadline,
+                stop_signal=stop_signal,
+                timings=g.timings
+            )
+        elif data.get("stream", False):
+            events = (("text", delta) for delta in stream_text_response(processed_messages))
+        else:
+            events = None
+        
+        # Stream text and incremental audio chunks as server-sent events
+        if data.get("stream", False):
+            response = Response(
+                stream_with_context(stream_chat_completion(completion_id, model, events, timings=g.timings if data.get("timings") else None, sample_rate=output_rate)),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+            # Called once the stream is done, or aborted by a failed write to a disconnected client
+            response.call_on_close(stop_signal.set)
+            return response
+        
+        if events is None:
+            # Generate intelligent text response using Pollinations AI
+            with g.timings.stage("llm"):
+                response_text = generate_text_response(processed_messages)
+            audio_bytes = None
+            stored_audio = None
+        else:
+            text_parts, errors = [], []
+            disconnected = False
+            
+            def audio_events() -> Iterator[np.ndarray]:
+                nonlocal disconnected
+                for kind, value in events:
+                    if client_disconnected():
+                        disconnected = True
+                        stop_signal.set()
+                        return
+                    if kind == "text":
+                        text_parts.append(value)
+                    elif kind == "audio":
+                        yield value
+                    else:
+                        PARTIAL_ERRORS.inc(endpoint="/v1/chat/completions")
+                        logger.error(f"Audio generation error: {value}")
+                        errors.append(value)
+            
+            # Encode the per-sentence audio in order as it is generated, in memory or straight into the result store
+            output_format = CHAT_AUDIO_FORMATS[audio_format]
+            encoder = open_audio_encoder(output_format, output_rate)
+            audio_bytes = None
+            stored_audio = None
+            if audio_config.get("delivery") == "url":
+                pending = result_store.open(output_format)
+                try:
+                    if write_audio_stream(pending.file, encoder, audio_events(), g.timings):
+                        stored_audio = pending.commit()
+                finally:
+                    pending.discard()
+            else:
+                buffer = io.BytesIO()
+                if write_audio_stream(buffer, encoder, audio_events(), g.timings):
+                    audio_bytes = buffer.getvalue()
+            if disconnected:
+                logger.info(f"Client disconnected, cancelling {completion_id}")
+                return Response(status=499)
+            response_text = "".join(text_parts).strip()
+            overloaded = [e for e in errors if isinstance(e, SchedulerQueueFullError)]
+            if audio_bytes is None and stored_audio is None and overloaded:
+                return overloaded_response(overloaded[0])
         
         # Generate response
         response_message = {
@@ -351,36 +1538,21 @@ def chat_completions():
             "content": response_text
         }
         
-        # Generate audio if requested
-        if "audio" in modalities:
-            try:
-                # Extract voice and voice cloning data from audio config
-                voice = audio_config.get("voice", "alloy")
-                voice_reference_audio = None
-                
-                # Check if voice cloning data is provided in audio.data
-                if "data" in audio_config:
-                    try:
-                        voice_reference_audio = decode_base64_audio(audio_config["data"])
-                        logger.info(f"Voice cloning requested with {len(voice_reference_audio)} bytes of reference audio")
-                    except Exception as e:
-                        logger.error(f"Failed to decode voice reference audio: {e}")
-                        # Continue with default voice if reference audio is invalid
-                
-                # Generate audio with optional voice cloning
-                audio_bytes = text_to_speech(response_text, voice=voice, voice_reference_audio=voice_reference_audio)
-                audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
-                response_message["audio"] = {
-                    "data": audio_b64,
-                    "format": audio_config.get("format", "wav")
-                }
-            except Exception as e:
-                logger.error(f"Audio generation error: {e}")
-                # Continue without audio if generation fails
+        # Continue without audio if generation fails
+        if audio_bytes is not None:
+            response_message["audio"] = {"format": audio_format}
+            if wants_multipart_response():
+                # Sent as a binary part of the response instead of base64 in the JSON
+                response_message["audio"]["file"] = "audio"
+            else:
+                response_message["audio"]["data"] = base64.b64encode(audio_bytes).decode('utf-8')
+        elif stored_audio is not None:
+            # Fetched from the result store with range requests
+            response_message["audio"] = stored_audio_object(stored_audio, audio_format)
         
         # Return OpenAI-compatible response
-        return jsonify({
-            "id": f"chatcmpl-{os.urandom(16).hex()}",
+        completion = {
+            "id": completion_id,
             "object": "chat.completion",
             "created": int(os.path.getmtime(__file__)),
             "model": model,
@@ -394,12 +1566,137 @@ def chat_completions():
                 "completion_tokens": len(response_text),
                 "total_tokens": len(str(processed_messages)) + len(response_text)
             }
-        })
+        }
+        if data.get("timings"):
+            completion["timings"] = g.timings.as_dict()
+        if wants_multipart_response():
+            parts = [({"Content-Type": "application/json"}, json.dumps(completion).encode("utf-8"))]
+            if audio_bytes is not None:
+                output_format = CHAT_AUDIO_FORMATS[audio_format]
+                parts.append(({"Content-Type": AUDIO_CONTENT_TYPES[output_format], "Content-Disposition": f'attachment; name="audio"; filename="audio.{output_format}"'}, audio_bytes))
+            return multipart_mixed_response(parts)
+        return jsonify(completion)
             
+    except SchedulerQueueFullError as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Chat completion error: {e}")
         return jsonify({"error": {"message": str(e), "type": "server_error"}}), 500
 
+# Chat audio.format -> encoder format
+CHAT_AUDIO_FORMATS = {
+    "wav": "wav",
+    "pcm16": "pcm",
+    "flac": "flac",
+    "mp3": "mp3",
+    "opus": "opus",
+    "aac": "aac",
+}
+
+@app.route("/v1/audio/speech", methods=["POST"])
+def audio_speech():
+    """OpenAI Audio Speech API compatible endpoint, skips text generation and returns raw audio bytes"""
+    try:
+        with g.timings.stage("parse"):
+            data = request.get_json(force=True)
+        
+        text = data.get("input", "")
+        voice = data.get("voice_id") or data.get("voice", "alloy")
+        response_format = data.get("response_format", "mp3")
+        speed = float(data.get("speed", 1.0))
+        
+        if not text.strip():
+            return jsonify({"error": {"message": "Missing required 'input' parameter", "type": "invalid_request_error"}}), 400
+        if response_format not in AUDIO_CONTENT_TYPES:
+            return jsonify({"error": {"message": f"Unsupported response_format '{response_format}'", "type": "invalid_request_error"}}), 400
+        if not 0.25 <= speed <= 4.0:
+            return jsonify({"error": {"message": "'speed' must be between 0.25 and 4.0", "type": "invalid_request_error"}}), 400
+        if voice.startswith("voice_") and not is_registered_voice(voice):
+            return jsonify({"error": {"message": f"Unknown voice '{voice}'", "type": "invalid_request_error"}}), 404
+        try:
+            priority, deadline = parse_scheduling_options(data)
+            output_rate = parse_output_sample_rate(data.get("sample_rate"))
+        except ValueError as e:
+            return jsonify({"error": {"message": str(e), "type": "invalid_request_error"}}), 400
+        
+        # Opened before the generation is submitted, so that an encoder failure has no generation to clean up
+        encoder = open_audio_encoder(response_format, output_rate)
+        # Set when the client goes away, cancels the generation
+        stop_signal = threading.Event()
+        try:
+            audio_chunks = stream_text_to_speech(text, voice=voice, speed=speed, seed=data.get("seed"), priority=priority, deadline=deadline, stop_signal=stop_signal, timings=g.timings)
+        except BaseException:
+            encoder.close()
+            raise
+        
+        if data.get("delivery") == "url":
+            # Written to the result store as it is generated, the response only carries its URL
+            disconnected = False
+            
+            def connected_audio_chunks() -> Iterator[np.ndarray]:
+                nonlocal disconnected
+                try:
+                    for audio_chunk in audio_chunks:
+                        # Nothing is sent before the end, so a client that hung up is only noticed by polling
+                        if client_disconnected():
+                            disconnected = True
+                            stop_signal.set()
+                            return
+                        yield audio_chunk
+                finally:
+                    audio_chunks.close()
+            
+            pending = result_store.open(response_format)
+            stored_audio = None
+            try:
+                if write_audio_stream(pending.file, encoder, connected_audio_chunks(), g.timings) and not disconnected:
+                    stored_audio = pending.commit()
+            finally:
+                pending.discard()
+            if disconnected:
+                logger.info("Client disconnected, cancelled the speech generation")
+                return Response(status=499)
+            if stored_audio is None:
+                return jsonify({"error": {"message": "The generation produced no audio", "type": "server_error"}}), 500
+            result = dict(stored_audio_object(stored_audio, response_format), object="audio.result")
+            if data.get("timings"):
+                result["timings"] = g.timings.as_dict()
+            return jsonify(result)
+        
+        # Every format is streamed with chunked transfer encoding, encoded frames are sent as the engine produces audio
+        def generate_bytes():
+            try:
+                yield from encode_audio_stream(encoder, audio_chunks, g.timings)
+            except Exception:
+                # The status line is long gone, the client sees a truncated stream
+                PARTIAL_ERRORS.inc(endpoint="/v1/audio/speech")
+                raise
+        
+        response = Response(stream_with_context(generate_bytes()), content_type=encoder.content_type)
+        response.call_on_close(stop_signal.set)
+        # The stream may be dropped before it was ever iterated
+        response.call_on_close(encoder.close)
+        return response
+        
+    except SchedulerQueueFullError as e:
+        return overloaded_response(e)
+    except DeadlineExceededError as e:
+        logger.warning(f"Speech generation missed its deadline: {e}")
+        return jsonify({"error": {"message": str(e), "type": "deadline_exceeded"}}), 504
+    except Exception as e:
+        logger.error(f"Speech generation error: {e}")
+        return jsonify({"error": {"message": str(e), "type": "server_error"}}), 500
+
+@app.route("/v1/audio/results/<file_name>", methods=["GET"])
+def get_audio_result(file_name: str):
+    """Serve a stored audio file with range request support"""
+    path = result_store.path(file_name)
+    if path is None:
+        return jsonify({"error": {"message": f"Unknown or expired audio result '{file_name}'", "type": "invalid_request_error"}}), 404
+    content_type = AUDIO_CONTENT_TYPES.get(file_name.rsplit(".", 1)[1], "application/octet-stream")
+    # conditional=True answers Range requests with 206; servers providing wsgi.file_wrapper send the file with sendfile
+    return send_file(path, mimetype=content_type, conditional=True, max_age=int(result_store.ttl))
+
 @app.errorhandler(404)
 def not_found(e):
     return jsonify({"error": "Endpoint not found"}), 404
@@ -411,8 +1708,8 @@ def internal_error(e):
 if __name__ == "__main__":
     logger.info("Starting Simple Audio Service...")
     
-    # Load models on startup
-    load_models()
+    # Load models in the background, /health/ready reports when they are warmed up
+    threading.Thread(target=load_and_warm_up, name="model-loader", daemon=True).start()
     
     # Start server
     host = "0.0.0.0"
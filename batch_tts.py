@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import requests
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+def load_state(output_dir):
+    path = os.path.join(output_dir, "batch.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(output_dir, batch):
+    path = os.path.join(output_dir, "batch.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(batch, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def submit_batch(server, input_path):
+    with open(input_path, "rb") as f:
+        response = requests.post(f"{server}/v1/batches", files={"file": f}, timeout=300)
+    if response.status_code != 201:
+        raise RuntimeError(f"Batch rejected ({response.status_code}): {response.text}")
+    return response.json()
+
+
+def download_results(server, batch_id, output_dir):
+    """Download the files of the jobs finished so far, skipping the ones already on disk"""
+    response = requests.get(f"{server}/v1/batches/{batch_id}/results", timeout=60)
+    response.raise_for_status()
+    results = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+
+    audio_dir = os.path.join(output_dir, "audio")
+    os.makedirs(audio_dir, exist_ok=True)
+    for result in results:
+        if result["status"] != "completed":
+            continue
+        path = os.path.join(audio_dir, result["file"])
+        if not os.path.exists(path):
+            audio = requests.get(f"{server}/v1/batches/{batch_id}/audio/{result['file']}", timeout=60)
+            audio.raise_for_status()
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(audio.content)
+            os.replace(f"{path}.tmp", path)
+        result["file"] = os.path.join("audio", result["file"])
+
+    with open(os.path.join(output_dir, "results.jsonl"), "w") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    return results
+
+
+def run_batch(server, input_path, output_dir, poll_interval, restart):
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Resume the batch of a previous run instead of submitting the file again
+    batch = None if restart else load_state(output_dir)
+    if batch is not None and batch.get("input") == os.path.abspath(input_path):
+        print(f"↻ Resuming batch {batch['id']}")
+    else:
+        batch = submit_batch(server, input_path)
+        batch["input"] = os.path.abspath(input_path)
+        save_state(output_dir, batch)
+        print(f"✅ Submitted batch {batch['id']} with {batch['request_counts']['total']} jobs")
+
+    while True:
+        response = requests.get(f"{server}/v1/batches/{batch['id']}", timeout=30)
+        response.raise_for_status()
+        batch.update(response.json())
+        save_state(output_dir, batch)
+
+        download_results(server, batch["id"], output_dir)
+        counts = batch["request_counts"]
+        print(f"  {batch['status']}: {counts['completed']} completed, {counts['failed']} failed of {counts['total']}")
+        if batch["status"] in TERMINAL_STATUSES:
+            break
+        time.sleep(poll_interval)
+
+    print(f"📁 Results written to {os.path.join(output_dir, 'results.jsonl')}")
+    return batch["status"] == "completed" and batch["request_counts"]["failed"] == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Synthesize a JSONL file of TTS jobs through the /v1/batches API",
+        epilog='Each line is {"custom_id": ..., "input": ..., "voice": ..., "speed": ..., "seed": ...}',
+    )
+    parser.add_argument("input", help="JSONL file of jobs")
+    parser.add_argument("output_dir", help="Directory for the audio files and results.jsonl")
+    parser.add_argument("--server", default="http://localhost:8000", help="Service base URL")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="Seconds between progress checks")
+    parser.add_argument("--restart", action="store_true", help="Submit a new batch instead of resuming the last one")
+    args = parser.parse_args()
+
+    try:
+        success = run_batch(args.server.rstrip("/"), args.input, args.output_dir, args.poll_interval, args.restart)
+    except (requests.RequestException, RuntimeError) as e:
+        print(f"❌ {e}")
+        success = False
+    sys.exit(0 if success else 1)
@@ -294,22 +294,27 @@ class HiggsAudioTokenizer(nn.Module):
         return EncodedResult(codes)
 
     def decode(self, vq_code: torch.Tensor) -> torch.Tensor:
-        vq_code = vq_code.to(self.device)
+        with torch.autograd.profiler.record_function("HiggsAudioTokenizer.decode"):
+            vq_code = vq_code.to(self.device)
 
-        if self.quantizer_type == "RVQ":
-            vq_code = vq_code.permute(1, 0, 2)
-            quantized = self.quantizer.decode(vq_code)
-            quantized = quantized.transpose(1, 2)
-        else:
-            vq_code = vq_code.permute(0, 2, 1)
-            quantized = self.quantizer.get_output_from_indices(vq_code)
-        quantized_acoustic = self.fc_post2(quantized).transpose(1, 2)
+            if self.quantizer_type == "RVQ":
+                vq_code = vq_code.permute(1, 0, 2)
+                quantized = self.quantizer.decode(vq_code)
+                quantized = quantized.transpose(1, 2)
+            else:
+                vq_code = vq_code.permute(0, 2, 1)
+                quantized = self.quantizer.get_output_from_indices(vq_code)
+            quantized_acoustic = self.fc_post2(quantized).transpose(1, 2)
 
-        o = self.decoder_2(quantized_acoustic)
-        return o.detach().cpu().numpy()
+            o = self.decoder_2(quantized_acoustic)
+            return o.detach().cpu().numpy()
 
 
-def load_higgs_audio_tokenizer(tokenizer_name_or_path, device="cuda"):
+def load_higgs_audio_tokenizer(tokenizer_name_or_path, device="cuda", load_weights=True):
+    """
+    Load the audio tokenizer. With load_weights=False, the module is only allocated on the meta device, for weights
+    that are assigned afterwards (e.g. memory-mapped by `serve.shared_weights`).
+    """
     is_local = os.path.exists(tokenizer_name_or_path)
     if not is_local:
         tokenizer_path = snapshot_download(tokenizer_name_or_path)
@@ -318,6 +323,13 @@ def load_higgs_audio_tokenizer(tokenizer_name_or_path, device="cuda"):
     config_path = os.path.join(tokenizer_path, "config.json")
     model_path = os.path.join(tokenizer_path, "model.pth")
     config = json.load(open(config_path))
+    if not load_weights:
+        with torch.device("meta"):
+            model = HiggsAudioTokenizer(
+                **config,
+                device=device,
+            )
+        return model.eval()
     model = HiggsAudioTokenizer(
         **config,
         device=device,
@@ -1,18 +1,20 @@
 """Basic data types for multimodal ChatML format."""
 
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 
 @dataclass
 class AudioContent:
     audio_url: str
-    # Base64 encoded audio bytes
-    raw_audio: Optional[str] = None
+    # Base64 encoded audio bytes, or the encoded audio bytes themselves
+    raw_audio: Optional[Union[str, bytes]] = None
     offset: Optional[float] = None
     duration: Optional[float] = None
     row_id: Optional[int] = None
     type: str = "audio"
+    # Precomputed audio tokenizer codes (num_codebooks, num_frames), used instead of loading and encoding the audio
+    audio_codes: Optional[Any] = None
 
 
 @dataclass
@@ -7,7 +7,7 @@ import glob
 import functools
 import os
 from collections import defaultdict, OrderedDict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from safetensors.torch import load_file
 from typing import Optional, Tuple, Union, List, Dict, Any
@@ -791,6 +791,64 @@ class HiggsAudioGenerationOutput(ModelOutput):
     past_key_values: Optional[Tuple[Tuple[Tuple[torch.FloatTensor]]]] = None
 
 
+@dataclass
+class HiggsAudioDecodeState:
+    """
+    Decoding state of a single sequence during HiggsAudio generation.
+
+    `_sample()` keeps one state for the sequence it generates. A serving engine can keep several states, each with its
+    own KV cache buckets, and advance them one token at a time with `HiggsAudioModel._decode_step()`.
+
+    Args:
+        input_ids (`torch.LongTensor` of shape `(1, sequence_length)`):
+            The prompt and the generated text tokens. Only one <|AUDIO_OUT|> token is kept per audio segment.
+        input_ids_full (`torch.LongTensor` of shape `(1, sequence_length)`):
+            The prompt and all generated tokens, including every <|AUDIO_OUT|> placeholder.
+        model_kwargs (`dict`):
+            The model specific kwargs forwarded to `forward()`, updated after every step.
+        past_key_values_buckets (`OrderedDict[int, Cache]`, *optional*):
+            The KV cache buckets owned by this sequence.
+        current_past_key_values_bucket (`int`, *optional*):
+            The bucket currently holding the sequence's KV cache.
+        cur_len (`int`):
+            The number of positions written to the KV cache.
+        generation_mode (`GenerationMode`):
+            The generation mode of the last decoding step.
+        num_delay (`int`):
+            The number of codebooks that have left the audio stream bos delay.
+        num_remaining_delays (`int`, *optional*):
+            The number of steps left to flush the delay pattern after the audio stream eos was sampled.
+        audio_sequences (`list(torch.LongTensor)`):
+            The generated audio codes, one tensor of shape `(num_codebooks, length)` per audio segment.
+        num_generated_tokens (`int`):
+            The number of decoding steps taken so far.
+    """
+
+    input_ids: torch.LongTensor
+    input_ids_full: torch.LongTensor
+    model_kwargs: Dict[str, Any]
+    logits_processor: LogitsProcessorList
+    stopping_criteria: StoppingCriteriaList
+    generation_config: GenerationConfig
+    past_key_values_buckets: Optional[OrderedDict[int, Cache]] = None
+    current_past_key_values_bucket: Optional[int] = None
+    streamer: Optional[Any] = None
+    torch_generator: Optional[torch.Generator] = None
+    cur_len: int = 0
+    unfinished_sequences: Optional[torch.LongTensor] = None
+    this_peer_finished: bool = False
+    init_model_input: bool = True
+    generation_mode: GenerationMode = GenerationMode.TEXT
+    num_delay: int = 0
+    num_remaining_delays: Optional[int] = None
+    audio_sequences: List[torch.LongTensor] = field(default_factory=list)
+    num_generated_tokens: int = 0
+    scores: Optional[Tuple[torch.FloatTensor]] = None
+    raw_logits: Optional[Tuple[torch.FloatTensor]] = None
+    decoder_attentions: Optional[Tuple[Tuple[torch.FloatTensor]]] = None
+    decoder_hidden_states: Optional[Tuple[Tuple[torch.FloatTensor]]] = None
+
+
 class HiggsAudioModel(HiggsAudioPreTrainedModel, GenerationMixin):
     """Higgs-Audio is an end-to-end multimodal model with the capability to understand and generate text / audio.
 
@@ -1334,30 +1392,32 @@ class HiggsAudioModel(HiggsAudioPreTrainedModel, GenerationMixin):
         # if it exists, otherwise use the normal forward pass
         if (
             past_key_values is not None
-            and past_key_values.get_max_cache_shape() in self.decode_graph_runners
+            and past_key_values in self.decode_graph_runners
             and (input_ids.shape[-1] == 1)
         ):
-            _forward_core = self.decode_graph_runners[past_key_values.get_max_cache_shape()][is_decoding_audio_token]
+            _forward_core = self.decode_graph_runners[past_key_values][is_decoding_audio_token]
             is_using_cuda_graph = True
         else:
             _forward_core = self._forward_core
             is_using_cuda_graph = False
 
-        hidden_states, all_hidden_states, all_self_attns = _forward_core(
-            hidden_states=hidden_states,
-            causal_mask=causal_mask,
-            position_ids=position_ids,
-            audio_discrete_codes_mask=audio_discrete_codes_mask,
-            is_decoding_audio_token=is_decoding_audio_token if use_static_cache else None,
-            cache_position=cache_position,
-            past_key_values=past_key_values,
-            use_cache=use_cache,
-            audio_attention_mask=audio_attention_mask if use_static_cache else None,
-            fast_forward_attention_mask=fast_forward_attention_mask if use_static_cache else None,
-            output_attentions=output_attentions,
-            output_hidden_states=output_hidden_states,
-            is_using_cuda_graph=is_using_cuda_graph,
-        )
+        # Labelled for on-demand profiler captures, the CUDA graph replays included
+        with torch.autograd.profiler.record_function("HiggsAudioModel._forward_core"):
+            hidden_states, all_hidden_states, all_self_attns = _forward_core(
+                hidden_states=hidden_states,
+                causal_mask=causal_mask,
+                position_ids=position_ids,
+                audio_discrete_codes_mask=audio_discrete_codes_mask,
+                is_decoding_audio_token=is_decoding_audio_token if use_static_cache else None,
+                cache_position=cache_position,
+                past_key_values=past_key_values,
+                use_cache=use_cache,
+                audio_attention_mask=audio_attention_mask if use_static_cache else None,
+                fast_forward_attention_mask=fast_forward_attention_mask if use_static_cache else None,
+                output_attentions=output_attentions,
+                output_hidden_states=output_hidden_states,
+                is_using_cuda_graph=is_using_cuda_graph,
+            )
         hidden_states = self.norm(hidden_states)
 
         # add hidden states from the last decoder layer
@@ -1619,6 +1679,269 @@ class HiggsAudioModel(HiggsAudioPreTrainedModel, GenerationMixin):
 
         return next_tokens, next_audio_tokens, next_token_logits, next_token_scores
 
+    def _init_decode_state(
+        self,
+        input_ids: torch.LongTensor,
+        logits_processor: LogitsProcessorList,
+        stopping_criteria: StoppingCriteriaList,
+        generation_config: GenerationConfig,
+        streamer: Optional["BaseStreamer"] = None,
+        past_key_values_buckets: Optional[OrderedDict[int, Cache]] = None,
+        **model_kwargs,
+    ) -> HiggsAudioDecodeState:
+        """Initialize the decoding state of a single sequence from its prompt.
+
+        The prompt itself is not processed here, the first call to `_decode_step()` runs the prefill.
+        """
+        assert input_ids.shape[0] == 1, "Each HiggsAudioDecodeState holds exactly one sequence"
+
+        # torch generator for sampling
+        seed = generation_config.generation_kwargs.get("seed", None)
+        if seed is not None:
+            torch_generator = torch.Generator(device=input_ids.device).manual_seed(seed)
+        else:
+            torch_generator = None
+
+        return_dict_in_generate = generation_config.return_dict_in_generate
+        if generation_config.use_cache:
+            model_kwargs["cache_audio_discrete_codes_mask"] = None
+
+        state = HiggsAudioDecodeState(
+            input_ids=input_ids,
+            # A tensor to keep track of all the audio placeholder tokens.
+            input_ids_full=input_ids.clone(),
+            model_kwargs=model_kwargs,
+            logits_processor=logits_processor,
+            stopping_criteria=stopping_criteria,
+            generation_config=generation_config,
+            past_key_values_buckets=past_key_values_buckets,
+            streamer=streamer,
+            torch_generator=torch_generator,
+            cur_len=input_ids.shape[1],
+            unfinished_sequences=torch.ones(input_ids.shape[0], dtype=torch.long, device=input_ids.device),
+            scores=() if (return_dict_in_generate and generation_config.output_scores) else None,
+            raw_logits=() if (return_dict_in_generate and generation_config.output_logits) else None,
+            decoder_attentions=() if (return_dict_in_generate and generation_config.output_attentions) else None,
+            decoder_hidden_states=() if (return_dict_in_generate and generation_config.output_hidden_states) else None,
+        )
+
+        # Initialize the audio variables based on the input prompt.
+        if input_ids[0][-1] == self.config.audio_out_token_idx:
+            state.audio_sequences = [model_kwargs["audio_out_ids"][:, model_kwargs["audio_out_ids_start"][-1] :]]
+            if self.use_delay_pattern:
+                state.num_delay = (
+                    self.audio_num_codebooks
+                    - (model_kwargs["audio_out_ids"][:, -1] == self.config.audio_stream_bos_id).sum()
+                )
+                all_eos_indices = (model_kwargs["audio_out_ids"][:, -1] == self.config.audio_stream_eos_id).nonzero()
+                if torch.numel(all_eos_indices) > 0:
+                    all_eos_indices = all_eos_indices[0]
+                    last_eos_idx = all_eos_indices[-1]
+                    state.num_remaining_delays = self.audio_num_codebooks - last_eos_idx - 1
+
+        return state
+
+    def _decode_step(self, state: HiggsAudioDecodeState, synced_gpus: bool = False) -> None:
+        """Run one forward pass for a single sequence and append the sampled text / audio tokens to its state.
+
+        Every sequence carries its own KV cache buckets, generation mode and delay-pattern counters, so a serving
+        engine can interleave the steps of several sequences and let them join or leave at token boundaries.
+        """
+        generation_config = state.generation_config
+        model_kwargs = state.model_kwargs
+        input_ids = state.input_ids
+        audio_out_bos_token_id = generation_config.generation_kwargs.get("audio_out_bos_token_id", None)
+        output_attentions = generation_config.output_attentions
+        output_hidden_states = generation_config.output_hidden_states
+        has_eos_stopping_criteria = any(hasattr(criteria, "eos_token_id") for criteria in state.stopping_criteria)
+
+        # Check which multimodal stage we are in
+        if input_ids[0][-1] == audio_out_bos_token_id:
+            generation_mode = GenerationMode.AUDIO_INIT
+        elif input_ids[0][-1] == self.audio_out_token_idx:
+            generation_mode = GenerationMode.AUDIO_IN_PROGRESS
+        else:
+            generation_mode = GenerationMode.TEXT
+        state.generation_mode = generation_mode
+
+        is_audio_generation_mode = generation_mode == GenerationMode.AUDIO_IN_PROGRESS
+
+        if state.init_model_input or not generation_config.use_cache:
+            model_inputs = {"input_ids": input_ids, **model_kwargs}
+        else:
+            model_inputs = {"input_ids": input_ids[:, -1:], **model_kwargs}
+
+            if is_audio_generation_mode and generation_config.use_cache:
+                model_inputs["audio_out_ids"] = model_kwargs["audio_out_ids"][:, -1:]
+                model_inputs["audio_out_ids_start"] = torch.tensor([0], dtype=torch.long, device=input_ids.device)
+            elif not is_audio_generation_mode:
+                del model_inputs["audio_out_ids"]
+                del model_inputs["audio_out_ids_start"]
+
+            if generation_config.use_cache:
+                if "audio_features" in model_inputs and model_inputs["audio_features"] is not None:
+                    model_inputs["audio_features"] = model_inputs["audio_features"][:0, ...]
+                    model_inputs["audio_feature_attention_mask"] = model_inputs["audio_feature_attention_mask"][
+                        :0, ...
+                    ]
+
+                if "audio_in_ids" in model_inputs and model_inputs["audio_in_ids"] is not None:
+                    model_inputs["audio_in_ids"] = None
+                    model_inputs["audio_in_ids_start"] = None
+
+        # prepare variable output controls (note: some models won't accept all output controls)
+        model_inputs.update({"output_attentions": output_attentions} if output_attentions else {})
+        model_inputs.update({"output_hidden_states": output_hidden_states} if output_hidden_states else {})
+
+        if state.past_key_values_buckets is not None:
+            past_key_values, state.current_past_key_values_bucket = self._prepare_kv_cache(
+                state.cur_len, state.current_past_key_values_bucket, state.past_key_values_buckets
+            )
+            if past_key_values is not None:
+                model_inputs.update({"past_key_values": past_key_values})
+            model_inputs["past_key_values_buckets"] = state.past_key_values_buckets
+
+        # forward pass to get next token
+        # forward() may promote the sequence to a larger bucket after merging the audio features.
+        self.current_past_key_values_bucket = state.current_past_key_values_bucket
+        outputs = self(**model_inputs, return_dict=True)
+        state.current_past_key_values_bucket = self.current_past_key_values_bucket
+
+        # Update the actual sequence length after the first forward pass
+        if state.init_model_input and state.past_key_values_buckets is not None:
+            state.cur_len = (
+                state.past_key_values_buckets[state.current_past_key_values_bucket].get_seq_length().item()
+            )
+
+        # synced_gpus: don't waste resources running the code we don't need; kwargs must be updated before skipping
+        model_kwargs = self._update_model_kwargs_for_generation(
+            outputs,
+            model_kwargs,
+            is_encoder_decoder=self.config.is_encoder_decoder,
+            extend_attention_mask=True,
+        )
+        state.model_kwargs = model_kwargs
+
+        # After the first forward pass, we can set init_model_input to False.
+        state.init_model_input = False
+
+        if synced_gpus and state.this_peer_finished:
+            return
+
+        if is_audio_generation_mode:
+            # In audio generation mode, we sample the audio tokens from audio logits.
+            # It might also generate the audio eos token to end the audio generation.
+            with torch.autograd.profiler.record_function("HiggsAudioModel._sample_audio_tokens"):
+                (
+                    next_tokens,
+                    next_audio_tokens,
+                    next_audio_token_logits,
+                    next_audio_token_scores,
+                    state.num_delay,
+                    state.num_remaining_delays,
+                ) = self._sample_audio_tokens(
+                    hidden_states=outputs.audio_hidden_states,
+                    audio_logits=outputs.audio_logits,
+                    audio_out_ids=model_kwargs["audio_out_ids"],
+                    do_sample=generation_config.do_sample,
+                    logits_processor=state.logits_processor,
+                    device=input_ids.device,
+                    torch_generator=state.torch_generator,
+                    generation_config=generation_config,
+                    num_delay=state.num_delay,
+                    num_remaining_delays=state.num_remaining_delays,
+                )
+
+            # update generated ids, model inputs, and length for next step
+            model_kwargs["audio_out_ids"] = torch.cat([model_kwargs["audio_out_ids"], next_audio_tokens[:, None]], dim=-1)
+            state.audio_sequences[-1] = torch.cat([state.audio_sequences[-1], next_audio_tokens[:, None]], dim=-1)
+
+            if state.streamer is not None:
+                state.streamer.put(next_audio_tokens.cpu())
+        else:
+            # In text generation mode, we sample the text tokens from text logits.
+            # It might also generate the audio placeholder token to start the audio generation.
+            next_tokens, next_audio_tokens, next_token_logits, next_token_scores = self._sample_text_tokens(
+                input_ids=input_ids,
+                logits=outputs.logits,
+                do_sample=generation_config.do_sample,
+                logits_processor=state.logits_processor,
+                device=input_ids.device,
+                generation_mode=generation_mode,
+                torch_generator=state.torch_generator,
+            )
+
+            if state.streamer is not None:
+                state.streamer.put(next_tokens.cpu())
+
+            if next_audio_tokens is not None:
+                # If the token is audio bos token, we will generate the audio placeholder token
+                # and the corrensponding audio stream bos token to start the audio generation.
+                state.audio_sequences.append(next_audio_tokens[:, None])
+                if state.streamer is not None:
+                    state.streamer.put(next_audio_tokens.cpu())
+                if model_kwargs["audio_out_ids"] is None or model_kwargs["audio_out_ids"].shape[0] == 0:
+                    # Initialize audio_out_ids
+                    model_kwargs["audio_out_ids"] = next_audio_tokens[:, None]
+                    model_kwargs["audio_out_ids_start"] = torch.tensor([0], dtype=torch.long, device=input_ids.device)
+                else:
+                    model_kwargs["audio_out_ids_start"] = torch.concat(
+                        [
+                            model_kwargs["audio_out_ids_start"],
+                            torch.tensor(
+                                [model_kwargs["audio_out_ids"].shape[1]], dtype=torch.long, device=input_ids.device
+                            ),
+                        ],
+                        dim=0,
+                    )
+                    model_kwargs["audio_out_ids"] = torch.concat(
+                        [model_kwargs["audio_out_ids"], next_audio_tokens[:, None]], dim=1
+                    )
+
+        if generation_config.return_dict_in_generate:
+            if generation_config.output_scores:
+                if is_audio_generation_mode:
+                    state.scores += (next_audio_token_scores,)
+                else:
+                    state.scores += (next_token_scores,)
+            if generation_config.output_logits:
+                if is_audio_generation_mode:
+                    state.raw_logits += (next_audio_token_logits,)
+                else:
+                    state.raw_logits += (next_token_logits,)
+            if output_attentions:
+                state.decoder_attentions += (outputs.attentions,)
+            if output_hidden_states:
+                state.decoder_hidden_states += (outputs.hidden_states,)
+
+        # finished sentences should have their next token be a padding token
+        if has_eos_stopping_criteria:
+            pad_token_id = generation_config._pad_token_tensor
+            next_tokens = next_tokens * state.unfinished_sequences + pad_token_id * (1 - state.unfinished_sequences)
+
+        if "tokenizer_length" in generation_config.generation_kwargs:
+            tokenizer_length = generation_config.generation_kwargs["tokenizer_length"]
+            if torch.max(next_tokens) >= tokenizer_length:
+                raise ValueError(
+                    f"Next generated token has max value {torch.max(next_tokens)} which is greater than the tokenizer's vocabulary size {tokenizer_length}, this is undesired behavior."
+                )
+
+        # update generated ids, model inputs, and length for next step
+        if not is_audio_generation_mode or next_tokens[0] != self.audio_out_token_idx:
+            # We only add one <|AUDIO_OUT|> token to the input_ids for simplicity.
+            state.input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
+        state.input_ids_full = torch.cat([state.input_ids_full, next_tokens[:, None]], dim=-1)
+        state.unfinished_sequences = state.unfinished_sequences & ~state.stopping_criteria(
+            state.input_ids_full, state.scores
+        )
+        state.this_peer_finished = state.unfinished_sequences.max() == 0
+        state.cur_len += 1
+        state.num_generated_tokens += 1
+
+        # This is needed to properly delete outputs.logits which may be very large for first iteration
+        # Otherwise a reference to outputs is kept which keeps the logits alive in the next iteration
+        del outputs
+
     # Built on top of GenerationMixin._sample.
     # We revise the implementation to support generating both audio / text.
     def _sample(
@@ -1644,6 +1967,10 @@ class HiggsAudioModel(HiggsAudioPreTrainedModel, GenerationMixin):
 
         Otherwise, we will keep generating the text tokens.
 
+        The loop body lives in `_decode_step()`, which advances a single `HiggsAudioDecodeState`. Serving engines that
+        interleave several requests drive `_init_decode_state()` / `_decode_step()` directly instead of calling
+        `generate()`.
+
         Parameters:
             input_ids (`torch.LongTensor` of shape `(batch_size, sequence_length)`):
                 The sequence used as a prompt for the generation.
@@ -1673,261 +2000,43 @@ class HiggsAudioModel(HiggsAudioPreTrainedModel, GenerationMixin):
             `model.config.is_encoder_decoder=True`.
         """
         assert input_ids.shape[0] == 1, "Only support batch_size=1 in _sample()"
-        audio_out_bos_token_id = generation_config.generation_kwargs.get("audio_out_bos_token_id", None)
-
-        # torch generator for sampling
-        seed = generation_config.generation_kwargs.get("seed", None)
-        if seed is not None:
-            torch_generator = torch.Generator(device=input_ids.device).manual_seed(seed)
-        else:
-            torch_generator = None
-
-        # init values
-        pad_token_id = generation_config._pad_token_tensor
-        output_attentions = generation_config.output_attentions
-        output_hidden_states = generation_config.output_hidden_states
-        output_scores = generation_config.output_scores
-        output_logits = generation_config.output_logits
-        return_dict_in_generate = generation_config.return_dict_in_generate
-        max_length = generation_config.max_length
-        has_eos_stopping_criteria = any(hasattr(criteria, "eos_token_id") for criteria in stopping_criteria)
-        do_sample = generation_config.do_sample
-        # Used to track which past_key_va
+        # Used to track which past_key_values bucket the sequence is using
         self.current_past_key_values_bucket = None
 
-        # init attention / hidden states / scores tuples
-        scores = () if (return_dict_in_generate and output_scores) else None
-        raw_logits = () if (return_dict_in_generate and output_logits) else None
-
-        decoder_attentions = () if (return_dict_in_generate and output_attentions) else None
-        decoder_hidden_states = () if (return_dict_in_generate and output_hidden_states) else None
-
-        # keep track of which sequences are already finished
-        batch_size, cur_len = input_ids.shape
-        this_peer_finished = False
-        unfinished_sequences = torch.ones(batch_size, dtype=torch.long, device=input_ids.device)
-        if generation_config.use_cache:
-            model_kwargs["cache_audio_discrete_codes_mask"] = None
-
-        init_model_input = True
-        num_delay = 0
-        num_remaining_delays = None
-        audio_sequences = []
-        # A tensor to keep track of all the audio placeholder tokens.
-        input_ids_full = input_ids.clone()
-
-        # Initialize the audio variables based on the input prompt.
-        if input_ids[0][-1] == self.config.audio_out_token_idx:
-            audio_sequences = [model_kwargs["audio_out_ids"][:, model_kwargs["audio_out_ids_start"][-1] :]]
-            if self.use_delay_pattern:
-                num_delay = (
-                    self.audio_num_codebooks
-                    - (model_kwargs["audio_out_ids"][:, -1] == self.config.audio_stream_bos_id).sum()
-                )
-                all_eos_indices = (model_kwargs["audio_out_ids"][:, -1] == self.config.audio_stream_eos_id).nonzero()
-                if torch.numel(all_eos_indices) > 0:
-                    all_eos_indices = all_eos_indices[0]
-                    last_eos_idx = all_eos_indices[-1]
-                    num_remaining_delays = self.audio_num_codebooks - last_eos_idx - 1
+        state = self._init_decode_state(
+            input_ids,
+            logits_processor=logits_processor,
+            stopping_criteria=stopping_criteria,
+            generation_config=generation_config,
+            streamer=streamer,
+            past_key_values_buckets=past_key_values_buckets,
+            **model_kwargs,
+        )
 
         while self._has_unfinished_sequences(
-            this_peer_finished, synced_gpus, device=input_ids.device, cur_len=cur_len, max_length=max_length
+            state.this_peer_finished,
+            synced_gpus,
+            device=input_ids.device,
+            cur_len=state.cur_len,
+            max_length=generation_config.max_length,
         ):
-            # Check which multimodal stage we are in
-            # FIXME: Assume single input generation
-            if input_ids[0][-1] == audio_out_bos_token_id:
-                generation_mode = GenerationMode.AUDIO_INIT
-            elif input_ids[0][-1] == self.audio_out_token_idx:
-                generation_mode = GenerationMode.AUDIO_IN_PROGRESS
-            else:
-                generation_mode = GenerationMode.TEXT
-
-            is_audio_generation_mode = generation_mode == GenerationMode.AUDIO_IN_PROGRESS
-
-            if init_model_input or not generation_config.use_cache:
-                model_inputs = {"input_ids": input_ids, **model_kwargs}
-            else:
-                model_inputs = {"input_ids": input_ids[:, -1:], **model_kwargs}
-
-                if is_audio_generation_mode and generation_config.use_cache:
-                    model_inputs["audio_out_ids"] = model_kwargs["audio_out_ids"][:, -1:]
-                    model_inputs["audio_out_ids_start"] = torch.tensor([0], dtype=torch.long, device=input_ids.device)
-                elif not is_audio_generation_mode:
-                    del model_inputs["audio_out_ids"]
-                    del model_inputs["audio_out_ids_start"]
-
-                if generation_config.use_cache:
-                    if "audio_features" in model_inputs and model_inputs["audio_features"] is not None:
-                        model_inputs["audio_features"] = model_inputs["audio_features"][:0, ...]
-                        model_inputs["audio_feature_attention_mask"] = model_inputs["audio_feature_attention_mask"][
-                            :0, ...
-                        ]
-
-                    if "audio_in_ids" in model_inputs and model_inputs["audio_in_ids"] is not None:
-                        model_inputs["audio_in_ids"] = None
-                        model_inputs["audio_in_ids_start"] = None
-
-            # prepare variable output controls (note: some models won't accept all output controls)
-            model_inputs.update({"output_attentions": output_attentions} if output_attentions else {})
-            model_inputs.update({"output_hidden_states": output_hidden_states} if output_hidden_states else {})
-
-            if past_key_values_buckets is not None:
-                past_key_values, self.current_past_key_values_bucket = self._prepare_kv_cache(
-                    cur_len, self.current_past_key_values_bucket, past_key_values_buckets
-                )
-                if past_key_values is not None:
-                    model_inputs.update({"past_key_values": past_key_values})
-                model_inputs["past_key_values_buckets"] = past_key_values_buckets
-
-            # forward pass to get next token
-            outputs = self(**model_inputs, return_dict=True)
-
-            # Update the actual sequence length after the first forward pass
-            if init_model_input and past_key_values_buckets is not None:
-                cur_len = past_key_values_buckets[self.current_past_key_values_bucket].get_seq_length().item()
-
-            # synced_gpus: don't waste resources running the code we don't need; kwargs must be updated before skipping
-            model_kwargs = self._update_model_kwargs_for_generation(
-                outputs,
-                model_kwargs,
-                is_encoder_decoder=self.config.is_encoder_decoder,
-                extend_attention_mask=True,
-            )
-
-            # After the first forward pass, we can set init_model_input to False.
-            init_model_input = False
-
-            if synced_gpus and this_peer_finished:
-                continue
-
-            if is_audio_generation_mode:
-                # In audio generation mode, we sample the audio tokens from audio logits.
-                # It might also generate the audio eos token to end the audio generation.
-                (
-                    next_tokens,
-                    next_audio_tokens,
-                    next_audio_token_logits,
-                    next_audio_token_scores,
-                    num_delay,
-                    num_remaining_delays,
-                ) = self._sample_audio_tokens(
-                    hidden_states=outputs.audio_hidden_states,
-                    audio_logits=outputs.audio_logits,
-                    audio_out_ids=model_kwargs["audio_out_ids"],
-                    do_sample=do_sample,
-                    logits_processor=logits_processor,
-                    device=input_ids.device,
-                    torch_generator=torch_generator,
-                    generation_config=generation_config,
-                    num_delay=num_delay,
-                    num_remaining_delays=num_remaining_delays,
-                )
-
-                # update generated ids, model inputs, and length for next step
-                model_kwargs["audio_out_ids"] = torch.cat(
-                    [model_kwargs["audio_out_ids"], next_audio_tokens[:, None]], dim=-1
-                )
-                audio_sequences[-1] = torch.cat([audio_sequences[-1], next_audio_tokens[:, None]], dim=-1)
-
-                if streamer is not None:
-                    streamer.put(next_audio_tokens.cpu())
-            else:
-                # In text generation mode, we sample the text tokens from text logits.
-                # It might also generate the audio placeholder token to start the audio generation.
-                next_tokens, next_audio_tokens, next_token_logits, next_token_scores = self._sample_text_tokens(
-                    input_ids=input_ids,
-                    logits=outputs.logits,
-                    do_sample=do_sample,
-                    logits_processor=logits_processor,
-                    device=input_ids.device,
-                    generation_mode=generation_mode,
-                    torch_generator=torch_generator,
-                )
-
-                if streamer is not None:
-                    streamer.put(next_tokens.cpu())
-
-                if next_audio_tokens is not None:
-                    # If the token is audio bos token, we will generate the audio placeholder token
-                    # and the corrensponding audio stream bos token to start the audio generation.
-                    audio_sequences.append(next_audio_tokens[:, None])
-                    if streamer is not None:
-                        streamer.put(next_audio_tokens.cpu())
-                    if model_kwargs["audio_out_ids"] is None or model_kwargs["audio_out_ids"].shape[0] == 0:
-                        # Initialize audio_out_ids
-                        model_kwargs["audio_out_ids"] = next_audio_tokens[:, None]
-                        model_kwargs["audio_out_ids_start"] = torch.tensor(
-                            [0], dtype=torch.long, device=input_ids.device
-                        )
-                    else:
-                        model_kwargs["audio_out_ids_start"] = torch.concat(
-                            [
-                                model_kwargs["audio_out_ids_start"],
-                                torch.tensor(
-                                    [model_kwargs["audio_out_ids"].shape[1]], dtype=torch.long, device=input_ids.device
-                                ),
-                            ],
-                            dim=0,
-                        )
-                        model_kwargs["audio_out_ids"] = torch.concat(
-                            [model_kwargs["audio_out_ids"], next_audio_tokens[:, None]], dim=1
-                        )
-
-            if return_dict_in_generate:
-                if output_scores:
-                    if is_audio_generation_mode:
-                        scores += (next_audio_token_scores,)
-                    else:
-                        scores += (next_token_scores,)
-                if output_logits:
-                    if is_audio_generation_mode:
-                        raw_logits += (next_audio_token_logits,)
-                    else:
-                        raw_logits += (next_token_logits,)
-                if output_attentions:
-                    decoder_attentions += (outputs.attentions,)
-                if output_hidden_states:
-                    decoder_hidden_states += (outputs.hidden_states,)
-
-            # finished sentences should have their next token be a padding token
-            if has_eos_stopping_criteria:
-                next_tokens = next_tokens * unfinished_sequences + pad_token_id * (1 - unfinished_sequences)
-
-            if "tokenizer_length" in generation_config.generation_kwargs:
-                tokenizer_length = generation_config.generation_kwargs["tokenizer_length"]
-                if torch.max(next_tokens) >= tokenizer_length:
-                    raise ValueError(
-                        f"Next generated token has max value {torch.max(next_tokens)} which is greater than the tokenizer's vocabulary size {tokenizer_length}, this is undesired behavior."
-                    )
-
-            # update generated ids, model inputs, and length for next step
-            if not is_audio_generation_mode or next_tokens[0] != self.audio_out_token_idx:
-                # We only add one <|AUDIO_OUT|> token to the input_ids for simplicity.
-                input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
-            input_ids_full = torch.cat([input_ids_full, next_tokens[:, None]], dim=-1)
-            unfinished_sequences = unfinished_sequences & ~stopping_criteria(input_ids_full, scores)
-            this_peer_finished = unfinished_sequences.max() == 0
-            cur_len += 1
-
-            # This is needed to properly delete outputs.logits which may be very large for first iteration
-            # Otherwise a reference to outputs is kept which keeps the logits alive in the next iteration
-            del outputs
+            self._decode_step(state, synced_gpus=synced_gpus)
 
         if streamer is not None:
             streamer.end()
 
-        if return_dict_in_generate:
+        if generation_config.return_dict_in_generate:
             return HiggsAudioGenerationOutput(
-                sequences=input_ids,
-                audio_sequences=audio_sequences,
-                scores=scores,
-                logits=raw_logits,
-                attentions=decoder_attentions,
-                hidden_states=decoder_hidden_states,
-                past_key_values=model_kwargs.get("past_key_values"),
+                sequences=state.input_ids,
+                audio_sequences=state.audio_sequences,
+                scores=state.scores,
+                logits=state.raw_logits,
+                attentions=state.decoder_attentions,
+                hidden_states=state.decoder_hidden_states,
+                past_key_values=state.model_kwargs.get("past_key_values"),
             )
         else:
-            return input_ids, audio_sequences
+            return state.input_ids, state.audio_sequences
 
     @torch.inference_mode()
     def generate(
@@ -1955,7 +2064,8 @@ class HiggsAudioModel(HiggsAudioPreTrainedModel, GenerationMixin):
         """
         # Right now, it's a very simplified version of generate, we should revisit this after our model architecture stabilizes.
         assert input_ids.shape[0] == 1, (
-            "Currently HiggsAudioModel.generate() only supports batch_size=1. See the implementation of "
+            "Currently HiggsAudioModel.generate() only supports batch_size=1. To interleave several sequences, "
+            "advance one HiggsAudioDecodeState per sequence with _decode_step(), as HiggsAudioServeEngine does."
         )
         generation_config, kwargs = self._prepare_generation_config(kwargs.pop("generation_config", None), **kwargs)
         if audio_out_bos_token_id is not None:
@@ -2242,6 +2352,9 @@ class HiggsAudioModel(HiggsAudioPreTrainedModel, GenerationMixin):
     def capture_model(self, past_key_values: list[Union[Cache, List[torch.FloatTensor]]]) -> None:
         """Capture CUDA graphs for the model's forward pass with different KV cache lengths.
 
+        A captured graph writes into the cache it was captured with, so the runners are keyed by the cache object and
+        every KV cache that will be decoded with (e.g. one set of buckets per serving slot) needs its own capture.
+
         Args:
             past_key_values: List of KV caches to capture graphs for
         """
@@ -2286,4 +2399,4 @@ class HiggsAudioModel(HiggsAudioPreTrainedModel, GenerationMixin):
                     stream=torch.cuda.Stream(device=self.device),
                 )
 
-                self.decode_graph_runners[kv_cache_length][is_decoding_audio_token] = runner
+                self.decode_graph_runners[past_key_value][is_decoding_audio_token] = runner
@@ -0,0 +1,617 @@
+import hashlib
+import io
+import math
+import queue
+import struct
+import subprocess
+import threading
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+# Response format -> content type
+AUDIO_CONTENT_TYPES = {
+    "pcm": "audio/pcm",
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "mp3": "audio/mpeg",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+}
+
+# Formats encoded by an ffmpeg process -> (ffmpeg muxer, ffmpeg encoder)
+PROCESS_FORMATS = {
+    "mp3": ("mp3", "libmp3lame"),
+    "opus": ("ogg", "libopus"),
+    "aac": ("adts", "aac"),
+}
+
+# Output sample rates audio can be resampled to, the telephony rates and the usual codec rates
+AUDIO_SAMPLE_RATES = (8000, 16000, 24000, 48000)
+
+
+class Pcm16Converter:
+    """Converts float PCM chunks in [-1, 1] to 16-bit PCM, reusing its buffers from one chunk to the next."""
+
+    def __init__(self):
+        self._scratch = np.empty(0, dtype=np.float32)
+        self._pcm = np.empty(0, dtype="<i2")
+
+    def convert(self, audio: np.ndarray) -> np.ndarray:
+        """Return the chunk as little-endian int16, a view into a buffer that is overwritten by the next call."""
+        num_samples = len(audio)
+        if len(self._scratch) < num_samples:
+            self._scratch = np.empty(num_samples, dtype=np.float32)
+            self._pcm = np.empty(num_samples, dtype="<i2")
+        scratch = self._scratch[:num_samples]
+        np.clip(audio, -1.0, 1.0, out=scratch)
+        np.multiply(scratch, 32767.0, out=scratch)
+        pcm = self._pcm[:num_samples]
+        np.copyto(pcm, scratch, casting="unsafe")
+        return pcm
+
+
+class StreamingResampler:
+    """
+    Polyphase windowed-sinc resampler fed chunk by chunk. Streaming a waveform through it gives the same samples as
+    resampling it at once, and the filter delay is compensated, so the output lines up with the input.
+    Args:
+        input_rate (int):
+            The sample rate of the pushed audio.
+        output_rate (int):
+            The sample rate of the returned audio.
+        zero_crossings (int):
+            Half-width of the low-pass filter, in zero crossings of its sinc. Wider filters have a sharper cutoff.
+        rolloff (float):
+            Cutoff of the filter as a fraction of the lower Nyquist frequency, leaving room for the transition band.
+    """
+
+    def __init__(self, input_rate: int, output_rate: int, zero_crossings: int = 16, rolloff: float = 0.94):
+        divisor = math.gcd(input_rate, output_rate)
+        self.input_rate = input_rate
+        self.output_rate = output_rate
+        self.up = output_rate // divisor
+        self.down = input_rate // divisor
+        factor = max(self.up, self.down)
+        # Filter in the upsampled domain, split into `up` phases of `taps` coefficients
+        self.taps = -(-(2 * zero_crossings * factor + 1) // self.up)
+        length = self.taps * self.up
+        # Keep the filter at an odd length, zero-padding the last tap, so its center and the delay fall on a sample
+        support = length - 1 + length % 2
+        cutoff = rolloff * 0.5 / factor
+        self._delay = (support - 1) // 2
+        offsets = np.arange(support) - self._delay
+        kernel = np.zeros(length)
+        kernel[:support] = 2 * cutoff * np.sinc(2 * cutoff * offsets) * np.kaiser(support, 8.6)
+        kernel *= self.up / kernel.sum()
+        self._phases = kernel.reshape(self.taps, self.up).T.astype(np.float32)
+        # Input samples still needed, starting at absolute index _start; zeros stand for the samples before the stream
+        self._buffer = np.zeros(self.taps - 1, dtype=np.float32)
+        self._start = -(self.taps - 1)
+        self._num_input = 0
+        self._num_output = 0
+
+    def push(self, audio: np.ndarray) -> np.ndarray:
+        """Add input samples and return the output samples they complete."""
+        self._buffer = np.concatenate([self._buffer, np.asarray(audio, dtype=np.float32)])
+        self._num_input += len(audio)
+        return self._produce(self._num_input, limit=None)
+
+    def flush(self) -> np.ndarray:
+        """Return the remaining output samples, as if the stream was followed by silence."""
+        padding = self._delay // self.up + 2
+        self._buffer = np.concatenate([self._buffer, np.zeros(padding, dtype=np.float32)])
+        total = -(-self._num_input * self.up // self.down)
+        return self._produce(self._num_input + padding, limit=total)
+
+    def _produce(self, num_available: int, limit: Optional[int]) -> np.ndarray:
+        # Output n is centered on position n * down + delay of the upsampled input
+        end = max((num_available * self.up - 1 - self._delay) // self.down + 1, self._num_output)
+        if limit is not None:
+            end = min(end, limit)
+        positions = np.arange(self._num_output, end) * self.down + self._delay
+        indices = (positions // self.up - self._start)[:, None] - np.arange(self.taps)[None, :]
+        output = np.einsum("ij,ij->i", self._buffer[indices], self._phases[positions % self.up])
+        self._num_output = end
+        # Drop the input samples no later output needs
+        first_needed = (end * self.down + self._delay) // self.up - (self.taps - 1)
+        if first_needed > self._start:
+            self._buffer = self._buffer[first_needed - self._start:]
+            self._start = first_needed
+        return output
+
+
+class AudioEncoder:
+    """
+    Streaming encoder of float PCM chunks. `push()` returns the encoded bytes that are ready, the header included,
+    and `finish()` the rest once the stream ends. Containers that store the length in their header are written for a
+    stream of unknown length; `finalize()` fixes the header up once the whole stream is in a seekable file.
+    Args:
+        sample_rate (int):
+            The sample rate of the pushed audio.
+        output_rate (Optional[int]):
+            The sample rate of the encoded audio, resampled with a StreamingResampler. Defaults to sample_rate.
+    """
+
+    content_type = "application/octet-stream"
+
+    def __init__(self, sample_rate: int, output_rate: Optional[int] = None):
+        self.sample_rate = output_rate or sample_rate
+        self._resampler = StreamingResampler(sample_rate, self.sample_rate) if self.sample_rate != sample_rate else None
+        self._converter = Pcm16Converter()
+        self._started = False
+        self.num_samples = 0
+
+    def push(self, audio: np.ndarray) -> bytes:
+        """Encode a chunk, returning the bytes ready so far."""
+        if self._resampler is not None:
+            audio = self._resampler.push(audio)
+        return self._push_pcm(audio)
+
+    def finish(self) -> bytes:
+        """End the stream, returning the remaining bytes."""
+        tail = self._resampler.flush() if self._resampler is not None else np.empty(0, dtype=np.float32)
+        return self._push_pcm(tail) + self._flush()
+
+    def close(self):
+        """Release the resources of the encoder, e.g. when the stream is abandoned before `finish()`."""
+
+    def finalize(self, file: BinaryIO, start: int = 0):
+        """Fix up the header of the finished stream written from offset start of a seekable file."""
+
+    def encode(self, audio: np.ndarray) -> bytes:
+        """Encode a whole waveform, with its final header."""
+        buffer = io.BytesIO()
+        try:
+            buffer.write(self.push(audio))
+            buffer.write(self.finish())
+        finally:
+            self.close()
+        self.finalize(buffer)
+        return buffer.getvalue()
+
+    def _push_pcm(self, audio: np.ndarray) -> bytes:
+        header = b""
+        if not self._started:
+            self._started = True
+            header = self._header()
+        if len(audio) == 0:
+            return header
+        pcm16 = self._converter.convert(audio)
+        self.num_samples += len(pcm16)
+        return header + self._encode(pcm16)
+
+    def _header(self) -> bytes:
+        return b""
+
+    def _encode(self, pcm16: np.ndarray) -> bytes:
+        raise NotImplementedError
+
+    def _flush(self) -> bytes:
+        return b""
+
+
+class PcmEncoder(AudioEncoder):
+    """Raw little-endian 16-bit mono PCM."""
+
+    content_type = AUDIO_CONTENT_TYPES["pcm"]
+
+    def _encode(self, pcm16: np.ndarray) -> bytes:
+        return pcm16.tobytes()
+
+
+class WavEncoder(AudioEncoder):
+    """16-bit mono WAV. The RIFF and data sizes are set to the maximum while streaming, as most players expect."""
+
+    content_type = AUDIO_CONTENT_TYPES["wav"]
+
+    def finalize(self, file: BinaryIO, start: int = 0):
+        num_bytes = 2 * self.num_samples
+        file.seek(start + 4)
+        file.write(struct.pack("<I", 36 + num_bytes))
+        file.seek(start + 40)
+        file.write(struct.pack("<I", num_bytes))
+        file.seek(0, io.SEEK_END)
+
+    def _header(self) -> bytes:
+        channels, bit_depth = 1, 16
+        byte_rate = self.sample_rate * channels * bit_depth // 8
+        block_align = channels * bit_depth // 8
+        return (
+            b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, self.sample_rate, byte_rate, block_align, bit_depth)
+            + b"data" + struct.pack("<I", 0xFFFFFFFF)
+        )
+
+    def _encode(self, pcm16: np.ndarray) -> bytes:
+        return pcm16.tobytes()
+
+
+def _crc_table(polynomial: int, width: int) -> List[int]:
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial) & mask if crc & top else (crc << 1) & mask
+        table.append(crc)
+    return table
+
+
+_CRC8_TABLE = _crc_table(0x07, 8)
+_CRC16_TABLE = _crc_table(0x8005, 16)
+
+
+def _crc8(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def _crc16(data: bytes) -> int:
+    crc = 0
+    table = _CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def _utf8_number(value: int) -> bytes:
+    """The "UTF-8" variable-length coding of FLAC frame numbers."""
+    if value < 0x80:
+        return bytes([value])
+    length = 2
+    while value >= 1 << (5 * length + 1):
+        length += 1
+    continuation = []
+    for _ in range(length - 1):
+        continuation.append(0x80 | (value & 0x3F))
+        value >>= 6
+    return bytes([((0xFF << (8 - length)) & 0xFF) | value] + continuation[::-1])
+
+
+def _int_bits(values: np.ndarray, num_bits: int) -> np.ndarray:
+    """Two's complement big-endian bits of integers, one uint8 per bit."""
+    shifts = np.arange(num_bits - 1, -1, -1)
+    return ((np.asarray(values, dtype=np.int64)[:, None] >> shifts) & 1).astype(np.uint8).ravel()
+
+
+def _rice_bits(residual: np.ndarray) -> np.ndarray:
+    """A residual coding section (Rice coding, one partition) with the parameter that minimizes its size."""
+    folded = np.where(residual >= 0, 2 * residual, -2 * residual - 1)
+    # The 4-bit parameter 15 is the escape code, 14 is the largest usable one
+    sizes = [int((folded >> k).sum()) + len(folded) * (k + 1) for k in range(15)]
+    k = int(np.argmin(sizes))
+    quotients = folded >> k
+    lengths = quotients + 1 + k
+    bits = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    stops = np.cumsum(lengths) - lengths + quotients
+    bits[stops] = 1
+    for i in range(k):
+        bits[stops + 1 + i] = (folded >> (k - 1 - i)) & 1
+    # Coding method 0 (4-bit parameters), partition order 0
+    return np.concatenate([_int_bits(np.array([0]), 2), _int_bits(np.array([0]), 4), _int_bits(np.array([k]), 4), bits])
+
+
+class FlacEncoder(AudioEncoder):
+    """
+    16-bit mono FLAC, in frames of block_size samples with fixed linear predictors and Rice-coded residuals. The
+    STREAMINFO block announces an unknown length and checksum while streaming, `finalize()` fills them in.
+    Args:
+        block_size (int):
+            Samples per frame. Frames are only emitted once complete, so this bounds the streaming latency.
+    """
+
+    content_type = AUDIO_CONTENT_TYPES["flac"]
+
+    def __init__(self, sample_rate: int, output_rate: Optional[int] = None, block_size: int = 4096):
+        super().__init__(sample_rate, output_rate)
+        self.block_size = block_size
+        self._pending = np.empty(0, dtype=np.int64)
+        self._num_frames = 0
+        self._md5 = hashlib.md5()
+
+    def finalize(self, file: BinaryIO, start: int = 0):
+        file.seek(start)
+        file.write(self._streaminfo(self.num_samples, self._md5.digest()))
+        file.seek(0, io.SEEK_END)
+
+    def _header(self) -> bytes:
+        return self._streaminfo(0, bytes(16))
+
+    def _streaminfo(self, total_samples: int, md5: bytes) -> bytes:
+        # Last metadata block, type STREAMINFO, 34 bytes
+        fields = (self.sample_rate << 44) | (0 << 41) | (15 << 36) | total_samples
+        return (
+            b"fLaC" + bytes([0x80]) + (34).to_bytes(3, "big")
+            + struct.pack(">HH", self.block_size, self.block_size) + bytes(6)
+            + fields.to_bytes(8, "big") + md5
+        )
+
+    def _encode(self, pcm16: np.ndarray) -> bytes:
+        self._md5.update(pcm16.tobytes())
+        self._pending = np.concatenate([self._pending, pcm16.astype(np.int64)])
+        frames = []
+        while len(self._pending) >= self.block_size:
+            frames.append(self._frame(self._pending[:self.block_size]))
+            self._pending = self._pending[self.block_size:]
+        return b"".join(frames)
+
+    def _flush(self) -> bytes:
+        if not len(self._pending):
+            return b""
+        frame = self._frame(self._pending)
+        self._pending = self._pending[:0]
+        return frame
+
+    def _frame(self, samples: np.ndarray) -> bytes:
+        num_samples = len(samples)
+        # Sync code and fixed block size; the block size is 4096 or stored after the frame number; the sample rate
+        # comes from STREAMINFO; mono, 16 bits per sample
+        block_size_code = 12 if num_samples == 4096 else 7
+        header = bytes([0xFF, 0xF8, block_size_code << 4, 0x08]) + _utf8_number(self._num_frames)
+        if block_size_code == 7:
+            header += struct.pack(">H", num_samples - 1)
+        header += bytes([_crc8(header)])
+        self._num_frames += 1
+        bits = self._subframe(samples)
+        bits = np.concatenate([bits, np.zeros(-len(bits) % 8, dtype=np.uint8)])
+        frame = header + np.packbits(bits).tobytes()
+        return frame + struct.pack(">H", _crc16(frame))
+
+    def _subframe(self, samples: np.ndarray) -> np.ndarray:
+        if (samples == samples[0]).all():
+            # CONSTANT subframe
+            return np.concatenate([_int_bits(np.array([0b00000000]), 8), _int_bits(samples[:1], 16)])
+        # VERBATIM subframe, unless a fixed predictor does better
+        best = np.concatenate([_int_bits(np.array([0b00000010]), 8), _int_bits(samples, 16)])
+        residual = samples
+        for order in range(min(4, len(samples) - 1) + 1):
+            if order:
+                residual = np.diff(residual)
+            bits = np.concatenate([
+                _int_bits(np.array([0b00010000 | order << 1]), 8),
+                _int_bits(samples[:order], 16),
+                _rice_bits(residual),
+            ])
+            if len(bits) < len(best):
+                best = bits
+        return best
+
+
+class ProcessEncoder(AudioEncoder):
+    """
+    Encoder backed by an ffmpeg process reading 16-bit PCM on its stdin, taken from an AudioEncoderPool. The encoded
+    stream is read by a thread as ffmpeg writes it, so `push()` returns whatever is ready without blocking on it.
+    """
+
+    def __init__(
+        self,
+        pool: "AudioEncoderPool",
+        process: subprocess.Popen,
+        response_format: str,
+        sample_rate: int,
+        output_rate: Optional[int] = None,
+    ):
+        super().__init__(sample_rate, output_rate)
+        self.content_type = AUDIO_CONTENT_TYPES[response_format]
+        self._pool = pool
+        self._process = process
+        self._output: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_output, name="audio-encoder-reader", daemon=True)
+        self._reader.start()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # An abandoned stream is killed, that is not a failure of the encoder
+        failed = self._process.poll() not in (None, 0)
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._reader.join()
+        self._pool._release(failed)
+
+    def _encode(self, pcm16: np.ndarray) -> bytes:
+        try:
+            self._process.stdin.write(pcm16.data)
+            self._process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            raise RuntimeError(f"Audio encoder exited: {self._error_output()}")
+        return self._drain(block=False)
+
+    def _flush(self) -> bytes:
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        data = self._drain(block=True)
+        if self._process.wait() != 0:
+            raise RuntimeError(f"Audio encoder failed with code {self._process.returncode}: {self._error_output()}")
+        self.close()
+        return data
+
+    def _read_output(self):
+        stdout = self._process.stdout
+        while True:
+            data = stdout.read1(65536)
+            if not data:
+                break
+            self._output.put(data)
+        self._output.put(None)
+
+    def _drain(self, block: bool) -> bytes:
+        chunks = []
+        while True:
+            try:
+                data = self._output.get(block=block)
+            except queue.Empty:
+                break
+            if data is None:
+                # Keep the end marker for later drains
+                self._output.put(None)
+                break
+            chunks.append(data)
+        return b"".join(chunks)
+
+    def _error_output(self) -> str:
+        if self._process.poll() is None:
+            return "still running"
+        return self._process.stderr.read().decode("utf-8", errors="replace").strip() or f"code {self._process.returncode}"
+
+
+class AudioEncoderPool:
+    """
+    Warm pool of ffmpeg processes for the compressed formats (mp3, opus, aac).
+
+    An ffmpeg process encodes one stream, so instead of reusing processes the pool keeps `spares` of them started and
+    waiting on their input for every format and sample rate in use. A request takes a spare and a background thread
+    starts its replacement, which keeps the process startup (fork, exec, codec initialization) off the request path.
+    Args:
+        spares (int):
+            Processes kept waiting per format and sample rate, 0 starts one per request.
+        ffmpeg (str):
+            The ffmpeg executable.
+        bitrates (Optional[Dict[str, str]]):
+            ffmpeg bitrate per format, e.g. {"mp3": "64k"}. Formats without one use the encoder default.
+    """
+
+    def __init__(self, spares: int = 2, ffmpeg: str = "ffmpeg", bitrates: Optional[Dict[str, str]] = None):
+        self.spares = spares
+        self.ffmpeg = ffmpeg
+        self.bitrates = bitrates or {}
+        self._lock = threading.Lock()
+        self._spares: Dict[Tuple[str, int], List[subprocess.Popen]] = {}
+        self._num_active = 0
+        self._num_warm_starts = 0
+        self._num_cold_starts = 0
+        self._num_failures = 0
+        self._refills: "queue.Queue[Optional[Tuple[str, int]]]" = queue.Queue()
+        self._refiller = threading.Thread(target=self._refill_loop, name="audio-encoder-refill", daemon=True)
+        self._refiller.start()
+
+    def open(self, response_format: str, sample_rate: int, output_rate: Optional[int] = None) -> ProcessEncoder:
+        """Return an encoder of float PCM at sample_rate into a compressed format, optionally resampled to output_rate."""
+        if response_format not in PROCESS_FORMATS:
+            raise ValueError(f"Unsupported compressed audio format '{response_format}'")
+        key = (response_format, output_rate or sample_rate)
+        process = None
+        with self._lock:
+            spares = self._spares.get(key, [])
+            while spares and process is None:
+                candidate = spares.pop()
+                if candidate.poll() is None:
+                    process = candidate
+                else:
+                    self._num_failures += 1
+            if process is not None:
+                self._num_warm_starts += 1
+            else:
+                self._num_cold_starts += 1
+            self._num_active += 1
+        if self.spares > 0:
+            self._refills.put(key)
+        if process is None:
+            try:
+                process = self._start(*key)
+            except BaseException:
+                with self._lock:
+                    self._num_active -= 1
+                raise
+        return ProcessEncoder(self, process, response_format, sample_rate, output_rate)
+
+    def stats(self) -> dict:
+        """Return the number of waiting and active processes and the start counters."""
+        with self._lock:
+            return {
+                "spares": sum(len(spares) for spares in self._spares.values()),
+                "active": self._num_active,
+                "warm_starts": self._num_warm_starts,
+                "cold_starts": self._num_cold_starts,
+                "failures": self._num_failures,
+            }
+
+    def shutdown(self):
+        """Stop the refill thread and the waiting processes."""
+        self._refills.put(None)
+        self._refiller.join()
+        with self._lock:
+            spares = [process for processes in self._spares.values() for process in processes]
+            self._spares.clear()
+        for process in spares:
+            process.kill()
+            process.wait()
+
+    def _start(self, response_format: str, sample_rate: int) -> subprocess.Popen:
+        muxer, codec = PROCESS_FORMATS[response_format]
+        command = [
+            self.ffmpeg, "-hide_banner", "-nostdin", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+            "-c:a", codec,
+        ]
+        if response_format in self.bitrates:
+            command += ["-b:a", self.bitrates[response_format]]
+        # Write every packet as soon as it is encoded instead of buffering the output
+        command += ["-flush_packets", "1", "-f", muxer, "pipe:1"]
+        try:
+            return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError(f"Audio encoder '{self.ffmpeg}' not found, {response_format} output needs ffmpeg")
+
+    def _release(self, failed: bool):
+        with self._lock:
+            self._num_active -= 1
+            if failed:
+                self._num_failures += 1
+
+    def _refill_loop(self):
+        while True:
+            key = self._refills.get()
+            if key is None:
+                return
+            with self._lock:
+                missing = self.spares - len(self._spares.get(key, []))
+            for _ in range(missing):
+                try:
+                    process = self._start(*key)
+                except Exception as e:
+                    logger.warning(f"Could not start a spare {key[0]} encoder: {e}")
+                    break
+                with self._lock:
+                    self._spares.setdefault(key, []).append(process)
+
+
+def create_audio_encoder(
+    response_format: str,
+    sample_rate: int,
+    output_rate: Optional[int] = None,
+    pool: Optional[AudioEncoderPool] = None,
+) -> AudioEncoder:
+    """
+    Create a streaming encoder of float PCM into a response format.
+    Args:
+        response_format: One of AUDIO_CONTENT_TYPES. pcm, wav and flac are encoded in process, the others by the pool.
+        sample_rate: The sample rate of the pushed audio.
+        output_rate: The sample rate of the encoded audio, defaults to sample_rate.
+        pool: The ffmpeg process pool, required for the compressed formats.
+    Returns:
+        The encoder.
+    """
+    if response_format == "pcm":
+        return PcmEncoder(sample_rate, output_rate)
+    if response_format == "wav":
+        return WavEncoder(sample_rate, output_rate)
+    if response_format == "flac":
+        return FlacEncoder(sample_rate, output_rate)
+    if response_format in PROCESS_FORMATS:
+        if pool is None:
+            raise ValueError(f"{response_format} output needs an AudioEncoderPool")
+        return pool.open(response_format, sample_rate, output_rate)
+    raise ValueError(f"Unsupported audio format '{response_format}'")
+
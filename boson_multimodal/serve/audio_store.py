@@ -0,0 +1,174 @@
+import os
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+from loguru import logger
+
+
+_FILE_NAME_RE = re.compile(r"^[0-9a-f]{32}\.[a-z0-9]+$")
+
+
+@dataclass
+class StoredAudio:
+    """A generated audio file in the result store."""
+
+    file_name: str
+    size: int
+    expires_at: float
+
+
+class PendingAudio:
+    """
+    An audio file being written into the result store. Write to `file`, then `commit()` to publish it or `discard()`
+    to drop it. The file is seekable, e.g. to patch a WAV header once the length is known.
+    """
+
+    def __init__(self, store: "AudioResultStore", file_name: str):
+        self._store = store
+        self.file_name = file_name
+        self._tmp_path = os.path.join(store.root_dir, f".{file_name}.tmp")
+        self.file: BinaryIO = open(self._tmp_path, "wb")
+        self._done = False
+
+    def commit(self) -> StoredAudio:
+        """Publish the file. Returns its StoredAudio."""
+        self.file.close()
+        self._done = True
+        return self._store._commit(self._tmp_path, self.file_name)
+
+    def discard(self):
+        """Drop the file. Does nothing after `commit()`."""
+        if self._done:
+            return
+        self._done = True
+        self.file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+class AudioResultStore:
+    """
+    Size- and TTL-bounded directory of generated audio files, served by URL instead of inline in responses.
+
+    Files are written incrementally (`open()`), so a long narration never has to sit in memory, and served straight
+    from disk with HTTP range requests. A file expires `ttl` seconds after it was written; expired files, then the
+    oldest ones while the store is over `max_bytes`, are deleted whenever a new file is committed.
+
+    Args:
+        root_dir (str):
+            The directory holding the files. Created if missing, leftover files are kept until they expire.
+        max_bytes (int):
+            The size bound of the store.
+        ttl (float):
+            Seconds a file stays available.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int = 2 << 30, ttl: float = 3600.0):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._num_stored = 0
+        self._num_evicted = 0
+        os.makedirs(root_dir, exist_ok=True)
+        # Files that were still being written when the process stopped
+        for entry in os.scandir(root_dir):
+            if entry.name.startswith(".") and entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+
+    def open(self, extension: str) -> PendingAudio:
+        """Start writing a new file with the given extension (without the dot)."""
+        return PendingAudio(self, f"{uuid.uuid4().hex}.{extension}")
+
+    def put(self, data: bytes, extension: str) -> StoredAudio:
+        """Store an already encoded file."""
+        pending = self.open(extension)
+        try:
+            pending.file.write(data)
+        except BaseException:
+            pending.discard()
+            raise
+        return pending.commit()
+
+    def path(self, file_name: str) -> Optional[str]:
+        """Return the path of a stored file, or None if it does not exist or has expired."""
+        if not _FILE_NAME_RE.match(file_name):
+            return None
+        path = os.path.join(self.root_dir, file_name)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+        except OSError:
+            return None
+        return path
+
+    def stats(self) -> dict:
+        """Return the number and size of the stored files and the store counters."""
+        num_files = 0
+        num_bytes = 0
+        for entry in self._entries():
+            try:
+                num_bytes += entry.stat().st_size
+            except FileNotFoundError:
+                continue
+            num_files += 1
+        with self._lock:
+            return {
+                "files": num_files,
+                "bytes": num_bytes,
+                "max_bytes": self.max_bytes,
+                "stored": self._num_stored,
+                "evicted": self._num_evicted,
+            }
+
+    def _entries(self) -> list:
+        try:
+            return [entry for entry in os.scandir(self.root_dir) if _FILE_NAME_RE.match(entry.name)]
+        except FileNotFoundError:
+            return []
+
+    def _commit(self, tmp_path: str, file_name: str) -> StoredAudio:
+        path = os.path.join(self.root_dir, file_name)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._num_stored += 1
+        self._evict()
+        return StoredAudio(file_name=file_name, size=size, expires_at=time.time() + self.ttl)
+
+    def _evict(self):
+        now = time.time()
+        live = []
+        total = 0
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self._remove(entry.path)
+            else:
+                live.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        # Oldest first, the newest file is kept even if it alone exceeds the bound
+        live.sort()
+        for _, size, path in live[:-1]:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._num_evicted += 1
+        logger.debug(f"Evicted stored audio {os.path.basename(path)}")
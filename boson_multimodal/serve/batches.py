@@ -0,0 +1,362 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from ..data_types import ChatMLSample
+from .scheduler import PRIORITY_BULK, GenerationRequest, HiggsAudioRequestScheduler, SchedulerQueueFullError
+
+
+_BATCH_ID_RE = re.compile(r"^batch_[0-9a-f]{24}$")
+_ACTIVE_STATUSES = ("queued", "in_progress")
+# The request counts of a running batch are written to batch.json after this many jobs or seconds, whichever is first
+_COUNTS_UPDATE_JOBS = 100
+_COUNTS_UPDATE_INTERVAL = 5.0
+# Seconds before submitting again to a full scheduler queue, when no job of the batch is running to wake the runner
+_QUEUE_FULL_RETRY_INTERVAL = 1.0
+
+
+def parse_batch_input(data: bytes) -> List[Dict[str, Any]]:
+    """
+    Parse and validate the JSONL input of a batch.
+    Each line is a job, either flat (`{"custom_id": ..., "input": ..., "voice": ...}`) or in the OpenAI batch format
+    (`{"custom_id": ..., "method": "POST", "url": "/v1/audio/speech", "body": {...}}`).
+    Args:
+        data: The JSONL file contents.
+    Returns:
+        The jobs as `{"custom_id": str, "body": dict}`, in file order.
+    Raises:
+        ValueError: If a line is not valid JSON, has no `input` text, or repeats a `custom_id`.
+    """
+    jobs = []
+    custom_ids = set()
+    for line_number, line in enumerate(data.decode("utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {line_number}: invalid JSON ({e})")
+        if not isinstance(job, dict):
+            raise ValueError(f"Line {line_number}: expected a JSON object")
+        body = job.get("body", job)
+        custom_id = str(job.get("custom_id", line_number))
+        if custom_id in custom_ids:
+            raise ValueError(f"Line {line_number}: duplicate custom_id '{custom_id}'")
+        if not isinstance(body, dict) or not isinstance(body.get("input"), str) or not body["input"].strip():
+            raise ValueError(f"Line {line_number}: missing 'input' text")
+        custom_ids.add(custom_id)
+        jobs.append({"custom_id": custom_id, "body": body})
+    if not jobs:
+        raise ValueError("The batch has no jobs")
+    return jobs
+
+
+class BatchManager:
+    """
+    Runs offline TTS batches through the shared request scheduler at bulk priority.
+
+    A batch is a directory `<root_dir>/<batch_id>/` holding the validated `input.jsonl`, the `batch.json` status
+    object, an append-only `results.jsonl` manifest with one line per finished job, and the generated files under
+    `audio/`. Batches run one at a time, in creation order. The runner keeps `max_in_flight` jobs submitted so the
+    scheduler can batch them across the engine's KV cache slots, and bulk priority lets interactive traffic go first.
+
+    Progress is durable: the manifest is flushed after every job, and batches that were queued or running when the
+    process stopped are resumed on start, skipping the jobs already in their manifest. The request counts in
+    `batch.json` are refreshed every `_COUNTS_UPDATE_JOBS` jobs or `_COUNTS_UPDATE_INTERVAL` seconds while a batch
+    runs, and are recounted from the manifest on resume.
+
+    Args:
+        root_dir (str):
+            The directory holding the batches. Created if missing.
+        scheduler (HiggsAudioRequestScheduler):
+            The scheduler the jobs are submitted to.
+        prepare (Callable):
+            Maps a job body to the chatml sample and the `start_sequence()` keyword arguments of its generation.
+        encode (Callable):
+            Encodes a float waveform and its sample rate into the bytes of an audio file.
+        file_extension (str):
+            The extension of the files `encode` produces.
+        max_in_flight (int, optional):
+            The maximum number of jobs submitted at once. Defaults to twice the engine's batch size.
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        scheduler: HiggsAudioRequestScheduler,
+        prepare: Callable[[Dict[str, Any]], Tuple[ChatMLSample, Dict[str, Any]]],
+        encode: Callable[[np.ndarray, int], bytes],
+        file_extension: str = "wav",
+        max_in_flight: Optional[int] = None,
+    ):
+        self.root_dir = root_dir
+        self.scheduler = scheduler
+        self.prepare = prepare
+        self.encode = encode
+        self.file_extension = file_extension
+        self.max_in_flight = max_in_flight or 2 * scheduler.max_batch_size
+        self._lock = threading.Lock()
+        self._cancelled = set()
+        # Notified when a submitted job finishes or a batch is cancelled, wakes the runner up
+        self._wakeup = threading.Condition()
+        self._queue = queue.Queue()
+        os.makedirs(root_dir, exist_ok=True)
+
+        for batch in self.list():
+            if batch["status"] in _ACTIVE_STATUSES:
+                logger.info(f"Resuming batch {batch['id']} ({batch['request_counts']})")
+                self._queue.put(batch["id"])
+        self._worker = threading.Thread(target=self._run, name="tts-batches", daemon=True)
+        self._worker.start()
+
+    def create(self, data: bytes, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Validate a JSONL file of jobs and queue it as a new batch.
+        Args:
+            data: The JSONL file contents, see `parse_batch_input()`.
+            metadata: Optional metadata stored with the batch.
+        Returns:
+            The batch object.
+        Raises:
+            ValueError: If the input is invalid.
+        """
+        jobs = parse_batch_input(data)
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "status": "queued",
+            "created_at": int(time.time()),
+            "started_at": None,
+            "completed_at": None,
+            "request_counts": {"total": len(jobs), "completed": 0, "failed": 0},
+            "metadata": metadata or {},
+        }
+
+        # Write to a temporary directory first so a batch is never visible half written
+        batch_dir = self._batch_dir(batch_id)
+        tmp_dir = f"{batch_dir}.tmp"
+        os.makedirs(os.path.join(tmp_dir, "audio"))
+        with open(os.path.join(tmp_dir, "input.jsonl"), "w") as f:
+            for job in jobs:
+                f.write(json.dumps(job) + "\n")
+        with open(os.path.join(tmp_dir, "batch.json"), "w") as f:
+            json.dump(batch, f)
+        os.rename(tmp_dir, batch_dir)
+
+        logger.info(f"Queued batch {batch_id} with {len(jobs)} jobs")
+        self._queue.put(batch_id)
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Return the batch object, or None if it does not exist."""
+        if not self.exists(batch_id):
+            return None
+        with self._lock:
+            with open(os.path.join(self._batch_dir(batch_id), "batch.json")) as f:
+                return json.load(f)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Return all batches, oldest first."""
+        batches = [self.get(batch_id) for batch_id in os.listdir(self.root_dir) if _BATCH_ID_RE.match(batch_id)]
+        return sorted((batch for batch in batches if batch is not None), key=lambda batch: batch["created_at"])
+
+    def exists(self, batch_id: str) -> bool:
+        return bool(_BATCH_ID_RE.match(batch_id)) and os.path.isfile(
+            os.path.join(self._batch_dir(batch_id), "batch.json")
+        )
+
+    def cancel(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancel a queued or running batch. Its running jobs are cancelled, finished ones stay in the manifest.
+        Returns:
+            The batch object, or None if it does not exist.
+        """
+        batch = self.get(batch_id)
+        if batch is None or batch["status"] not in _ACTIVE_STATUSES:
+            return batch
+        with self._lock:
+            self._cancelled.add(batch_id)
+        self._wake()
+        if batch["status"] == "queued":
+            batch = self._update(batch_id, status="cancelled", completed_at=int(time.time()))
+        return batch
+
+    def results_path(self, batch_id: str) -> Optional[str]:
+        """Return the path of the results manifest of a batch, or None if it has none yet."""
+        if not self.exists(batch_id):
+            return None
+        path = os.path.join(self._batch_dir(batch_id), "results.jsonl")
+        return path if os.path.isfile(path) else None
+
+    def audio_path(self, batch_id: str, file_name: str) -> Optional[str]:
+        """Return the path of a generated file of a batch, or None if it does not exist."""
+        if not self.exists(batch_id) or os.path.basename(file_name) != file_name:
+            return None
+        path = os.path.join(self._batch_dir(batch_id), "audio", file_name)
+        return path if os.path.isfile(path) else None
+
+    def shutdown(self, wait: bool = True):
+        """Stop the runner after the current batch. Unfinished batches resume on the next start."""
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    def _batch_dir(self, batch_id: str) -> str:
+        return os.path.join(self.root_dir, batch_id)
+
+    def _update(self, batch_id: str, **fields: Any) -> Dict[str, Any]:
+        """Update fields of the batch object, replacing the file atomically."""
+        path = os.path.join(self._batch_dir(batch_id), "batch.json")
+        with self._lock:
+            with open(path) as f:
+                batch = json.load(f)
+            batch.update(fields)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(batch, f)
+            os.replace(f"{path}.tmp", path)
+        return batch
+
+    def _is_cancelled(self, batch_id: str) -> bool:
+        with self._lock:
+            return batch_id in self._cancelled
+
+    def _wake(self, *_):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _run(self):
+        while True:
+            batch_id = self._queue.get()
+            if batch_id is None:
+                break
+            try:
+                self._process(batch_id)
+            except Exception as e:
+                logger.opt(exception=e).error(f"Batch {batch_id} failed")
+                self._update(batch_id, status="failed", completed_at=int(time.time()))
+
+    def _process(self, batch_id: str):
+        batch = self.get(batch_id)
+        if batch is None or batch["status"] not in _ACTIVE_STATUSES:
+            return
+        batch_dir = self._batch_dir(batch_id)
+        with open(os.path.join(batch_dir, "input.jsonl")) as f:
+            jobs = [json.loads(line) for line in f]
+
+        # Jobs already in the manifest were finished before a restart
+        counts = {"total": len(jobs), "completed": 0, "failed": 0}
+        finished = set()
+        manifest_path = os.path.join(batch_dir, "results.jsonl")
+        if os.path.isfile(manifest_path):
+            results = []
+            with open(manifest_path) as f:
+                for line in f:
+                    try:
+                        results.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Torn last line of an interrupted write, the job runs again
+                        continue
+            with open(manifest_path, "w") as f:
+                for result in results:
+                    f.write(json.dumps(result) + "\n")
+                    finished.add(result["custom_id"])
+                    counts[result["status"]] += 1
+        pending = [(index, job) for index, job in enumerate(jobs) if job["custom_id"] not in finished]
+        pending.reverse()
+        batch = self._update(
+            batch_id, status="in_progress", started_at=batch["started_at"] or int(time.time()), request_counts=counts
+        )
+        logger.info(f"Running batch {batch_id}: {len(pending)} of {len(jobs)} jobs left")
+
+        in_flight: Dict[Any, Tuple[int, Dict[str, Any], GenerationRequest]] = {}
+        with open(manifest_path, "a") as manifest:
+
+            num_unreported = 0
+            last_report = time.monotonic()
+
+            def record(result: Dict[str, Any]):
+                nonlocal num_unreported, last_report
+                manifest.write(json.dumps(result) + "\n")
+                manifest.flush()
+                counts[result["status"]] += 1
+                num_unreported += 1
+                # Rewriting batch.json after every job would cost a file replace per job
+                if num_unreported >= _COUNTS_UPDATE_JOBS or time.monotonic() - last_report >= _COUNTS_UPDATE_INTERVAL:
+                    self._update(batch_id, request_counts=counts)
+                    num_unreported = 0
+                    last_report = time.monotonic()
+
+            while pending or in_flight:
+                if self._is_cancelled(batch_id):
+                    for _, _, request in in_flight.values():
+                        request.cancel()
+                    self._update(batch_id, status="cancelled", completed_at=int(time.time()), request_counts=counts)
+                    logger.info(f"Cancelled batch {batch_id}")
+                    return
+
+                # Keep the scheduler fed so the engine batches jobs across its KV cache slots
+                while pending and len(in_flight) < self.max_in_flight:
+                    index, job = pending[-1]
+                    try:
+                        chat_ml_sample, generate_kwargs = self.prepare(job["body"])
+                        request = self.scheduler.submit(
+                            chat_ml_sample, priority=PRIORITY_BULK, enforce_slo=False, **generate_kwargs
+                        )
+                    except SchedulerQueueFullError:
+                        # Interactive traffic has filled the queue, retry once some of it has drained
+                        break
+                    except Exception as e:
+                        pending.pop()
+                        record({"custom_id": job["custom_id"], "status": "failed", "error": str(e)})
+                        continue
+                    pending.pop()
+                    in_flight[request.future] = (index, job, request)
+                    request.future.add_done_callback(self._wake)
+
+                if not pending and not in_flight:
+                    continue
+                # Sleep until a job finishes or the batch is cancelled; with no job running, the queue was full
+                with self._wakeup:
+                    self._wakeup.wait_for(
+                        lambda: any(future.done() for future in in_flight) or self._is_cancelled(batch_id),
+                        timeout=None if in_flight else _QUEUE_FULL_RETRY_INTERVAL,
+                    )
+                for future in [future for future in in_flight if future.done()]:
+                    index, job, request = in_flight.pop(future)
+                    record(self._save_result(batch_dir, index, job, request))
+
+        self._update(batch_id, status="completed", completed_at=int(time.time()), request_counts=counts)
+        logger.info(f"Finished batch {batch_id}: {counts}")
+
+    def _save_result(
+        self, batch_dir: str, index: int, job: Dict[str, Any], request: GenerationRequest
+    ) -> Dict[str, Any]:
+        try:
+            response = request.result()
+            if response.audio is None:
+                raise RuntimeError("No audio generated by model")
+            file_name = f"{index:06d}.{self.file_extension}"
+            path = os.path.join(batch_dir, "audio", file_name)
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(self.encode(response.audio, response.sampling_rate))
+            os.replace(f"{path}.tmp", path)
+        except Exception as e:
+            logger.warning(f"Batch job {job['custom_id']} failed: {e}")
+            return {"custom_id": job["custom_id"], "status": "failed", "error": str(e)}
+        return {
+            "custom_id": job["custom_id"],
+            "status": "completed",
+            "file": file_name,
+            "duration": round(len(response.audio) / response.sampling_rate, 3),
+            "queue_wait": round(request.queue_wait, 3),
+            "service_time": round(request.service_time, 3),
+        }
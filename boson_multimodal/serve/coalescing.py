@@ -0,0 +1,226 @@
+import queue
+import threading
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+# Seconds between two checks of the stop signals of the subscriptions
+_STOP_SIGNAL_POLL_INTERVAL = 0.05
+
+class _Flight:
+    """The shared, replayable output of one in-flight generation."""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.num_subscribers = 0
+        self.cond = threading.Condition()
+        # Set once nobody is listening anymore, cancels the underlying generation
+        self.stop_signal = threading.Event()
+
+    def publish(self, chunk: Any):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+
+class _Subscription:
+    """Iterator over a flight's chunks from the first one, whenever it was joined."""
+
+    def __init__(
+        self,
+        coalescer: "StreamCoalescer",
+        key: Hashable,
+        flight: _Flight,
+        leader: bool,
+        stop_signal: Optional[threading.Event] = None,
+    ):
+        self._coalescer = coalescer
+        self._key = key
+        self._flight = flight
+        # Whether this subscription started the generation, or joined one that was in flight
+        self.leader = leader
+        self.stop_signal = stop_signal
+        self._index = 0
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Any:
+        flight = self._flight
+        with flight.cond:
+            while not self._closed and self._index >= len(flight.chunks) and not flight.done:
+                flight.cond.wait()
+            if self._closed:
+                raise StopIteration
+            if self._index < len(flight.chunks):
+                chunk = flight.chunks[self._index]
+                self._index += 1
+                return chunk
+        self.close()
+        if flight.error is not None:
+            raise flight.error
+        raise StopIteration
+
+    def close(self):
+        """Stop listening. The generation is cancelled when its last subscriber closes."""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        # Wakes a reader waiting for the next chunk
+        with self._flight.cond:
+            self._flight.cond.notify_all()
+        self._coalescer._unsubscribe(self._key, self._flight)
+
+    def __del__(self):
+        # Subscriptions that are dropped without being exhausted, e.g. by a disconnected client, still let go. The
+        # garbage collector may run this on a thread that holds the coalescer's lock, so the watcher unsubscribes
+        if not self._closed:
+            self._closed = True
+            self._coalescer._released.put((self._key, self._flight))
+
+
+class StreamCoalescer:
+    """
+    Single-flight deduplication of streamed generations.
+
+    The first request for a key (the leader) starts the generation; a worker thread pumps its chunks into a shared
+    buffer. Identical requests arriving while it runs (followers) subscribe to the same buffer instead of starting
+    their own generation, and replay it from the first chunk. The leader is a subscriber like any other, so it can go
+    away without cutting off its followers; the generation is only cancelled once every subscriber has closed.
+    A subscriber leaves when it closes its iterator or, if it subscribed with a stop signal, when the signal is set;
+    a watcher thread checks the signals, so a request whose iterator is never read again still lets go. The watcher
+    also releases the subscriptions that are garbage collected without being closed.
+
+    Followers inherit the leader's scheduling: they are never shed by admission control and wait at the leader's
+    priority, so requests that must not share a priority should not share a key.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._num_leaders = 0
+        self._num_followers = 0
+        # Subscriptions closed by the watcher once their stop signal is set
+        self._watched: List[_Subscription] = []
+        self._watcher: Optional[threading.Thread] = None
+        # (key, flight) of the subscriptions dropped without being closed, and None to wake the watcher up. A
+        # SimpleQueue, since its put() is safe to call from __del__
+        self._released: "queue.SimpleQueue[Optional[Tuple[Hashable, _Flight]]]" = queue.SimpleQueue()
+
+    def subscribe(
+        self,
+        key: Hashable,
+        start: Callable[[threading.Event], Iterator[Any]],
+        stop_signal: Optional[threading.Event] = None,
+    ) -> _Subscription:
+        """
+        Join the in-flight generation of a key, or start it.
+        Args:
+            key: The normalized request, e.g. `make_cache_key()` of the TTS inputs.
+            start: Called with a stop event to start the generation, only if none is in flight for the key. Must
+                return the iterator over its chunks and end it once the event is set. Errors it raises are raised to
+                the leader and to the followers that joined in the meantime.
+            stop_signal: Optional event of the caller's request. Setting it stops listening, like closing the iterator.
+        Returns:
+            An iterator over all the chunks of the generation, whose `leader` tells whether it started it. Close it,
+            drop it or set stop_signal to stop listening.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.num_subscribers += 1
+                self._num_followers += 1
+                return self._watch(_Subscription(self, key, flight, leader=False, stop_signal=stop_signal))
+            flight = _Flight()
+            flight.num_subscribers = 1
+            self._flights[key] = flight
+            self._num_leaders += 1
+
+        try:
+            source = start(flight.stop_signal)
+        except BaseException as e:
+            self._retire(key, flight)
+            flight.finish(e)
+            raise
+        threading.Thread(target=self._pump, args=(key, flight, source), name="tts-single-flight", daemon=True).start()
+        with self._lock:
+            return self._watch(_Subscription(self, key, flight, leader=True, stop_signal=stop_signal))
+
+    def stats(self) -> dict:
+        """Return the number of generations started and of requests that joined one instead."""
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self._num_leaders,
+                "followers": self._num_followers,
+            }
+
+    def _watch(self, subscription: _Subscription) -> _Subscription:
+        """Hand a new subscription to the watcher, called with the lock held."""
+        if self._watcher is None:
+            self._watcher = threading.Thread(
+                target=self._watch_subscriptions, name="tts-single-flight-watcher", daemon=True
+            )
+            self._watcher.start()
+        if subscription.stop_signal is not None:
+            self._watched.append(subscription)
+            self._released.put(None)
+        return subscription
+
+    def _watch_subscriptions(self):
+        # Polls the stop signals while some are watched, and otherwise sleeps until a subscription is added or released
+        while True:
+            with self._lock:
+                self._watched = [subscription for subscription in self._watched if not subscription.closed]
+                stopped = [subscription for subscription in self._watched if subscription.stop_signal.is_set()]
+                timeout = _STOP_SIGNAL_POLL_INTERVAL if self._watched else None
+            for subscription in stopped:
+                subscription.close()
+            try:
+                released = self._released.get(timeout=timeout)
+                while True:
+                    if released is not None:
+                        self._unsubscribe(*released)
+                    released = self._released.get_nowait()
+            except queue.Empty:
+                pass
+
+    def _pump(self, key: Hashable, flight: _Flight, source: Iterator[Any]):
+        error = None
+        try:
+            for chunk in source:
+                flight.publish(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            # Requests arriving from now on start a new generation (or hit the result cache)
+            self._retire(key, flight)
+            flight.finish(error)
+
+    def _unsubscribe(self, key: Hashable, flight: _Flight):
+        with self._lock:
+            flight.num_subscribers -= 1
+            if flight.num_subscribers > 0:
+                return
+            # Retired under the same lock so that nobody joins a flight that is being cancelled
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.stop_signal.set()
+
+    def _retire(self, key: Hashable, flight: _Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
@@ -0,0 +1,310 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from ..data_types import AudioContent, ChatMLSample, Message, TextContent
+
+
+# How the audio in a record is kept: only its SHA-256 and size, or the whole clip
+FLIGHT_RECORDER_AUDIO_MODES = ("hash", "full")
+# Request body fields holding base64 audio
+_AUDIO_FIELDS = ("data",)
+
+
+def _audio_digest(data: bytes) -> Dict[str, Any]:
+    return {"sha256": hashlib.sha256(data).hexdigest(), "bytes": len(data)}
+
+
+def serialize_chat_ml_sample(chat_ml_sample: ChatMLSample, audio: str = "hash") -> Dict[str, Any]:
+    """
+    Convert a chatml sample to JSON, with its reference audio kept according to the audio mode.
+    Args:
+        chat_ml_sample: The chatml sample of a generation.
+        audio: "hash" keeps the SHA-256 and size of raw audio and audio codes, "full" keeps them whole.
+    Returns:
+        A JSON-serializable dict, converted back by `deserialize_chat_ml_sample()`.
+    """
+
+    def content_to_json(content):
+        if isinstance(content, str):
+            return content
+        if isinstance(content, TextContent):
+            return {"type": "text", "text": content.text}
+        if isinstance(content, AudioContent):
+            item = {"type": "audio", "audio_url": content.audio_url}
+            if content.raw_audio is not None:
+                raw_audio = content.raw_audio
+                if isinstance(raw_audio, str):
+                    raw_audio = base64.b64decode(raw_audio)
+                item["raw_audio"] = _audio_digest(raw_audio)
+                if audio == "full":
+                    item["raw_audio"]["data"] = base64.b64encode(raw_audio).decode("ascii")
+            if content.audio_codes is not None:
+                codes = content.audio_codes.tolist()
+                item["audio_codes"] = {
+                    "sha256": hashlib.sha256(json.dumps(codes).encode("utf-8")).hexdigest(),
+                    "shape": list(content.audio_codes.shape),
+                }
+                if audio == "full":
+                    item["audio_codes"]["data"] = codes
+            return item
+        raise TypeError(f"Unsupported message content {type(content).__name__}")
+
+    messages = []
+    for message in chat_ml_sample.messages:
+        if isinstance(message.content, list):
+            content = [content_to_json(item) for item in message.content]
+        else:
+            content = content_to_json(message.content)
+        messages.append({"role": message.role, "content": content})
+    return {"messages": messages, "speaker": chat_ml_sample.speaker}
+
+
+def deserialize_chat_ml_sample(data: Dict[str, Any], reference_audio: Optional[bytes] = None) -> ChatMLSample:
+    """
+    Rebuild a chatml sample serialized by `serialize_chat_ml_sample()`.
+    Args:
+        data: The serialized sample.
+        reference_audio: Encoded audio used for raw audio that was recorded by hash only.
+    Returns:
+        The ChatMLSample.
+    Raises:
+        ValueError: If the sample holds audio recorded by hash only and no substitute was given.
+    """
+
+    def content_from_json(item):
+        if isinstance(item, str):
+            return item
+        if item["type"] == "text":
+            return TextContent(text=item["text"])
+        raw_audio = None
+        audio_codes = None
+        if "raw_audio" in item:
+            if "data" in item["raw_audio"]:
+                raw_audio = base64.b64decode(item["raw_audio"]["data"])
+            elif reference_audio is not None:
+                if hashlib.sha256(reference_audio).hexdigest() != item["raw_audio"]["sha256"]:
+                    logger.warning("The substitute reference audio differs from the recorded one")
+                raw_audio = reference_audio
+            else:
+                raise ValueError("The record holds only the hash of its reference audio, pass a substitute clip")
+        if "audio_codes" in item:
+            if "data" in item["audio_codes"]:
+                import torch
+
+                audio_codes = torch.tensor(item["audio_codes"]["data"], dtype=torch.long)
+            elif reference_audio is not None:
+                # Encoded again from the substitute by the engine
+                raw_audio = reference_audio
+            else:
+                raise ValueError("The record holds only the hash of its reference audio codes, pass a substitute clip")
+        return AudioContent(audio_url=item.get("audio_url", ""), raw_audio=raw_audio, audio_codes=audio_codes)
+
+    messages = []
+    for message in data["messages"]:
+        content = message["content"]
+        if isinstance(content, list):
+            content = [content_from_json(item) for item in content]
+        else:
+            content = content_from_json(content)
+        messages.append(Message(role=message["role"], content=content))
+    return ChatMLSample(messages=messages, speaker=data.get("speaker"))
+
+
+def sanitize_request_body(body: Any, audio: str = "hash") -> Any:
+    """Copy a request body, replacing base64 audio with its SHA-256 and size unless the audio mode is "full"."""
+    if audio == "full":
+        return body
+    if isinstance(body, dict):
+        sanitized = {}
+        for key, value in body.items():
+            if key in _AUDIO_FIELDS and isinstance(value, str) and len(value) > 256:
+                try:
+                    sanitized[key] = _audio_digest(base64.b64decode(value))
+                    continue
+                except ValueError:
+                    pass
+            sanitized[key] = sanitize_request_body(value, audio)
+        return sanitized
+    if isinstance(body, list):
+        return [sanitize_request_body(item, audio) for item in body]
+    return body
+
+
+class FlightRecorder:
+    """
+    Keeps the full inputs, per-stage timings and engine state of requests slower than a latency threshold, so that a
+    p99 spike can be investigated and replayed after the fact (`replay_flight_record.py`).
+
+    While a request runs, its generations are attached to it (`add_generation()`): the chatml sample, sampling
+    parameters and seed, plus the queue wait, decode steps, token counts, KV cache bucket and stage timings of the
+    engine. When the request ends (`finish()`), it is written out as one JSON file if it took at least `threshold`
+    seconds, otherwise dropped. The directory is a ring buffer of the latest `capacity` records. Reference audio is
+    kept as a hash unless `audio="full"`.
+
+    Args:
+        root_dir (str):
+            The directory holding the records. Created if missing, existing records count against the capacity.
+        threshold (float):
+            Seconds a request must take to be recorded.
+        capacity (int):
+            The maximum number of records kept.
+        audio (str):
+            "hash" or "full", see `FLIGHT_RECORDER_AUDIO_MODES`.
+    """
+
+    def __init__(self, root_dir: str, threshold: float, capacity: int = 100, audio: str = "hash"):
+        if audio not in FLIGHT_RECORDER_AUDIO_MODES:
+            raise ValueError(f"Unknown audio mode '{audio}', expected one of {', '.join(FLIGHT_RECORDER_AUDIO_MODES)}")
+        self.root_dir = root_dir
+        self.threshold = threshold
+        self.capacity = max(capacity, 1)
+        self.audio = audio
+        self._lock = threading.Lock()
+        # Generations of the running requests, keyed by their RequestTimings
+        self._pending: "weakref.WeakKeyDictionary[Any, List[Dict[str, Any]]]" = weakref.WeakKeyDictionary()
+        self._num_finished = 0
+        self._num_recorded = 0
+        self._num_evicted = 0
+        os.makedirs(root_dir, exist_ok=True)
+        entries = sorted(
+            (entry for entry in os.scandir(root_dir) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self._records = deque(entry.path for entry in entries)
+        self._evict()
+
+    def add_generation(
+        self,
+        request_key: Any,
+        generate_kwargs: Dict[str, Any],
+        generation,
+        response=None,
+        error: Optional[BaseException] = None,
+    ):
+        """
+        Attach a finished generation to a running request.
+        Args:
+            request_key: The object identifying the request, its RequestTimings.
+            generate_kwargs: The `chat_ml_sample` and sampling arguments the generation was submitted with.
+            generation: The scheduler's GenerationRequest or the pool's PooledGenerationRequest.
+            response: The HiggsAudioResponse, None if the generation failed.
+            error: The error of a failed generation.
+        """
+        # Serialized lazily, most requests are fast and never recorded
+        entry = {
+            "generate_kwargs": generate_kwargs,
+            "queue_wait": generation.queue_wait,
+            "service_time": generation.service_time,
+            "num_steps": generation.num_steps,
+            "response": response,
+            "error": None if error is None else f"{type(error).__name__}: {error}",
+        }
+        with self._lock:
+            self._pending.setdefault(request_key, []).append(entry)
+
+    def finish(
+        self,
+        request_key: Any,
+        latency: float,
+        request_info: Dict[str, Any],
+        engine_state: Optional[Callable[[], Dict[str, Any]]] = None,
+    ) -> Optional[str]:
+        """
+        End a request, recording it if it was slow.
+        Args:
+            request_key: The object identifying the request, its RequestTimings.
+            latency: The seconds the request took.
+            request_info: The method, path, status, request body and timings of the request.
+            engine_state: Returns a snapshot of the scheduler and KV cache state, only called for recorded requests.
+        Returns:
+            The path of the record, or None if the request was not recorded.
+        """
+        with self._lock:
+            generations = self._pending.pop(request_key, [])
+            self._num_finished += 1
+        if latency < self.threshold:
+            return None
+
+        record_id = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+        record = {
+            "id": record_id,
+            "time": time.time(),
+            "latency_ms": round(latency * 1000, 1),
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "audio": self.audio,
+            **request_info,
+            "generations": [self._serialize_generation(entry) for entry in generations],
+            "engine": engine_state() if engine_state is not None else {},
+        }
+        path = os.path.join(self.root_dir, f"{record_id}.json")
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(record, f, default=str)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Failed to write flight record {path}: {e}")
+            return None
+        with self._lock:
+            self._records.append(path)
+            self._num_recorded += 1
+            self._evict()
+        logger.info(f"Recorded slow request {record_id} ({latency * 1000:.0f}ms, {len(generations)} generations)")
+        return path
+
+    def stats(self) -> dict:
+        """Return the recorder settings and counters."""
+        with self._lock:
+            return {
+                "threshold_ms": round(self.threshold * 1000, 1),
+                "capacity": self.capacity,
+                "records": len(self._records),
+                "finished": self._num_finished,
+                "recorded": self._num_recorded,
+                "evicted": self._num_evicted,
+            }
+
+    def _serialize_generation(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        generate_kwargs = dict(entry["generate_kwargs"])
+        chat_ml_sample = generate_kwargs.pop("chat_ml_sample")
+        generation = {
+            "chat_ml_sample": serialize_chat_ml_sample(chat_ml_sample, audio=self.audio),
+            "generate_kwargs": generate_kwargs,
+            "queue_wait": entry["queue_wait"],
+            "service_time": entry["service_time"],
+            "num_steps": entry["num_steps"],
+            "error": entry["error"],
+        }
+        response = entry["response"]
+        if response is not None:
+            generation.update(
+                usage=response.usage,
+                kv_bucket=response.kv_bucket,
+                audio_seconds=None if response.audio is None else len(response.audio) / response.sampling_rate,
+                timings=response.timings,
+            )
+        return generation
+
+    def _evict(self):
+        while len(self._records) > self.capacity:
+            path = self._records.popleft()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._num_evicted += 1
+
+
+def load_flight_record(path: str) -> Dict[str, Any]:
+    """Read a record written by a FlightRecorder."""
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,383 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+
+class UpstreamUnavailableError(RuntimeError):
+    """Raised when the upstream LLM is not called because its circuit is open or all request slots are busy."""
+
+
+class _RetryableError(Exception):
+    pass
+
+
+class UpstreamChatStream:
+    """
+    Iterator over the `chat.completion.chunk` objects of a streaming upstream response.
+
+    It holds a request slot of its client and the open response until the stream is exhausted, fails or is closed.
+    `close()` releases them even if iteration never started, which a generator's `finally` would not; use the stream
+    as a context manager so that callers that stop early close it.
+    """
+
+    def __init__(self, client: "UpstreamLLMClient", response: requests.Response, is_trial: bool):
+        self._client = client
+        self._response = response
+        self._is_trial = is_trial
+        self._lines = response.iter_lines(decode_unicode=True)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __iter__(self) -> "UpstreamChatStream":
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        if self._closed:
+            raise StopIteration
+        try:
+            for line in self._lines:
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                return json.loads(data)
+        except Exception:
+            if self._release(success=False):
+                self._client._count("failures")
+            raise
+        self._release(success=True)
+        raise StopIteration
+
+    def close(self):
+        """
+        Close the response and release the request slot, at most once. A caller that stops reading early says nothing
+        about the upstream's health, so it counts as a success for the circuit breaker.
+        """
+        self._release(success=True)
+
+    def __enter__(self) -> "UpstreamChatStream":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def _release(self, success: bool) -> bool:
+        """Release the slot once. Returns whether this call released it."""
+        with self._lock:
+            if self._closed:
+                return False
+            self._closed = True
+        self._response.close()
+        self._client._slots.release()
+        self._client._record_outcome(success=success, is_trial=self._is_trial)
+        return True
+
+
+class UpstreamLLMClient:
+    """
+    Pooled client for an OpenAI-compatible chat completions upstream.
+
+    One keep-alive `requests.Session` is shared by all server threads, so calls reuse pooled TCP/TLS connections.
+    On top of it:
+
+    - at most `max_concurrency` calls are in flight; callers wait up to `acquire_timeout` seconds for a slot;
+    - connection errors, timeouts, 429 and 5xx responses are retried with exponential backoff;
+    - if `hedge_delay` is set, a second identical request is sent when the first has not answered after that many
+      seconds, and whichever returns first wins;
+    - after `breaker_threshold` consecutive failed calls the circuit opens and calls fail fast for `breaker_cooldown`
+      seconds, after which a single trial call is let through;
+    - responses to calls made with `cache=True` (deterministic prompts) are kept in an exact-match LRU.
+
+    Args:
+        url (str):
+            The chat completions endpoint. Point it at a local stand-in server for testing.
+        connect_timeout (float):
+            Seconds to establish a connection.
+        read_timeout (float):
+            Seconds to wait for the response.
+        max_concurrency (int):
+            The maximum number of calls in flight, also the connection pool size.
+        acquire_timeout (float):
+            Seconds a call waits for a free slot before failing with `UpstreamUnavailableError`.
+        max_retries (int):
+            Retries after the first attempt of a call.
+        retry_backoff (float):
+            Base delay between retries, doubled on every retry.
+        hedge_delay (float, optional):
+            Seconds before a hedged duplicate request is sent. None disables hedging.
+        breaker_threshold (int):
+            Consecutive failed calls that open the circuit.
+        breaker_cooldown (float):
+            Seconds the circuit stays open.
+        cache_size (int):
+            The maximum number of cached responses. Use 0 to disable the cache.
+        cache_ttl (float):
+            Seconds a cached response stays valid.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_concurrency: int = 16,
+        acquire_timeout: float = 5.0,
+        max_retries: int = 2,
+        retry_backoff: float = 0.25,
+        hedge_delay: Optional[float] = None,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 30.0,
+        cache_size: int = 0,
+        cache_ttl: float = 3600.0,
+    ):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.hedge_delay = hedge_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency * 2)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # Hedged requests run on their own threads so the caller can wait for the first one to finish
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="upstream-llm")
+
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._consecutive_failures = 0
+        self._circuit_open_until = 0.0
+        self._trial_in_flight = False
+        self._stats = {
+            "calls": 0,
+            "failures": 0,
+            "retries": 0,
+            "hedges": 0,
+            "rejected": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+        }
+
+    def chat_completion(self, payload: Dict[str, Any], cache: bool = False) -> Dict[str, Any]:
+        """
+        Send a chat completion request.
+        Args:
+            payload: The JSON request body.
+            cache: Whether the response can be served from / stored in the response cache. Only set it for prompts
+                whose response is deterministic (fixed seed or zero temperature).
+        Returns:
+            The decoded JSON response.
+        Raises:
+            UpstreamUnavailableError: If the circuit is open or no request slot frees up in time.
+            requests.RequestException: If the call failed after all retries.
+        """
+        cache_key = self._cache_key(payload) if cache and self.cache_size > 0 else None
+        if cache_key is not None:
+            response = self._cache_get(cache_key)
+            if response is not None:
+                return response
+
+        is_trial = self._admit()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self._count("rejected")
+            self._release_trial(is_trial)
+            raise UpstreamUnavailableError(f"All {self.max_concurrency} upstream request slots are busy")
+        try:
+            self._count("calls")
+            response = self._call_with_retries(self._call_hedged, payload)
+        except Exception:
+            self._count("failures")
+            self._record_outcome(success=False, is_trial=is_trial)
+            raise
+        finally:
+            self._slots.release()
+        self._record_outcome(success=True, is_trial=is_trial)
+
+        if cache_key is not None:
+            self._cache_put(cache_key, response)
+        return response
+
+    def stream_chat_completion(self, payload: Dict[str, Any]) -> UpstreamChatStream:
+        """
+        Send a streaming chat completion request (`"stream": true`) and iterate its server-sent event chunks.
+        Connecting is retried like `chat_completion()`; once the response has started, errors are raised to the
+        caller. Streams are neither hedged nor cached. The slot is taken and the connection opened before this returns;
+        the returned stream holds them until it is exhausted or closed.
+        Args:
+            payload: The JSON request body.
+        Returns:
+            An UpstreamChatStream iterating the decoded `chat.completion.chunk` objects.
+        Raises:
+            UpstreamUnavailableError: If the circuit is open or no request slot frees up in time.
+            requests.RequestException: If the call failed after all retries.
+        """
+        is_trial = self._admit()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self._count("rejected")
+            self._release_trial(is_trial)
+            raise UpstreamUnavailableError(f"All {self.max_concurrency} upstream request slots are busy")
+        try:
+            self._count("calls")
+            response = self._call_with_retries(self._open_stream, dict(payload, stream=True))
+        except Exception:
+            self._count("failures")
+            self._slots.release()
+            self._record_outcome(success=False, is_trial=is_trial)
+            raise
+        return UpstreamChatStream(self, response, is_trial)
+
+    def stats(self) -> dict:
+        """Return call counters, cache counters and the circuit state."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["circuit_open"] = time.monotonic() < self._circuit_open_until
+            stats["consecutive_failures"] = self._consecutive_failures
+            stats["cache_entries"] = len(self._cache)
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+    def _admit(self) -> bool:
+        """Fail fast while the circuit is open. Returns whether this call is the half-open trial."""
+        with self._lock:
+            if self._consecutive_failures < self.breaker_threshold:
+                return False
+            if time.monotonic() < self._circuit_open_until or self._trial_in_flight:
+                self._stats["rejected"] += 1
+                raise UpstreamUnavailableError("Upstream circuit is open after repeated failures")
+            self._trial_in_flight = True
+            return True
+
+    def _release_trial(self, is_trial: bool):
+        if is_trial:
+            with self._lock:
+                self._trial_in_flight = False
+
+    def _record_outcome(self, success: bool, is_trial: bool):
+        with self._lock:
+            if is_trial:
+                self._trial_in_flight = False
+            if success:
+                self._consecutive_failures = 0
+                return
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.breaker_threshold:
+                self._circuit_open_until = time.monotonic() + self.breaker_cooldown
+                logger.warning(
+                    f"Opening upstream circuit for {self.breaker_cooldown:.0f}s after "
+                    f"{self._consecutive_failures} consecutive failures"
+                )
+
+    def _call_with_retries(self, call: Callable[[Dict[str, Any]], Any], payload: Dict[str, Any]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call(payload)
+            except _RetryableError as e:
+                error = e.__cause__ or e
+                if attempt == self.max_retries:
+                    raise error
+                self._count("retries")
+                delay = self.retry_backoff * (2**attempt)
+                logger.warning(f"Upstream call failed ({error}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _call_hedged(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if self.hedge_delay is None:
+            return self._post(payload)
+
+        pending = {self._executor.submit(self._post, payload)}
+        done, pending = wait(pending, timeout=self.hedge_delay)
+        if not done:
+            self._count("hedges")
+            pending.add(self._executor.submit(self._post, payload))
+
+        # Return the first successful response, fail only when every request failed
+        error: Optional[BaseException] = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = self._session.post(self.url, json=payload, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise _RetryableError() from e
+        self._raise_for_status(response)
+        return response.json()
+
+    def _open_stream(self, payload: Dict[str, Any]) -> requests.Response:
+        try:
+            response = self._session.post(self.url, json=payload, timeout=self.timeout, stream=True)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise _RetryableError() from e
+        try:
+            self._raise_for_status(response)
+        except Exception:
+            response.close()
+            raise
+        return response
+
+    @staticmethod
+    def _raise_for_status(response: requests.Response):
+        if response.status_code == 429 or response.status_code >= 500:
+            try:
+                response.raise_for_status()
+            except requests.HTTPError as e:
+                raise _RetryableError() from e
+        response.raise_for_status()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _cache_key(self, payload: Dict[str, Any]) -> str:
+        # Credentials do not change the response
+        payload = {k: v for k, v in payload.items() if k != "token"}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.cache_ttl:
+                self._cache.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self._cache[key]
+            self._stats["cache_misses"] += 1
+            return None
+
+    def _cache_put(self, key: str, response: Dict[str, Any]):
+        with self._lock:
+            self._cache[key] = (time.monotonic(), response)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
@@ -0,0 +1,173 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Sequence, Tuple
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """A metric family, one value (or histogram) per combination of label values."""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: Tuple[str, ...], value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float, **labels):
+        """Mirror a cumulative count kept elsewhere, e.g. in a component's `stats()`."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down."""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed cumulative buckets.
+    Args:
+        buckets (Sequence[float]):
+            The upper bounds of the buckets, in increasing order. The +Inf bucket is added.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non cumulative) counts, the sum and the count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, key: Tuple[str, ...], state) -> List[str]:
+        counts, total, num_observed = state
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {num_observed}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    A minimal Prometheus registry, rendered in the text exposition format (version 0.0.4).
+
+    Metrics updated as events happen are recorded directly; values that other components already keep in their
+    `stats()` are copied into gauges and counters by collectors, which run before every scrape.
+    """
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, namespace: str = ""):
+        self.namespace = namespace
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self._full_name(name), documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self._full_name(name), documentation, label_names))
+
+    def histogram(
+        self, name: str, documentation: str, buckets: Sequence[float], label_names: Sequence[str] = ()
+    ) -> Histogram:
+        return self._register(Histogram(self._full_name(name), documentation, buckets, label_names))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Register a function that updates metrics from component state right before each scrape."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Run the collectors and return every metric in the text exposition format."""
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+        for collector in collectors:
+            collector()
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _full_name(self, name: str) -> str:
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+        return metric
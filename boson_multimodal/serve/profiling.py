@@ -0,0 +1,250 @@
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+
+# Labelled regions summarized in every capture. Flask handlers are labelled "flask.<endpoint>"
+PROFILED_REGIONS = (
+    "HiggsAudioModel._forward_core",
+    "HiggsAudioModel._sample_audio_tokens",
+    "HiggsAudioTokenizer.decode",
+    "flask.",
+)
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when a capture is requested while another one is running."""
+
+
+class ProfilerUnavailableError(RuntimeError):
+    """Raised when the installed torch cannot profile the threads of the serving process."""
+
+
+@dataclass
+class ProfilerCaptureInfo:
+    """A profiler capture, its window and the files it wrote."""
+
+    id: str
+    # Capture window: the first of `seconds` elapsed or `requests` requests finished
+    seconds: float
+    requests: Optional[int]
+    with_stack: bool
+    status: str = "starting"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    num_requests: int = 0
+    trace_path: Optional[str] = None
+    summary_path: Optional[str] = None
+    error: Optional[str] = None
+
+
+def summarize_profile(events, regions=PROFILED_REGIONS, row_limit: int = 20) -> str:
+    """
+    Summarize the operators spent inside each labelled region of a profile.
+    Args:
+        events: The profiler's FunctionEvents, `profile.events()`.
+        regions: The region labels, a label ending with "." matches every label with that prefix.
+        row_limit: The number of operators listed per region.
+    Returns:
+        A text report with the calls and total time of each region, and its top operators by self CPU time.
+    """
+    lines = []
+    for region in regions:
+        region_events = [
+            event for event in events
+            if (event.name.startswith(region) if region.endswith(".") else event.name == region)
+        ]
+        if not region_events:
+            lines.append(f"== {region}: not seen\n")
+            continue
+        names = sorted({event.name for event in region_events})
+        total_us = sum(event.cpu_time_total for event in region_events)
+        lines.append(
+            f"== {region} ({', '.join(names)}): {len(region_events)} calls, "
+            f"{total_us / 1000:.1f}ms CPU total, {total_us / len(region_events) / 1000:.3f}ms per call"
+        )
+        # Self time of every operator run inside the region, nested regions included
+        operators: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        for event in region_events:
+            pending = list(event.cpu_children)
+            while pending:
+                child = pending.pop()
+                operators[child.name][0] += 1
+                operators[child.name][1] += child.self_cpu_time_total
+                pending.extend(child.cpu_children)
+        own_us = sum(event.self_cpu_time_total for event in region_events)
+        operators["(region self time)"] = [len(region_events), own_us]
+        lines.append(f"   {'operator':<60} {'calls':>8} {'self CPU':>12} {'share':>7}")
+        for name, (calls, self_us) in sorted(operators.items(), key=lambda item: -item[1][1])[:row_limit]:
+            share = self_us / total_us * 100 if total_us else 0.0
+            lines.append(f"   {name[:60]:<60} {calls:>8} {self_us / 1000:>10.2f}ms {share:>6.1f}%")
+        lines.append("")
+    return "\n".join(lines)
+
+
+class ProfilerCapture:
+    """
+    Arms `torch.profiler` on a running serving process for the next N seconds or the next N requests.
+
+    A capture profiles CPU activity of every thread of the process (the scheduler worker, request handlers and
+    encoders), with input shapes and, optionally, Python stacks. It runs on a thread of its own; when its window
+    closes, it writes a Chrome/Perfetto trace and a summary of the top operators inside the labelled regions
+    (`PROFILED_REGIONS`) to `root_dir`. Only one capture runs at a time. Request handlers are labelled and counted
+    with `begin_request()` / `end_request()`.
+
+    Args:
+        root_dir (str):
+            The directory receiving the traces and summaries. Created on the first capture.
+        max_seconds (float):
+            The longest capture window, also the bound of a window counted in requests.
+        max_captures (int):
+            The number of past captures listed by `captures()`; their files are kept.
+        row_limit (int):
+            The operators listed per region in the summaries.
+    """
+
+    def __init__(self, root_dir: str, max_seconds: float = 120.0, max_captures: int = 20, row_limit: int = 20):
+        self.root_dir = root_dir
+        self.max_seconds = max_seconds
+        self.max_captures = max_captures
+        self.row_limit = row_limit
+        self._lock = threading.Lock()
+        self._active: Optional[ProfilerCaptureInfo] = None
+        # Set once the profiler is recording, requests starting before are not counted
+        self._recording = threading.Event()
+        self._done = threading.Event()
+        self._captures: List[ProfilerCaptureInfo] = []
+
+    def start(self, seconds: Optional[float] = None, requests: Optional[int] = None, with_stack: bool = True) -> ProfilerCaptureInfo:
+        """
+        Arm the profiler.
+        Args:
+            seconds: The length of the capture window, at most `max_seconds`.
+            requests: Close the window once this many requests started after arming have finished.
+            with_stack: Whether to record the Python stack of every operator.
+        Returns:
+            The ProfilerCaptureInfo of the capture, updated as it progresses.
+        Raises:
+            ValueError: If the window is invalid.
+            ProfilerBusyError: If a capture is already running.
+            ProfilerUnavailableError: If the installed torch cannot profile all threads.
+        """
+        if seconds is None and requests is None:
+            raise ValueError("A capture needs 'seconds' or 'requests'")
+        if seconds is not None and not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"'seconds' must be in (0, {self.max_seconds:g}]")
+        if requests is not None and requests < 1:
+            raise ValueError("'requests' must be at least 1")
+        experimental_config = self._experimental_config()
+        with self._lock:
+            if self._active is not None:
+                raise ProfilerBusyError(f"Capture {self._active.id} is still running")
+            capture = ProfilerCaptureInfo(
+                id=f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}",
+                seconds=min(seconds or self.max_seconds, self.max_seconds),
+                requests=requests,
+                with_stack=with_stack,
+            )
+            self._active = capture
+            self._recording.clear()
+            self._done.clear()
+            self._captures.append(capture)
+            del self._captures[: -self.max_captures]
+        threading.Thread(
+            target=self._run, args=(capture, experimental_config), name="profiler-capture", daemon=True
+        ).start()
+        logger.info(f"Profiler capture {capture.id} armed for {capture.seconds:g}s / {requests} requests")
+        return capture
+
+    def captures(self) -> List[Dict[str, Any]]:
+        """Return the running and past captures, latest first."""
+        with self._lock:
+            return [asdict(capture) for capture in reversed(self._captures)]
+
+    def get(self, capture_id: str) -> Optional[ProfilerCaptureInfo]:
+        """Return a capture by id, None if unknown."""
+        with self._lock:
+            return next((capture for capture in self._captures if capture.id == capture_id), None)
+
+    def begin_request(self, name: str):
+        """
+        Label a request handler while a capture records, called at the start of the request.
+        Returns:
+            A handle to pass to `end_request()`, None if no capture is recording.
+        """
+        capture = self._active
+        if capture is None or not self._recording.is_set():
+            return None
+        import torch
+
+        region = torch.autograd.profiler.record_function(name)
+        region.__enter__()
+        return capture, region
+
+    def end_request(self, handle):
+        """Close the label opened by `begin_request()` and count the request against its capture's window."""
+        if handle is None:
+            return
+        capture, region = handle
+        region.__exit__(None, None, None)
+        with self._lock:
+            if capture is not self._active:
+                return
+            capture.num_requests += 1
+            if capture.requests is not None and capture.num_requests >= capture.requests:
+                self._done.set()
+
+    def _experimental_config(self):
+        try:
+            from torch.profiler import _ExperimentalConfig
+
+            return _ExperimentalConfig(profile_all_threads=True)
+        except (ImportError, TypeError) as e:
+            raise ProfilerUnavailableError(f"This torch version cannot profile all threads: {e}")
+
+    def _run(self, capture: ProfilerCaptureInfo, experimental_config):
+        try:
+            from torch.profiler import ProfilerActivity, profile
+
+            os.makedirs(self.root_dir, exist_ok=True)
+            with profile(
+                activities=[ProfilerActivity.CPU],
+                record_shapes=True,
+                with_stack=capture.with_stack,
+                experimental_config=experimental_config,
+            ) as profiler:
+                capture.status = "recording"
+                capture.started_at = time.time()
+                self._recording.set()
+                self._done.wait(capture.seconds)
+                self._recording.clear()
+            capture.status = "exporting"
+            capture.finished_at = time.time()
+            trace_path = os.path.join(self.root_dir, f"{capture.id}.trace.json")
+            profiler.export_chrome_trace(trace_path)
+            capture.trace_path = trace_path
+
+            window = f"{capture.finished_at - capture.started_at:.1f}s, {capture.num_requests} requests"
+            summary = summarize_profile(profiler.events(), row_limit=self.row_limit)
+            top_operators = profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=self.row_limit)
+            summary_path = os.path.join(self.root_dir, f"{capture.id}.summary.txt")
+            with open(summary_path, "w") as f:
+                f.write(f"Profiler capture {capture.id} ({window})\n\n{summary}\n== All operators\n{top_operators}\n")
+            capture.summary_path = summary_path
+            capture.status = "completed"
+            logger.info(f"Profiler capture {capture.id} written to {trace_path} ({window})")
+        except Exception as e:
+            logger.exception(f"Profiler capture {capture.id} failed")
+            capture.status = "failed"
+            capture.error = f"{type(e).__name__}: {e}"
+        finally:
+            self._recording.clear()
+            with self._lock:
+                self._active = None
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+from loguru import logger
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a TTS input: NFC unicode with whitespace runs collapsed."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def make_cache_key(text: str, voice: str, reference_audio: Optional[bytes] = None, **params: Any) -> str:
+    """
+    Content address of a TTS result.
+    Args:
+        text: The text to speak, normalized before hashing.
+        voice: The voice name or registered voice id.
+        reference_audio: Optional voice cloning reference clip, hashed into the key.
+        params: Everything else that changes the output (sampling parameters, seed, speed). Must be JSON serializable.
+    Returns:
+        A hex sha256 digest.
+    """
+    payload = {
+        "text": normalize_text(text),
+        "voice": voice,
+        "reference_audio": hashlib.sha256(reference_audio).hexdigest() if reference_audio else None,
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class AudioResultCache:
+    """
+    Two-tier cache of generated waveforms: an in-memory LRU in front of a size-bounded on-disk store.
+
+    Entries are float32 waveforms keyed by `make_cache_key()`. Results are only reproducible, and therefore only
+    worth caching, when the generation is seeded. Disk entries are `<disk_dir>/<key>.npy` files evicted
+    least-recently-used first, using the file modification time which is refreshed on every hit.
+
+    Args:
+        max_memory_bytes (int):
+            The size bound of the in-memory tier. Use 0 to disable it.
+        disk_dir (str, optional):
+            The directory of the on-disk tier. Use None to disable it.
+        max_disk_bytes (int):
+            The size bound of the on-disk tier.
+    """
+
+    def __init__(self, max_memory_bytes: int = 256 << 20, disk_dir: Optional[str] = None, max_disk_bytes: int = 1 << 30):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(disk_dir) if entry.name.endswith(".npy"))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the cached waveform of a key, or None on a miss."""
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                return audio
+
+        audio = self._disk_get(key)
+        with self._lock:
+            if audio is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+            self._memory_put(key, audio)
+        return audio
+
+    def put(self, key: str, audio: np.ndarray):
+        """Store a waveform in both tiers."""
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        with self._lock:
+            self._memory_put(key, audio)
+        self._disk_put(key, audio)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the size of each tier."""
+        with self._lock:
+            num_lookups = self._memory_hits + self._disk_hits + self._misses
+            return {
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": (self._memory_hits + self._disk_hits) / num_lookups if num_lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _memory_put(self, key: str, audio: np.ndarray):
+        if audio.nbytes > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous.nbytes
+        self._memory[key] = audio
+        self._memory_bytes += audio.nbytes
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.npy")
+
+    def _disk_get(self, key: str) -> Optional[np.ndarray]:
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            audio = np.load(path)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._disk_remove(path)
+            return None
+        return audio
+
+    def _disk_put(self, key: str, audio: np.ndarray):
+        if self.disk_dir is None or audio.nbytes > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, audio)
+            size = os.path.getsize(tmp_path)
+            existed = os.path.exists(path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {path}: {e}")
+            return
+        with self._lock:
+            if not existed:
+                self._disk_bytes += size
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        try:
+            entries = sorted(
+                (entry for entry in os.scandir(self.disk_dir) if entry.name.endswith(".npy")),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+        except FileNotFoundError:
+            # An entry was removed by a concurrent eviction, the next put retries
+            return
+        for entry in entries:
+            with self._lock:
+                if self._disk_bytes <= self.max_disk_bytes:
+                    return
+            self._disk_remove(entry.path)
+
+    def _disk_remove(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
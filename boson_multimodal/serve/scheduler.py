@@ -0,0 +1,552 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from ..data_types import AudioContent, ChatMLSample, TextContent
+
+if TYPE_CHECKING:
+    # Only for annotations, so that importing the scheduler does not load torch and transformers
+    from .serve_engine import HiggsAudioServeEngine, HiggsAudioResponse, HiggsAudioGenerationSequence
+
+
+class SchedulerQueueFullError(RuntimeError):
+    """Raised when a request is submitted while the scheduler queue is at capacity."""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a request's deadline passes before the worker could start it."""
+
+
+class GenerationCancelledError(RuntimeError):
+    """Raised when a request is cancelled while it runs, e.g. because its client disconnected."""
+
+
+# Priority classes, lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_CLASSES = {"interactive": PRIORITY_INTERACTIVE, "bulk": PRIORITY_BULK}
+
+
+class AdmissionRejectedError(SchedulerQueueFullError):
+    """Raised when the projected queue delay of a request exceeds the scheduler's latency objective."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Rough cost model of a generation, in decode steps
+_AUDIO_TOKENS_PER_SECOND = 25
+# Speaking rate of the generated speech
+_CHARS_PER_SECOND = 14
+# Prompt tokens are prefilled in one forward pass, far cheaper per token than decoding
+_PREFILL_TOKENS_PER_STEP = 64
+# Bitrate assumed for reference audio of unknown format (128 kbit/s)
+_REFERENCE_AUDIO_BYTES_PER_SECOND = 16000
+# Weight of the latest measurement in the decode throughput average
+_THROUGHPUT_EMA = 0.05
+
+
+def estimate_generation_tokens(chat_ml_sample: ChatMLSample, max_new_tokens: int, num_codebooks: int = 8) -> float:
+    """
+    Estimate the cost of a TTS generation in decode steps, before running it.
+    Args:
+        chat_ml_sample: The chatml sample. The last message's text is what gets spoken.
+        max_new_tokens: The generation limit.
+        num_codebooks: The number of audio codebooks, the delay pattern adds one step per codebook.
+    Returns:
+        The expected number of decode steps, plus the prefill of the prompt and reference audio in decode step
+        equivalents.
+    """
+    prompt_tokens = 0.0
+    spoken_chars = 0
+    for message in chat_ml_sample.messages:
+        contents = message.content if isinstance(message.content, list) else [message.content]
+        spoken_chars = 0
+        for content in contents:
+            if isinstance(content, str):
+                text = content
+            elif isinstance(content, TextContent):
+                text = content.text
+            elif isinstance(content, AudioContent):
+                if content.audio_codes is not None:
+                    prompt_tokens += content.audio_codes.shape[-1]
+                elif content.raw_audio:
+                    num_bytes = len(content.raw_audio)
+                    if isinstance(content.raw_audio, str):
+                        num_bytes *= 3 / 4
+                    prompt_tokens += num_bytes / _REFERENCE_AUDIO_BYTES_PER_SECOND * _AUDIO_TOKENS_PER_SECOND
+                continue
+            else:
+                continue
+            # Roughly 4 characters per text token
+            prompt_tokens += len(text) / 4
+            spoken_chars += len(text)
+
+    speech_tokens = spoken_chars / _CHARS_PER_SECOND * _AUDIO_TOKENS_PER_SECOND + num_codebooks
+    return min(speech_tokens, max_new_tokens) + prompt_tokens / _PREFILL_TOKENS_PER_STEP
+
+
+@dataclass
+class GenerationRequest:
+    """A generation request that is waiting for, or being served by, the scheduler worker."""
+
+    generate_kwargs: Dict[str, Any]
+    future: Future = field(default_factory=Future)
+    enqueue_time: float = field(default_factory=time.monotonic)
+    start_time: Optional[float] = None
+    finish_time: Optional[float] = None
+    sequence: Optional["HiggsAudioGenerationSequence"] = None
+    # Estimated decode steps left, counted against the scheduler's token budget
+    remaining_tokens: float = 0.0
+    priority: int = PRIORITY_INTERACTIVE
+    # Latest time.monotonic() at which the request may start, None for no deadline
+    deadline: Optional[float] = None
+    # Set to cancel the request, checked by the worker at every token boundary
+    stop_signal: threading.Event = field(default_factory=threading.Event)
+    # Decode steps run so far
+    num_steps: int = 0
+
+    @property
+    def queue_wait(self) -> Optional[float]:
+        """Seconds spent in the queue before the worker picked the request up."""
+        if self.start_time is None:
+            return None
+        return self.start_time - self.enqueue_time
+
+    @property
+    def service_time(self) -> Optional[float]:
+        """Seconds between the request starting to decode and its response being ready."""
+        if self.start_time is None or self.finish_time is None:
+            return None
+        return self.finish_time - self.start_time
+
+    @property
+    def cancelled(self) -> bool:
+        return self.stop_signal.is_set()
+
+    def cancel(self):
+        """
+        Cancel the request. A queued request is dropped from the queue; a running one stops at the next token
+        boundary, frees its KV cache slot and fails with `GenerationCancelledError`. Its streamer is ended either way.
+        """
+        self.stop_signal.set()
+        self.future.cancel()
+
+    def result(self, timeout: Optional[float] = None) -> "HiggsAudioResponse":
+        return self.future.result(timeout=timeout)
+
+
+class HiggsAudioRequestScheduler:
+    """
+    Serializes access to a shared HiggsAudioServeEngine and interleaves its requests at token boundaries.
+
+    The engine's KV caches and CUDA graphs must never be used from two threads at once. The scheduler owns a bounded
+    request queue and a single generation worker thread; callers from any thread submit requests and wait on
+    per-request futures.
+
+    At every token boundary, queued requests start while the engine has free KV cache slots
+    (`HiggsAudioServeEngine(max_batch_size=...)`), every running sequence is advanced by one token, and finished
+    sequences release their slot and resolve their futures. Each sequence still runs its own batch-1 forward pass, so
+    running several at once does not raise the aggregate token throughput: it only lets a short or urgent request
+    start before a long one has finished, at the cost of one set of KV caches per slot.
+
+    Requests carry a priority class and an optional deadline. Queued requests are served by priority, then earliest
+    deadline, then arrival; a request whose deadline passes while it is queued is purged from the queue like a
+    cancelled one and fails with `DeadlineExceededError`.
+    Bulk requests leave `reserved_interactive_slots` KV cache slots free for interactive ones, and while interactive
+    sequences are running, bulk sequences are only advanced every `bulk_step_interval` iterations, so interactive
+    latency stays flat and bulk work fills the remaining capacity.
+
+    Requests are cancelled with `GenerationRequest.cancel()` or by setting the `stop_signal` event they were
+    submitted with (one event can be shared by all the requests of an HTTP response). Cancelled requests are purged
+    from the queue on the next submission, admission check or worker iteration, returning their queue space and token
+    budget, or stop at the next token boundary, releasing their KV cache slot.
+
+    Admission control keeps a running token budget: every request is charged its estimated cost
+    (`estimate_generation_tokens()`) when it is submitted, and the charge is paid down as the worker decodes it. The
+    projected queue delay of a priority class is the outstanding budget of that class and the ones above it divided
+    by the measured decode throughput; requests that would wait longer than `max_queue_delay` are rejected with
+    `AdmissionRejectedError`, so bulk work is shed before interactive work.
+
+    Args:
+        engine (HiggsAudioServeEngine):
+            The engine that runs the generations.
+        max_queue_size (int):
+            The maximum number of requests waiting for the worker. Submitting beyond it raises
+            `SchedulerQueueFullError`. Use <= 0 for an unbounded queue.
+        max_queue_delay (float, optional):
+            The latency objective in seconds for the projected queue delay. None disables admission control.
+        initial_tokens_per_second (float):
+            The decode throughput assumed until the worker has measured it.
+        reserved_interactive_slots (int):
+            KV cache slots bulk requests may not take. Capped at `max_batch_size - 1`.
+        bulk_step_interval (int):
+            While interactive sequences run, bulk sequences are advanced once every this many iterations.
+        on_complete (Callable[[GenerationRequest, HiggsAudioResponse], None], optional):
+            Called on the worker thread with every completed request and its response, before its future resolves,
+            e.g. to record metrics. Must be fast, it holds up the decode loop.
+    """
+
+    def __init__(
+        self,
+        engine: "HiggsAudioServeEngine",
+        max_queue_size: int = 64,
+        max_queue_delay: Optional[float] = None,
+        initial_tokens_per_second: float = 50.0,
+        reserved_interactive_slots: int = 0,
+        bulk_step_interval: int = 4,
+        on_complete: Optional[Callable[[GenerationRequest, "HiggsAudioResponse"], None]] = None,
+    ):
+        self.engine = engine
+        self.on_complete = on_complete
+        self.max_queue_size = max_queue_size
+        self.max_queue_delay = max_queue_delay
+        self.reserved_interactive_slots = min(reserved_interactive_slots, engine.max_batch_size - 1)
+        self.bulk_step_interval = max(bulk_step_interval, 1)
+        # Heap of (priority, deadline, arrival, request), guarded by the condition
+        self._pending: List[tuple] = []
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._stats_lock = threading.Lock()
+        self._outstanding_tokens = {priority: 0.0 for priority in PRIORITY_CLASSES.values()}
+        self._num_queued = {priority: 0 for priority in PRIORITY_CLASSES.values()}
+        self._tokens_per_second = initial_tokens_per_second
+        self._num_submitted = 0
+        self._num_rejected = 0
+        self._num_shed = 0
+        self._num_deadline_exceeded = 0
+        self._num_cancelled = 0
+        self._num_cancelled_steps = 0
+        self._cancelled_saved_tokens = 0.0
+        self._num_completed = 0
+        self._num_failed = 0
+        self._num_active = 0
+        self._total_queue_wait = 0.0
+        self._total_service_time = 0.0
+        self._worker = threading.Thread(target=self._run, name="higgs-audio-generation", daemon=True)
+        self._worker.start()
+
+    def submit(
+        self,
+        chat_ml_sample: ChatMLSample,
+        priority: int = PRIORITY_INTERACTIVE,
+        deadline: Optional[float] = None,
+        enforce_slo: bool = True,
+        stop_signal: Optional[threading.Event] = None,
+        **generate_kwargs,
+    ) -> GenerationRequest:
+        """
+        Queue a generation request.
+        Args:
+            chat_ml_sample: A chatml sample.
+            priority: The priority class, `PRIORITY_INTERACTIVE` or `PRIORITY_BULK`.
+            deadline: Optional `time.monotonic()` time by which the request must have started.
+            enforce_slo: Whether to reject the request when the projected queue delay exceeds `max_queue_delay`.
+                Pass False for follow-up work of a request that was already admitted.
+            stop_signal: Optional event that cancels the request once set. A new one is created when omitted.
+            generate_kwargs: Keyword arguments forwarded to `HiggsAudioServeEngine.start_sequence()`.
+        Returns:
+            The queued GenerationRequest. Call `result()` on it to wait for the HiggsAudioResponse.
+        """
+        if priority not in self._num_queued:
+            raise ValueError(f"Unknown priority {priority}")
+        request = GenerationRequest(
+            generate_kwargs=dict(chat_ml_sample=chat_ml_sample, **generate_kwargs),
+            priority=priority,
+            deadline=deadline,
+        )
+        if stop_signal is not None:
+            request.stop_signal = stop_signal
+        request.generate_kwargs["stop_signal"] = request.stop_signal
+        request.remaining_tokens = estimate_generation_tokens(
+            chat_ml_sample,
+            generate_kwargs.get("max_new_tokens", 1024),
+            num_codebooks=self.engine.audio_num_codebooks,
+        )
+        if enforce_slo:
+            self.check_admission(priority)
+        self._purge_pending()
+        with self._cond:
+            if 0 < self.max_queue_size <= len(self._pending):
+                with self._stats_lock:
+                    self._num_rejected += 1
+                raise SchedulerQueueFullError(f"Generation queue is full ({self.max_queue_size} pending requests)")
+            entry = (priority, math.inf if deadline is None else deadline, next(self._arrivals), request)
+            heapq.heappush(self._pending, entry)
+            with self._stats_lock:
+                self._num_submitted += 1
+                self._num_queued[priority] += 1
+                self._outstanding_tokens[priority] += request.remaining_tokens
+            self._cond.notify()
+        return request
+
+    @property
+    def max_batch_size(self) -> int:
+        """The number of sequences decoded concurrently."""
+        return self.engine.max_batch_size
+
+    def kv_cache_stats(self) -> dict:
+        """Return the KV cache slot and bucket usage of the engine."""
+        return self.engine.kv_cache_stats()
+
+    def projected_queue_delay(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Seconds a request of the priority class submitted now is expected to wait before it starts decoding."""
+        with self._stats_lock:
+            return self._projected_queue_delay(priority)
+
+    def check_admission(self, priority: int = PRIORITY_INTERACTIVE):
+        """Raise `AdmissionRejectedError` if a request submitted now would miss the queue delay objective."""
+        if self.max_queue_delay is None:
+            return
+        self._purge_pending()
+        with self._stats_lock:
+            delay = self._projected_queue_delay(priority)
+            if delay <= self.max_queue_delay:
+                return
+            self._num_shed += 1
+        retry_after = max(delay - self.max_queue_delay, 1.0)
+        raise AdmissionRejectedError(
+            f"Projected queue delay {delay:.1f}s exceeds the {self.max_queue_delay:.1f}s objective", retry_after
+        )
+
+    def _projected_queue_delay(self, priority: int) -> float:
+        # Only work of the same or a more urgent class is served before a new request
+        num_queued = sum(n for p, n in self._num_queued.items() if p <= priority)
+        outstanding_tokens = sum(t for p, t in self._outstanding_tokens.items() if p <= priority)
+        free_slots = self.engine.num_free_kv_slots
+        if priority != PRIORITY_INTERACTIVE:
+            free_slots -= self.reserved_interactive_slots
+        # New requests start right away while there are more usable free KV cache slots than queued requests
+        if free_slots > num_queued:
+            return 0.0
+        return outstanding_tokens / self._tokens_per_second
+
+    def generate(
+        self, chat_ml_sample: ChatMLSample, timeout: Optional[float] = None, **generate_kwargs
+    ) -> "HiggsAudioResponse":
+        """Submit a request and block until its response is ready."""
+        return self.submit(chat_ml_sample, **generate_kwargs).result(timeout=timeout)
+
+    def stats(self) -> dict:
+        """Return queue depth and cumulative queue-wait / service-time accounting."""
+        self._purge_pending()
+        with self._stats_lock:
+            num_served = self._num_completed + self._num_failed
+            return {
+                "queue_depth": sum(self._num_queued.values()),
+                "max_queue_size": self.max_queue_size,
+                "queued": {name: self._num_queued[priority] for name, priority in PRIORITY_CLASSES.items()},
+                "submitted": self._num_submitted,
+                "rejected": self._num_rejected,
+                "shed": self._num_shed,
+                "deadline_exceeded": self._num_deadline_exceeded,
+                "cancelled": self._num_cancelled,
+                # Decode steps spent on cancelled requests, and estimated steps their cancellation saved
+                "cancelled_steps": self._num_cancelled_steps,
+                "cancelled_saved_tokens": round(self._cancelled_saved_tokens, 1),
+                "outstanding_tokens": round(sum(self._outstanding_tokens.values()), 1),
+                "tokens_per_second": round(self._tokens_per_second, 1),
+                "projected_queue_delay": {
+                    name: round(self._projected_queue_delay(priority), 3) for name, priority in PRIORITY_CLASSES.items()
+                },
+                "active": self._num_active,
+                "completed": self._num_completed,
+                "failed": self._num_failed,
+                "avg_queue_wait": self._total_queue_wait / num_served if num_served else 0.0,
+                "avg_service_time": self._total_service_time / num_served if num_served else 0.0,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker after the requests already queued have been served."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if wait:
+            self._worker.join()
+
+    def _purge_pending(self):
+        """
+        Drop the queued requests that were cancelled or whose deadline has passed, so that they do not hold queue space
+        or admission budget while every KV cache slot is busy. They are ended as if the worker had picked them up.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if not any(self._is_stale(entry, now) for entry in self._pending):
+                return
+            stale = [entry[-1] for entry in self._pending if self._is_stale(entry, now)]
+            self._pending = [entry for entry in self._pending if not self._is_stale(entry, now)]
+            heapq.heapify(self._pending)
+            with self._stats_lock:
+                for request in stale:
+                    self._num_queued[request.priority] -= 1
+            self._cond.notify_all()
+        # Outside the condition: ending a request resolves its future, which runs the callbacks of its waiters
+        for request in stale:
+            self._start_queued(request)
+
+    @staticmethod
+    def _is_stale(entry: tuple, now: float) -> bool:
+        _, deadline, _, request = entry
+        return deadline < now or request.cancelled or request.future.cancelled()
+
+    def _pop_admissible(self, block: bool) -> Optional[GenerationRequest]:
+        """Pop the most urgent queued request that may take a free KV cache slot now."""
+        with self._cond:
+            while True:
+                free_slots = self.engine.num_free_kv_slots
+                if self._pending and free_slots > 0:
+                    priority = self._pending[0][0]
+                    if priority == PRIORITY_INTERACTIVE or free_slots > self.reserved_interactive_slots:
+                        request = heapq.heappop(self._pending)[-1]
+                        with self._stats_lock:
+                            self._num_queued[request.priority] -= 1
+                        return request
+                if not block or self._stopping:
+                    return None
+                self._cond.wait()
+
+    def _run(self):
+        active: List[GenerationRequest] = []
+        iteration = 0
+        while True:
+            self._purge_pending()
+            # New requests start at the token boundary while there are free KV cache slots
+            while True:
+                request = self._pop_admissible(block=not active)
+                if request is None:
+                    break
+                self._admit(request, active)
+
+            # Cancelled sequences stop before spending another step, paused bulk ones included
+            for request in [r for r in active if r.cancelled]:
+                active.remove(request)
+                self._cancel(request)
+
+            if not active:
+                with self._cond:
+                    if self._stopping and not self._pending:
+                        break
+                continue
+
+            # Advance the running sequences by one token each, finished ones release their slot. Bulk sequences yield
+            # their turn to interactive ones on most iterations
+            iteration += 1
+            stepping = active
+            if iteration % self.bulk_step_interval and any(r.priority == PRIORITY_INTERACTIVE for r in active):
+                stepping = [r for r in active if r.priority == PRIORITY_INTERACTIVE]
+            step_start = time.monotonic()
+            num_steps = len(stepping)
+            for request in list(stepping):
+                try:
+                    finished = self.engine.step(request.sequence)
+                    request.num_steps += 1
+                    self._charge(request, 1)
+                    if not finished:
+                        continue
+                    if request.cancelled:
+                        # Stopped by the stop signal, skip decoding the audio nobody is waiting for
+                        active.remove(request)
+                        self._cancel(request)
+                        continue
+                    response = self.engine.finish_sequence(request.sequence)
+                except Exception as e:
+                    self.engine.release_sequence(request.sequence)
+                    active.remove(request)
+                    self._fail(request, e)
+                else:
+                    active.remove(request)
+                    self._complete(request, response)
+            step_time = time.monotonic() - step_start
+            with self._stats_lock:
+                self._num_active = len(active)
+                if step_time > 0:
+                    # Exponential moving average of the decode throughput over all running sequences
+                    self._tokens_per_second += _THROUGHPUT_EMA * (num_steps / step_time - self._tokens_per_second)
+
+    def _charge(self, request: GenerationRequest, num_tokens: float):
+        """Pay down the budget of a request by the decode steps it used, at most its remaining estimate."""
+        num_tokens = min(num_tokens, request.remaining_tokens)
+        request.remaining_tokens -= num_tokens
+        with self._stats_lock:
+            self._outstanding_tokens[request.priority] -= num_tokens
+
+    def _start_queued(self, request: GenerationRequest) -> bool:
+        """
+        Take a request off the queue. Requests that were cancelled or whose deadline has passed are ended instead.
+        Returns whether the request may start.
+        """
+        # Requests that never start still end their streamer so that its consumer does not wait forever
+        streamer = request.generate_kwargs.get("streamer")
+        request.start_time = time.monotonic()
+        if not request.future.set_running_or_notify_cancel() or request.cancelled:
+            if streamer is not None:
+                streamer.end()
+            self._cancel(request)
+            return False
+        if request.deadline is not None and request.start_time > request.deadline:
+            with self._stats_lock:
+                self._num_deadline_exceeded += 1
+            if streamer is not None:
+                streamer.end()
+            self._fail(request, DeadlineExceededError(f"Deadline passed after {request.queue_wait:.3f}s in the queue"))
+            return False
+        return True
+
+    def _admit(self, request: GenerationRequest, active: List[GenerationRequest]):
+        if not self._start_queued(request):
+            return
+        try:
+            request.sequence = self.engine.start_sequence(**request.generate_kwargs)
+        except Exception as e:
+            self._fail(request, e)
+        else:
+            active.append(request)
+
+    def _cancel(self, request: GenerationRequest):
+        if request.sequence is not None:
+            self.engine.release_sequence(request.sequence)
+        request.finish_time = time.monotonic()
+        with self._stats_lock:
+            self._num_cancelled += 1
+            self._num_cancelled_steps += request.num_steps
+            self._cancelled_saved_tokens += request.remaining_tokens
+        self._charge(request, request.remaining_tokens)
+        if request.future.running():
+            request.future.set_exception(GenerationCancelledError(f"Cancelled after {request.num_steps} decode steps"))
+        if request.sequence is not None:
+            logger.info(f"Cancelled generation after {request.num_steps} decode steps, freed KV cache slot")
+
+    def _complete(self, request: GenerationRequest, response: "HiggsAudioResponse"):
+        request.finish_time = time.monotonic()
+        self._record(request, failed=False)
+        if self.on_complete is not None:
+            try:
+                self.on_complete(request, response)
+            except Exception:
+                logger.exception("Generation completion hook failed")
+        request.future.set_result(response)
+
+    def _fail(self, request: GenerationRequest, error: Exception):
+        request.finish_time = time.monotonic()
+        logger.opt(exception=error).error(f"Generation failed after {request.service_time:.3f}s")
+        self._record(request, failed=True)
+        request.future.set_exception(error)
+
+    def _record(self, request: GenerationRequest, failed: bool):
+        self._charge(request, request.remaining_tokens)
+        with self._stats_lock:
+            if failed:
+                self._num_failed += 1
+            else:
+                self._num_completed += 1
+            self._total_queue_wait += request.queue_wait
+            self._total_service_time += request.service_time
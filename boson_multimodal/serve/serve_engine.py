@@ -3,24 +3,30 @@ import base64
 import torch
 import numpy as np
 from io import BytesIO
-from dataclasses import dataclass
-from typing import List, Optional, Union
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
 from copy import deepcopy
 from transformers import AutoTokenizer, AutoProcessor
 from transformers.cache_utils import StaticCache
+from transformers.generation import GenerationConfig, LogitsProcessorList, StoppingCriteriaList
+from transformers.generation.logits_process import TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
 from transformers.generation.streamers import BaseStreamer
-from transformers.generation.stopping_criteria import StoppingCriteria
+from transformers.generation.stopping_criteria import MaxLengthCriteria, StoppingCriteria, StopStringCriteria
 from dataclasses import asdict
 from loguru import logger
 import threading
+import queue
+import time
 import librosa
 
 
 from ..dataset.chatml_dataset import ChatMLSample, ChatMLDatasetSample, prepare_chatml_sample
-from ..model.higgs_audio import HiggsAudioModel
+from ..model.higgs_audio import HiggsAudioConfig, HiggsAudioModel
+from ..model.higgs_audio.modeling_higgs_audio import HiggsAudioDecodeState
 from ..model.higgs_audio.utils import revert_delay_pattern
 from ..data_collator.higgs_audio_collator import HiggsAudioSampleCollator
 from ..audio_processing.higgs_audio_tokenizer import load_higgs_audio_tokenizer
+from .shared_weights import load_shared_module, snapshot_path
 
 
 @dataclass
@@ -33,7 +39,100 @@ class HiggsAudioStreamerDelta:
     finish_reason: Optional[str] = None
 
 
-class AsyncHiggsAudioStreamer(BaseStreamer):
+class HiggsAudioStreamer(BaseStreamer):
+    """
+    Streamer that handles both text and audio token generation from Higgs-Audio model.
+    Stores chunks in a thread-safe queue so that a synchronous consumer can iterate over them while the generation
+    runs on another thread.
+
+    Parameters:
+        tokenizer (`AutoTokenizer`):
+            The tokenizer used to decode text tokens.
+        skip_prompt (`bool`, *optional*, defaults to `False`):
+            Whether to skip the prompt tokens in generation.
+        timeout (`float`, *optional*):
+            The timeout for the queue. If `None`, the queue will block indefinitely.
+        decode_kwargs (`dict`, *optional*):
+            Additional keyword arguments to pass to the tokenizer's `decode` method.
+
+    Examples:
+        ```python
+        >>> streamer = HiggsAudioStreamer(engine.tokenizer, audio_num_codebooks=engine.audio_num_codebooks)
+        >>> thread = Thread(target=engine.generate, kwargs=dict(chat_ml_sample=sample, max_new_tokens=20, streamer=streamer))
+        >>> thread.start()
+        >>> for delta in streamer:
+        ...     if delta.audio_tokens is not None:
+        ...         print("Audio tokens shape:", delta.audio_tokens.shape)
+        ```
+    """
+
+    def __init__(
+        self,
+        tokenizer: "AutoTokenizer",
+        skip_prompt: bool = False,
+        timeout: Optional[float] = None,
+        audio_num_codebooks: int = 1,
+        **decode_kwargs,
+    ):
+        self.tokenizer = tokenizer
+        self.skip_prompt = skip_prompt
+        self.timeout = timeout
+        self.decode_kwargs = decode_kwargs
+        self.audio_num_codebooks = audio_num_codebooks
+        # Queue to store generated chunks
+        self.queue = queue.Queue()
+        self.stop_signal = None
+
+        # State tracking
+        self.next_tokens_are_prompt = True
+
+    def put(self, value: torch.Tensor):
+        """
+        Receives tokens and processes them as either text or audio tokens.
+        For text tokens, decodes and caches them until complete words are formed.
+        For audio tokens, directly queues them.
+        """
+        if value.shape[0] > 1 and not self.next_tokens_are_prompt:
+            # This is likely audio tokens (shape: [audio_num_codebooks])
+            assert value.shape[0] == self.audio_num_codebooks, "Number of codebooks mismatch"
+            self.on_delta(HiggsAudioStreamerDelta(audio_tokens=value))
+            return
+
+        # Skip prompt tokens if configured
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+
+        # Process as text tokens
+        if len(value.shape) > 1:
+            value = value[0]
+
+        text = self.tokenizer.decode(value, **self.decode_kwargs)
+        self.on_delta(HiggsAudioStreamerDelta(text=text, text_tokens=value))
+
+    def end(self):
+        """Flushes any remaining text tokens and signals the end of generation."""
+        self.next_tokens_are_prompt = True
+        self.on_delta(self.stop_signal)
+
+    def on_delta(self, delta: Optional[HiggsAudioStreamerDelta]):
+        """Hands a delta (or the stop signal) over to the consumer."""
+        self.queue.put(delta, timeout=self.timeout)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            value = self.queue.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError()
+        if value is self.stop_signal:
+            raise StopIteration()
+        return value
+
+
+class AsyncHiggsAudioStreamer(HiggsAudioStreamer):
     """
     Async streamer that handles both text and audio token generation from Higgs-Audio model.
     Stores chunks in a queue to be consumed by downstream applications.
@@ -97,40 +196,10 @@ class AsyncHiggsAudioStreamer(BaseStreamer):
         # State tracking
         self.next_tokens_are_prompt = True
 
-    def put(self, value: torch.Tensor):
-        """
-        Receives tokens and processes them as either text or audio tokens.
-        For text tokens, decodes and caches them until complete words are formed.
-        For audio tokens, directly queues them.
-        """
-        if value.shape[0] > 1 and not self.next_tokens_are_prompt:
-            # This is likely audio tokens (shape: [audio_num_codebooks])
-            assert value.shape[0] == self.audio_num_codebooks, "Number of codebooks mismatch"
-            delta = HiggsAudioStreamerDelta(audio_tokens=value)
-            if self.loop.is_running():
-                self.loop.call_soon_threadsafe(self.queue.put_nowait, delta)
-            return
-
-        # Skip prompt tokens if configured
-        if self.skip_prompt and self.next_tokens_are_prompt:
-            self.next_tokens_are_prompt = False
-            return
-
-        # Process as text tokens
-        if len(value.shape) > 1:
-            value = value[0]
-
-        text = self.tokenizer.decode(value, **self.decode_kwargs)
-        delta = HiggsAudioStreamerDelta(text=text, text_tokens=value)
+    def on_delta(self, delta: Optional[HiggsAudioStreamerDelta]):
         if self.loop.is_running():
             self.loop.call_soon_threadsafe(self.queue.put_nowait, delta)
 
-    def end(self):
-        """Flushes any remaining text tokens and signals the end of generation."""
-        self.next_tokens_are_prompt = True
-        if self.loop.is_running():
-            self.loop.call_soon_threadsafe(self.queue.put_nowait, self.stop_signal)
-
     def __aiter__(self):
         return self
 
@@ -176,6 +245,144 @@ class HiggsAudioResponse:
     generated_text: str = ""
     generated_text_tokens: Optional[np.ndarray] = None
     usage: Optional[dict] = None
+    # Seconds spent in each stage of the generation: prepare_inputs, prefill, decode and codec_decode
+    timings: Optional[Dict[str, float]] = None
+    # Length of the KV cache bucket holding the sequence when it finished
+    kv_bucket: Optional[int] = None
+
+
+@dataclass
+class HiggsAudioGenerationSequence:
+    """A generation that holds one KV cache slot of the engine and is advanced one token per `step()`."""
+
+    state: HiggsAudioDecodeState
+    kv_slot: int
+    prompt_token_ids: np.ndarray
+    released: bool = False
+    num_steps: int = 0
+    # Seconds spent in each stage so far
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def finished(self) -> bool:
+        return bool(self.state.this_peer_finished)
+
+    @property
+    def kv_bucket(self) -> Optional[int]:
+        """The length of the KV cache bucket currently holding the sequence, None before the prefill."""
+        return self.state.current_past_key_values_bucket
+
+
+class HiggsAudioStreamingDecoder:
+    """
+    Incrementally decodes the delay-pattern audio tokens of one audio segment into PCM.
+
+    Audio token deltas are pushed one generation step at a time. Codebook k lags k steps behind, so a codec frame is
+    complete once all codebooks have reached it. Every `chunk_frames` new complete frames, a window of frames that
+    also covers `context_frames` already decoded frames is run through the codec. The start of the new window is
+    cross-faded with the held-back end of the previous one using a Hamming window, which removes the clicks of
+    decoding chunks independently while keeping the output close to decoding the whole segment at once.
+
+    Parameters:
+        audio_tokenizer (`HiggsAudioTokenizer`):
+            The codec used to decode the audio codes.
+        num_codebooks (`int`):
+            The number of codebooks.
+        codebook_size (`int`):
+            The codebook size. Codes are clipped to it as in the offline decode.
+        samples_per_token (`int`):
+            The number of waveform samples per codec frame.
+        hamming_window_len (`int`):
+            The length of the Hamming window. Half of it is the cross-fade length in samples.
+        chunk_frames (`int`):
+            The number of new complete frames that triggers a decode.
+        context_frames (`int`, *optional*):
+            The number of already decoded frames prepended to every window. Defaults to twice the cross-fade length.
+    """
+
+    def __init__(
+        self,
+        audio_tokenizer,
+        num_codebooks: int,
+        codebook_size: int,
+        samples_per_token: int,
+        hamming_window_len: int,
+        chunk_frames: int = 10,
+        context_frames: Optional[int] = None,
+    ):
+        self.audio_tokenizer = audio_tokenizer
+        self.num_codebooks = num_codebooks
+        self.codebook_size = codebook_size
+        self.samples_per_token = samples_per_token
+        self.chunk_frames = chunk_frames
+        self.overlap_len = hamming_window_len // 2
+        self.window = np.hamming(2 * self.overlap_len)
+        if context_frames is None:
+            context_frames = 2 * -(-self.overlap_len // samples_per_token)
+        self.context_frames = context_frames
+
+        self._delayed_codes: List[torch.Tensor] = []
+        # Frame 0 is the audio stream bos, frames before _num_decoded have been decoded
+        self._num_decoded = 1
+        # The decoded end of the last window, held back to cross-fade it with the next one
+        self._tail: Optional[np.ndarray] = None
+
+    def push(self, audio_tokens: torch.Tensor) -> Optional[np.ndarray]:
+        """Add one step of audio tokens (shape: [num_codebooks]). Returns a PCM chunk once one is ready."""
+        self._delayed_codes.append(audio_tokens.cpu())
+        if self._num_ready_frames() - self._num_decoded < self.chunk_frames:
+            return None
+        return self._decode_until(self._num_ready_frames(), final=False)
+
+    def flush(self) -> Optional[np.ndarray]:
+        """Decode the remaining frames at the end of the segment. Returns the last PCM chunk, if any."""
+        return self._decode_until(self._num_ready_frames(), final=True)
+
+    def _num_ready_frames(self) -> int:
+        # The newest complete frame is held back because it is the audio stream eos once the segment ends,
+        # the offline decode drops it as well.
+        return len(self._delayed_codes) - self.num_codebooks
+
+    def _decode_frames(self, start: int, end: int) -> np.ndarray:
+        # Frames [start, end) span the delayed columns [start, end + num_codebooks - 1)
+        delayed = torch.stack(self._delayed_codes[start : end + self.num_codebooks - 1], dim=1)
+        vq_code = revert_delay_pattern(delayed).clip(0, self.codebook_size - 1)
+        with torch.inference_mode():
+            return self.audio_tokenizer.decode(vq_code.unsqueeze(0))[0, 0]
+
+    def _crossfade(self, tail: np.ndarray, head: np.ndarray) -> np.ndarray:
+        n = len(tail)
+        window = self.window if n == self.overlap_len else np.hamming(2 * n)
+        fade_in, fade_out = window[:n], window[n:]
+        return (tail * fade_out + head * fade_in) / (fade_in + fade_out)
+
+    def _decode_until(self, end: int, final: bool) -> Optional[np.ndarray]:
+        start = self._num_decoded
+        if end <= start:
+            if not final:
+                return None
+            tail, self._tail = self._tail, None
+            return tail
+
+        context_start = max(1, start - self.context_frames)
+        wav = self._decode_frames(context_start, end)
+        num_new_samples = (end - start) * self.samples_per_token
+        new_wav = wav[-num_new_samples:]
+
+        chunks = []
+        if self._tail is not None:
+            # The tail and the samples right before the new frames cover the same span of audio
+            overlap = wav[len(wav) - num_new_samples - len(self._tail) : len(wav) - num_new_samples]
+            chunks.append(self._crossfade(self._tail, overlap))
+        if final:
+            chunks.append(new_wav)
+            self._tail = None
+        else:
+            num_held_back = min(self.overlap_len, len(new_wav))
+            chunks.append(new_wav[: len(new_wav) - num_held_back])
+            self._tail = new_wav[len(new_wav) - num_held_back :]
+        self._num_decoded = end
+        return np.concatenate(chunks)
 
 
 class HiggsAudioServeEngine:
@@ -187,6 +394,8 @@ class HiggsAudioServeEngine:
         device: str = "cuda",
         torch_dtype: Union[torch.dtype, str] = "auto",
         kv_cache_lengths: List[int] = [1024, 4096, 8192],  # Multiple KV cache sizes
+        max_batch_size: int = 1,
+        shared_weights_dir: Optional[str] = None,
     ):
         """
         Initialize the HiggsAudioServeEngine, a serving wrapper for the HiggsAudioModel.
@@ -205,13 +414,33 @@ class HiggsAudioServeEngine:
                 The lengths of the KV caches to use for the model. Used for cuda graph capture when device is cuda.
             torch_dtype (Union[torch.dtype, str]):
                 The dtype to use for the model.
+            max_batch_size (int):
+                The number of KV cache slots, i.e. sequences that can be in progress at once. Their decode steps are
+                interleaved, each one a batch-1 forward pass, so more slots do not raise the aggregate throughput. Every
+                slot owns a full set of KV caches (one per length in `kv_cache_lengths`), so memory grows linearly
+                with it. An engine with 0 slots
+                only serves the tokenizers, e.g. in front of an `EngineWorkerPool`.
+            shared_weights_dir (str, optional):
+                CPU only. Directory of weight snapshots that the model and audio tokenizer weights are memory-mapped
+                from, so that every engine process on the host shares one copy of them. The first engine writes the
+                snapshots; delete them to pick up new weights.
         """
         self.device = device
         self.model_name_or_path = model_name_or_path
         self.torch_dtype = torch_dtype
 
+        if shared_weights_dir is not None and device != "cpu":
+            raise ValueError(f"Shared weights are only supported on cpu, not {device}")
+
         # Initialize model and tokenizer
-        self.model = HiggsAudioModel.from_pretrained(model_name_or_path, torch_dtype=torch_dtype).to(device)
+        if shared_weights_dir is None:
+            self.model = HiggsAudioModel.from_pretrained(model_name_or_path, torch_dtype=torch_dtype).to(device)
+        else:
+            self.model = load_shared_module(
+                snapshot_path(shared_weights_dir, f"{model_name_or_path}|{torch_dtype}"),
+                build=lambda: HiggsAudioModel.from_pretrained(model_name_or_path, torch_dtype=torch_dtype),
+                build_empty=lambda: self._build_empty_model(model_name_or_path),
+            ).eval()
         logger.info(f"Loaded model from {model_name_or_path}, dtype: {self.model.dtype}")
 
         if tokenizer_name_or_path is None:
@@ -220,7 +449,16 @@ class HiggsAudioServeEngine:
         self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name_or_path)
 
         logger.info(f"Initializing Higgs Audio Tokenizer")
-        self.audio_tokenizer = load_higgs_audio_tokenizer(audio_tokenizer_name_or_path, device=device)
+        if shared_weights_dir is None:
+            self.audio_tokenizer = load_higgs_audio_tokenizer(audio_tokenizer_name_or_path, device=device)
+        else:
+            self.audio_tokenizer = load_shared_module(
+                snapshot_path(shared_weights_dir, audio_tokenizer_name_or_path),
+                build=lambda: load_higgs_audio_tokenizer(audio_tokenizer_name_or_path, device=device),
+                build_empty=lambda: load_higgs_audio_tokenizer(
+                    audio_tokenizer_name_or_path, device=device, load_weights=False
+                ),
+            )
 
         self.audio_num_codebooks = self.model.config.audio_num_codebooks
         self.audio_codebook_size = self.model.config.audio_codebook_size
@@ -235,17 +473,27 @@ class HiggsAudioServeEngine:
         cache_config.num_hidden_layers = self.model.config.text_config.num_hidden_layers
         if self.model.config.audio_dual_ffn_layers:
             cache_config.num_hidden_layers += len(self.model.config.audio_dual_ffn_layers)
-        # A list of KV caches for different lengths
-        self.kv_caches = {
-            length: StaticCache(
-                config=cache_config,
-                max_batch_size=1,
-                max_cache_len=length,
-                device=self.model.device,
-                dtype=self.model.dtype,
-            )
-            for length in sorted(kv_cache_lengths)
-        }
+        # One slot of KV caches for different lengths per concurrently decoded sequence
+        self.max_batch_size = max_batch_size
+        self.kv_cache_lengths = sorted(kv_cache_lengths)
+        self.kv_cache_slots = [
+            {
+                length: StaticCache(
+                    config=cache_config,
+                    max_batch_size=1,
+                    max_cache_len=length,
+                    device=self.model.device,
+                    dtype=self.model.dtype,
+                )
+                for length in sorted(kv_cache_lengths)
+            }
+            for _ in range(max_batch_size)
+        ]
+        self.kv_caches = self.kv_cache_slots[0] if self.kv_cache_slots else None
+        self._free_kv_slots = list(range(max_batch_size))
+        # The sequence holding each KV cache slot, and the promotions into each bucket length
+        self._slot_sequences: List[Optional[HiggsAudioGenerationSequence]] = [None] * max_batch_size
+        self._kv_bucket_promotions = {length: 0 for length in self.kv_cache_lengths}
 
         if self.model.config.encode_whisper_embed:
             logger.info(f"Loading whisper processor")
@@ -275,7 +523,14 @@ class HiggsAudioServeEngine:
         # Capture CUDA graphs for each KV cache length
         if device == "cuda":
             logger.info(f"Capturing CUDA graphs for each KV cache length")
-            self.model.capture_model(self.kv_caches.values())
+            self.model.capture_model([kv_cache for kv_caches in self.kv_cache_slots for kv_cache in kv_caches.values()])
+
+    @staticmethod
+    def _build_empty_model(model_name_or_path: str) -> HiggsAudioModel:
+        """Allocate the model on the meta device, for weights that are mapped in afterwards."""
+        config = HiggsAudioConfig.from_pretrained(model_name_or_path)
+        with torch.device("meta"):
+            return HiggsAudioModel(config)
 
     def _prepare_inputs(self, chat_ml_sample: ChatMLSample, force_audio_gen: bool = False):
         input_tokens, _, audio_contents, _ = prepare_chatml_sample(
@@ -292,12 +547,17 @@ class HiggsAudioServeEngine:
         # Configure the audio inputs
         audio_ids_l = []
         for audio_content in audio_contents:
+            if audio_content.audio_codes is not None:
+                audio_ids_l.append(audio_content.audio_codes)
+                continue
+
             if audio_content.audio_url not in ["placeholder", ""]:
                 raw_audio, _ = librosa.load(audio_content.audio_url, sr=self.audio_tokenizer.sampling_rate)
             elif audio_content.raw_audio is not None:
-                raw_audio, _ = librosa.load(
-                    BytesIO(base64.b64decode(audio_content.raw_audio)), sr=self.audio_tokenizer.sampling_rate
-                )
+                audio_bytes = audio_content.raw_audio
+                if isinstance(audio_bytes, str):
+                    audio_bytes = base64.b64decode(audio_bytes)
+                raw_audio, _ = librosa.load(BytesIO(audio_bytes), sr=self.audio_tokenizer.sampling_rate)
             else:
                 raw_audio = None
 
@@ -334,11 +594,104 @@ class HiggsAudioServeEngine:
 
         return inputs
 
-    def _prepare_kv_caches(self):
-        for kv_cache in self.kv_caches.values():
+    def encode_audio(self, audio_bytes: bytes) -> torch.Tensor:
+        """
+        Encode an audio clip to audio tokenizer codes that can be passed as `AudioContent(audio_codes=...)`.
+        Args:
+            audio_bytes: The encoded audio clip.
+        Returns:
+            The codes as a CPU tensor of shape (num_codebooks, num_frames).
+        """
+        raw_audio, _ = librosa.load(BytesIO(audio_bytes), sr=self.audio_tokenizer.sampling_rate)
+        audio_ids = self.audio_tokenizer.encode(raw_audio, self.audio_tokenizer.sampling_rate)
+        return audio_ids.squeeze(0).cpu()
+
+    def create_streaming_decoder(self, chunk_frames: int = 10) -> HiggsAudioStreamingDecoder:
+        """Create a decoder that turns streamed audio token deltas into overlap-added PCM chunks."""
+        return HiggsAudioStreamingDecoder(
+            self.audio_tokenizer,
+            num_codebooks=self.audio_num_codebooks,
+            codebook_size=self.audio_codebook_size,
+            samples_per_token=self.samples_per_token,
+            hamming_window_len=self.hamming_window_len,
+            chunk_frames=chunk_frames,
+        )
+
+    @property
+    def num_free_kv_slots(self) -> int:
+        return len(self._free_kv_slots)
+
+    def kv_cache_stats(self) -> dict:
+        """Return the number of running sequences in each KV cache bucket, and the promotions into each bucket."""
+        buckets_in_use = {length: 0 for length in self.kv_cache_lengths}
+        for sequence in list(self._slot_sequences):
+            if sequence is not None and sequence.kv_bucket is not None:
+                buckets_in_use[sequence.kv_bucket] += 1
+        return {
+            "slots": self.max_batch_size,
+            "free_slots": self.num_free_kv_slots,
+            "buckets_in_use": buckets_in_use,
+            "bucket_promotions": dict(self._kv_bucket_promotions),
+        }
+
+    def _acquire_kv_slot(self) -> int:
+        if not self._free_kv_slots:
+            raise RuntimeError(f"All {self.max_batch_size} KV cache slots are in use")
+        kv_slot = self._free_kv_slots.pop(0)
+        for kv_cache in self.kv_cache_slots[kv_slot].values():
             kv_cache.reset()
+        return kv_slot
 
-    def generate(
+    def _prepare_decode_config(
+        self,
+        prompt_length: int,
+        max_new_tokens: int,
+        temperature: float,
+        top_k: Optional[int],
+        top_p: float,
+        stop_strings: List[str],
+        ras_win_len: Optional[int],
+        ras_win_max_num_repeat: int,
+        seed: Optional[int],
+        stop_signal: Optional[threading.Event] = None,
+    ):
+        """Build the generation config, logits processors and stopping criteria of a single sequence."""
+        do_sample = False if temperature == 0.0 else True
+        generation_config = GenerationConfig(
+            do_sample=do_sample,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            max_length=prompt_length + max_new_tokens,
+            use_cache=True,
+        )
+        generation_config.generation_kwargs = {
+            "audio_out_bos_token_id": self.model.audio_out_bos_token_id,
+            "audio_eos_token_id": self.model.audio_eos_token_id,
+            "ras_win_len": ras_win_len,
+            "ras_win_max_num_repeat": ras_win_max_num_repeat,
+            "tokenizer_length": len(self.tokenizer),
+        }
+        if seed is not None:
+            generation_config.generation_kwargs["seed"] = seed
+
+        logits_processor = LogitsProcessorList()
+        if do_sample:
+            if temperature is not None and temperature != 1.0:
+                logits_processor.append(TemperatureLogitsWarper(temperature))
+            if top_k is not None and top_k != 0:
+                logits_processor.append(TopKLogitsWarper(top_k=top_k, min_tokens_to_keep=1))
+            if top_p is not None and top_p < 1.0:
+                logits_processor.append(TopPLogitsWarper(top_p=top_p, min_tokens_to_keep=1))
+
+        stopping_criteria = StoppingCriteriaList([MaxLengthCriteria(max_length=generation_config.max_length)])
+        if stop_strings:
+            stopping_criteria.append(StopStringCriteria(tokenizer=self.tokenizer, stop_strings=stop_strings))
+        if stop_signal is not None:
+            stopping_criteria.append(AsyncStoppingCriteria(stop_signal))
+        return generation_config, logits_processor, stopping_criteria
+
+    def start_sequence(
         self,
         chat_ml_sample: ChatMLSample,
         max_new_tokens: int,
@@ -350,22 +703,19 @@ class HiggsAudioServeEngine:
         ras_win_len: Optional[int] = 7,
         ras_win_max_num_repeat: int = 2,
         seed: Optional[int] = None,
-    ):
+        streamer: Optional[BaseStreamer] = None,
+        stop_signal: Optional[threading.Event] = None,
+    ) -> HiggsAudioGenerationSequence:
         """
-        Generate audio from a chatml sample.
+        Prepare the inputs of a chatml sample and reserve a KV cache slot for it.
+        The prompt is prefilled by the first `step()` on the returned sequence, so new sequences can join a running
+        decode loop at any token boundary.
         Args:
-            chat_ml_sample: A chatml sample.
-            max_new_tokens: The maximum number of new tokens to generate.
-            temperature: The temperature to use for the generation.
-            top_p: The top p to use for the generation.
-            stop_strings: A list of strings to stop the generation.
-            force_audio_gen: Whether to force audio generation. This ensures the model generates audio tokens rather than text tokens.
-            ras_win_len: The length of the RAS window. We use 7 by default. You can disable it by setting it to None or <=0.
-            ras_win_max_num_repeat: The maximum number of times to repeat the RAS window.
+            Same as `generate()`.
+            streamer: An optional streamer receiving the generated text / audio tokens.
+            stop_signal: An optional event that ends the sequence at the next token boundary once set.
         Returns:
-            A dictionary with the following keys:
-                audio: The generated audio.
-                sampling_rate: The sampling rate of the generated audio.
+            A HiggsAudioGenerationSequence. Advance it with `step()` and collect it with `finish_sequence()`.
         """
         # Default stop strings
         if stop_strings is None:
@@ -373,59 +723,121 @@ class HiggsAudioServeEngine:
         if ras_win_len is not None and ras_win_len <= 0:
             ras_win_len = None
 
-        with torch.no_grad():
-            inputs = self._prepare_inputs(chat_ml_sample, force_audio_gen=force_audio_gen)
-            prompt_token_ids = inputs["input_ids"][0].cpu().numpy()
-
-            self._prepare_kv_caches()
-
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                use_cache=True,
-                stop_strings=stop_strings,
-                tokenizer=self.tokenizer,
-                do_sample=False if temperature == 0.0 else True,
-                temperature=temperature,
-                top_k=top_k,
-                top_p=top_p,
-                past_key_values_buckets=self.kv_caches,
-                ras_win_len=ras_win_len,
-                ras_win_max_num_repeat=ras_win_max_num_repeat,
-                seed=seed,
-            )
-
-            if len(outputs[1]) > 0:
+        kv_slot = None
+        prepare_start = time.monotonic()
+        try:
+            kv_slot = self._acquire_kv_slot()
+            with torch.inference_mode():
+                inputs = self._prepare_inputs(chat_ml_sample, force_audio_gen=force_audio_gen)
+                input_ids = inputs.pop("input_ids")
+                generation_config, logits_processor, stopping_criteria = self._prepare_decode_config(
+                    prompt_length=input_ids.shape[1],
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    top_k=top_k,
+                    top_p=top_p,
+                    stop_strings=stop_strings,
+                    ras_win_len=ras_win_len,
+                    ras_win_max_num_repeat=ras_win_max_num_repeat,
+                    seed=seed,
+                    stop_signal=stop_signal,
+                )
+                if streamer is not None:
+                    streamer.put(input_ids.cpu())
+                state = self.model._init_decode_state(
+                    input_ids,
+                    logits_processor=logits_processor,
+                    stopping_criteria=stopping_criteria,
+                    generation_config=generation_config,
+                    streamer=streamer,
+                    past_key_values_buckets=self.kv_cache_slots[kv_slot],
+                    use_cache=True,
+                    **inputs,
+                )
+        except Exception:
+            if kv_slot is not None:
+                self._free_kv_slots.append(kv_slot)
+            if streamer is not None:
+                streamer.end()
+            raise
+
+        sequence = HiggsAudioGenerationSequence(
+            state=state,
+            kv_slot=kv_slot,
+            prompt_token_ids=input_ids[0].cpu().numpy(),
+            timings={"prepare_inputs": time.monotonic() - prepare_start},
+        )
+        self._slot_sequences[kv_slot] = sequence
+        return sequence
+
+    def step(self, sequence: HiggsAudioGenerationSequence) -> bool:
+        """Decode one token of a running sequence. Returns whether the sequence has finished."""
+        step_start = time.monotonic()
+        kv_bucket = sequence.kv_bucket
+        with torch.inference_mode():
+            self.model._decode_step(sequence.state)
+        # Outgrowing a bucket copies the KV cache into the next larger one
+        if kv_bucket is not None and sequence.kv_bucket != kv_bucket:
+            self._kv_bucket_promotions[sequence.kv_bucket] += 1
+        # The first step prefills the prompt
+        stage = "decode" if sequence.num_steps else "prefill"
+        sequence.timings[stage] = sequence.timings.get(stage, 0.0) + time.monotonic() - step_start
+        sequence.num_steps += 1
+        return sequence.finished
+
+    def release_sequence(self, sequence: HiggsAudioGenerationSequence):
+        """End the sequence's stream and return its KV cache slot to the engine."""
+        if sequence.released:
+            return
+        sequence.released = True
+        if sequence.state.streamer is not None:
+            sequence.state.streamer.end()
+        self._slot_sequences[sequence.kv_slot] = None
+        self._free_kv_slots.append(sequence.kv_slot)
+
+    def finish_sequence(self, sequence: HiggsAudioGenerationSequence) -> HiggsAudioResponse:
+        """Release a finished sequence and decode its audio codes into a HiggsAudioResponse."""
+        kv_bucket = sequence.kv_bucket
+        self.release_sequence(sequence)
+        state = sequence.state
+        prompt_token_ids = sequence.prompt_token_ids
+
+        decode_start = time.monotonic()
+        with torch.inference_mode():
+            if len(state.audio_sequences) > 0:
                 wv_list = []
-                for output_audio in outputs[1]:
+                for output_audio in state.audio_sequences:
                     vq_code = revert_delay_pattern(output_audio).clip(0, self.audio_codebook_size - 1)[:, 1:-1]
                     wv_numpy = self.audio_tokenizer.decode(vq_code.unsqueeze(0))[0, 0]
                     wv_list.append(wv_numpy)
                 wv_numpy = np.concatenate(wv_list)
+                generated_audio_tokens = state.audio_sequences[0].cpu().numpy()
+                num_audio_tokens = generated_audio_tokens.shape[1]
             else:
                 wv_numpy = None
+                generated_audio_tokens = None
+                num_audio_tokens = 0
+        sequence.timings["codec_decode"] = time.monotonic() - decode_start
+
+        generated_text_tokens = state.input_ids[0].cpu().numpy()[len(prompt_token_ids) :]
+        generated_text = self.tokenizer.decode(generated_text_tokens)
+        return HiggsAudioResponse(
+            audio=wv_numpy,
+            generated_audio_tokens=generated_audio_tokens,
+            sampling_rate=self.audio_tokenizer.sampling_rate,
+            generated_text=generated_text,
+            generated_text_tokens=generated_text_tokens,
+            usage={
+                "prompt_tokens": prompt_token_ids.shape[0],
+                "completion_tokens": generated_text_tokens.shape[0] + num_audio_tokens,
+                "total_tokens": prompt_token_ids.shape[0] + generated_text_tokens.shape[0] + num_audio_tokens,
+                "cached_tokens": 0,
+            },
+            timings=dict(sequence.timings),
+            kv_bucket=kv_bucket,
+        )
 
-            # We only support one request at a time now
-            generated_text_tokens = outputs[0][0].cpu().numpy()[len(prompt_token_ids) :]
-            generated_text = self.tokenizer.decode(generated_text_tokens)
-            generated_audio_tokens = outputs[1][0].cpu().numpy()
-            return HiggsAudioResponse(
-                audio=wv_numpy,
-                generated_audio_tokens=generated_audio_tokens,
-                sampling_rate=self.audio_tokenizer.sampling_rate,
-                generated_text=generated_text,
-                generated_text_tokens=generated_text_tokens,
-                usage={
-                    "prompt_tokens": prompt_token_ids.shape[0],
-                    "completion_tokens": generated_text_tokens.shape[0] + generated_audio_tokens.shape[1],
-                    "total_tokens": (
-                        prompt_token_ids.shape[0] + generated_text_tokens.shape[0] + generated_audio_tokens.shape[1]
-                    ),
-                    "cached_tokens": 0,
-                },
-            )
-
-    async def generate_delta_stream(
+    def generate(
         self,
         chat_ml_sample: ChatMLSample,
         max_new_tokens: int,
@@ -437,9 +849,13 @@ class HiggsAudioServeEngine:
         ras_win_len: Optional[int] = 7,
         ras_win_max_num_repeat: int = 2,
         seed: Optional[int] = None,
+        streamer: Optional[BaseStreamer] = None,
+        stop_signal: Optional[threading.Event] = None,
     ):
         """
         Generate audio from a chatml sample.
+        The engine is not thread-safe. To share it between threads, or to decode several requests concurrently, go
+        through a HiggsAudioRequestScheduler.
         Args:
             chat_ml_sample: A chatml sample.
             max_new_tokens: The maximum number of new tokens to generate.
@@ -449,43 +865,32 @@ class HiggsAudioServeEngine:
             force_audio_gen: Whether to force audio generation. This ensures the model generates audio tokens rather than text tokens.
             ras_win_len: The length of the RAS window. We use 7 by default. You can disable it by setting it to None or <=0.
             ras_win_max_num_repeat: The maximum number of times to repeat the RAS window.
+            seed: The seed of the sampling generator, for reproducible generations.
+            streamer: An optional streamer receiving the generated text / audio tokens.
+            stop_signal: An optional event that stops the generation early once set, e.g. when the client disconnects.
         Returns:
-             Delta AsyncGenerator
+            A dictionary with the following keys:
+                audio: The generated audio.
+                sampling_rate: The sampling rate of the generated audio.
         """
-        # Default stop strings
-        if stop_strings is None:
-            stop_strings = ["<|end_of_text|>", "<|eot_id|>"]
-        if ras_win_len is not None and ras_win_len <= 0:
-            ras_win_len = None
-
-        with torch.no_grad():
-            inputs = self._prepare_inputs(chat_ml_sample, force_audio_gen=force_audio_gen)
-
-            self._prepare_kv_caches()
-
-            streamer = AsyncHiggsAudioStreamer(
-                self.tokenizer,
-                audio_num_codebooks=self.model.config.audio_num_codebooks,
-                skip_prompt=True,
-            )
-            generation_kwargs = dict(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                use_cache=True,
-                stop_strings=stop_strings,
-                tokenizer=self.tokenizer,
-                do_sample=False if temperature == 0.0 else True,
-                temperature=temperature,
-                top_k=top_k,
-                top_p=top_p,
-                past_key_values_buckets=self.kv_caches,
-                ras_win_len=ras_win_len,
-                ras_win_max_num_repeat=ras_win_max_num_repeat,
-                seed=seed,
-                streamer=streamer,
-            )
-            thread = threading.Thread(target=self.model.generate, kwargs=generation_kwargs)
-            thread.start()
-
-            async for delta in streamer:
-                yield delta
+        sequence = self.start_sequence(
+            chat_ml_sample,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            stop_strings=stop_strings,
+            force_audio_gen=force_audio_gen,
+            ras_win_len=ras_win_len,
+            ras_win_max_num_repeat=ras_win_max_num_repeat,
+            seed=seed,
+            streamer=streamer,
+            stop_signal=stop_signal,
+        )
+        try:
+            while not self.step(sequence):
+                pass
+        except BaseException:
+            self.release_sequence(sequence)
+            raise
+        return self.finish_sequence(sequence)
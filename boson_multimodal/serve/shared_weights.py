@@ -0,0 +1,90 @@
+import hashlib
+import os
+import uuid
+from typing import Callable, Optional
+
+import torch
+from loguru import logger
+from torch import nn
+
+
+def snapshot_path(root_dir: str, name: str) -> str:
+    """Return the path of the weight snapshot of a model, identified by its name and load options."""
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(root_dir, f"{digest}.pt")
+
+
+def export_module_tensors(module: nn.Module, path: str):
+    """
+    Write every parameter and buffer of a module, non-persistent buffers included, to a snapshot file.
+    Tied parameters are listed under each of their names and keep sharing one storage in the file.
+    """
+    tensors = dict(module.named_parameters(remove_duplicate=False))
+    tensors.update(module.named_buffers(remove_duplicate=False))
+    tensors = {name: tensor.detach().cpu() for name, tensor in tensors.items()}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        torch.save(tensors, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def map_module_tensors(module: nn.Module, path: str):
+    """
+    Replace every parameter and buffer of a module by a read-only memory mapping of a snapshot file.
+    The pages are shared through the page cache by all the processes that map the same file, as long as nobody
+    writes to them, so the module must only be used for inference.
+    """
+    tensors = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    names = {name for name, _ in module.named_parameters(remove_duplicate=False)}
+    names.update(name for name, _ in module.named_buffers(remove_duplicate=False))
+    missing = names - tensors.keys()
+    if missing:
+        raise ValueError(f"Weight snapshot {path} does not match the model, missing {sorted(missing)[:5]}")
+    for name in names:
+        owner_name, _, attr = name.rpartition(".")
+        owner = module.get_submodule(owner_name) if owner_name else module
+        if attr in owner._parameters:
+            owner._parameters[attr] = nn.Parameter(tensors[name], requires_grad=False)
+        else:
+            owner._buffers[attr] = tensors[name]
+
+
+def load_shared_module(
+    path: str,
+    build: Callable[[], nn.Module],
+    build_empty: Optional[Callable[[], nn.Module]] = None,
+) -> nn.Module:
+    """
+    Load a CPU module whose weights are memory-mapped from a snapshot file shared by several processes.
+    The first process builds the module normally and writes the snapshot; the others only allocate the module
+    structure and map the snapshot, so N processes hold about one copy of the weights.
+    Args:
+        path: The snapshot file, see `snapshot_path()`.
+        build: Builds the module with its weights loaded, e.g. from `from_pretrained()`.
+        build_empty: Builds the module structure without loading weights, e.g. on the meta device. Defaults to `build`.
+    Returns:
+        The module, its parameters and buffers mapped from the snapshot.
+    """
+    if os.path.exists(path):
+        module = None
+        if build_empty is not None:
+            try:
+                module = build_empty()
+            except Exception as e:
+                logger.warning(f"Could not build an empty module ({e}), loading its weights before mapping them")
+        if module is None:
+            module = build()
+        map_module_tensors(module, path)
+        logger.info(f"Mapped shared weights from {path}")
+        return module
+
+    module = build()
+    logger.info(f"Writing shared weight snapshot {path}")
+    export_module_tensors(module, path)
+    # Swap the private copy for the mapping, so this process does not hold the weights twice
+    map_module_tensors(module, path)
+    return module
@@ -0,0 +1,446 @@
+import base64
+import hashlib
+import random
+import struct
+import threading
+import time
+from dataclasses import dataclass, field, fields, replace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+import whisper
+from loguru import logger
+
+from ..data_types import AudioContent, ChatMLSample, TextContent
+from ..model.higgs_audio.utils import revert_delay_pattern
+from .serve_engine import HiggsAudioResponse, HiggsAudioStreamingDecoder
+from .transcriber import TranscriptionRequest, WhisperTranscriptionService
+
+
+@dataclass
+class StandInProfile:
+    """
+    Synthetic cost model of a StandInServeEngine and a StandInTranscriptionService. Every cost is spent sleeping, so
+    stand-ins release the GIL like the real kernels do, and varies by +/- `jitter` (relative) from one call to the next.
+    """
+
+    # Prompt tokens processed per second by the prefill step
+    prefill_tokens_per_second: float = 20000.0
+    # Seconds of one decode step of one sequence
+    decode_step_seconds: float = 0.012
+    # Seconds of codec decoding per audio frame
+    codec_seconds_per_frame: float = 0.0004
+    # Seconds of codec encoding per second of reference audio
+    encode_seconds_per_second: float = 0.02
+    # Seconds of one transcription forward pass, for a batch of any size
+    transcribe_seconds: float = 0.15
+    # Duration of the generated speech per character of text
+    audio_seconds_per_character: float = 0.065
+    jitter: float = 0.1
+
+    @classmethod
+    def parse(cls, spec: str) -> "StandInProfile":
+        """
+        Parse a profile spec: the name of a preset, optionally followed by field overrides, e.g.
+        "gpu,decode_step_seconds=0.02,jitter=0".
+        """
+        name, *overrides = [part.strip() for part in spec.split(",") if part.strip()]
+        if name not in STAND_IN_PROFILES:
+            raise ValueError(f"Unknown stand-in profile '{name}', expected one of {', '.join(STAND_IN_PROFILES)}")
+        names = {f.name for f in fields(cls)}
+        values = {}
+        for override in overrides:
+            key, _, value = override.partition("=")
+            if key not in names:
+                raise ValueError(f"Unknown stand-in profile field '{key}'")
+            values[key] = float(value)
+        return replace(STAND_IN_PROFILES[name], **values)
+
+    def spend(self, seconds: float, rng: random.Random):
+        """Sleep for a cost of the profile."""
+        if seconds <= 0:
+            return
+        time.sleep(seconds * (1.0 + self.jitter * rng.uniform(-1.0, 1.0)))
+
+
+STAND_IN_PROFILES = {
+    # No synthetic cost at all, what remains is the overhead of the serving layer
+    "instant": StandInProfile(
+        prefill_tokens_per_second=float("inf"),
+        decode_step_seconds=0.0,
+        codec_seconds_per_frame=0.0,
+        encode_seconds_per_second=0.0,
+        transcribe_seconds=0.0,
+        jitter=0.0,
+    ),
+    # About a 3B model on a datacenter GPU, ~3x faster than real time for one sequence
+    "gpu": StandInProfile(),
+    # About the same model on a many-core CPU worker, slower than real time
+    "cpu": StandInProfile(
+        prefill_tokens_per_second=800.0,
+        decode_step_seconds=0.09,
+        codec_seconds_per_frame=0.004,
+        encode_seconds_per_second=0.2,
+        transcribe_seconds=1.0,
+    ),
+}
+
+
+class StandInTokenizer:
+    """Text tokenizer of a stand-in engine, which never generates text."""
+
+    def decode(self, token_ids, **kwargs) -> str:
+        return ""
+
+    def __len__(self) -> int:
+        return 128256
+
+
+class StandInAudioTokenizer:
+    """
+    Codec of a stand-in engine. Decoding turns every frame into a short tone whose pitch follows the frame's first code,
+    so different generations sound different and the waveform has the real length.
+    """
+
+    def __init__(self, profile: StandInProfile, rng: random.Random, sampling_rate: int = 24000, tps: int = 25):
+        self.profile = profile
+        self.rng = rng
+        self.sampling_rate = sampling_rate
+        self.tps = tps
+
+    def decode(self, vq_code: torch.Tensor) -> np.ndarray:
+        codes = vq_code[0, 0].cpu().numpy()
+        self.profile.spend(self.profile.codec_seconds_per_frame * len(codes), self.rng)
+        samples_per_frame = self.sampling_rate // self.tps
+        frequencies = np.repeat(110.0 + (codes % 256), samples_per_frame)
+        phase = np.cumsum(2 * np.pi * frequencies / self.sampling_rate)
+        return (0.1 * np.sin(phase)).astype(np.float32)[None, None, :]
+
+    def encode(self, num_samples: int, num_codebooks: int, codebook_size: int, seed: int) -> torch.Tensor:
+        seconds = num_samples / self.sampling_rate
+        self.profile.spend(self.profile.encode_seconds_per_second * seconds, self.rng)
+        generator = torch.Generator().manual_seed(seed)
+        num_frames = max(1, int(seconds * self.tps))
+        return torch.randint(0, codebook_size, (1, num_codebooks, num_frames), generator=generator)
+
+
+@dataclass
+class StandInGenerationSequence:
+    """A stand-in generation, replaying precomputed delay-pattern audio codes one column per `step()`."""
+
+    kv_slot: int
+    prompt_length: int
+    delayed_codes: torch.Tensor
+    max_steps: int
+    streamer: Any = None
+    stop_signal: Optional[threading.Event] = None
+    released: bool = False
+    num_steps: int = 0
+    kv_cache_lengths: List[int] = field(default_factory=list)
+    # Seconds spent in each stage so far
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def finished(self) -> bool:
+        if self.stop_signal is not None and self.stop_signal.is_set():
+            return True
+        return self.num_steps >= min(self.delayed_codes.shape[1], self.max_steps)
+
+    @property
+    def kv_bucket(self) -> Optional[int]:
+        """The length of the KV cache bucket the real engine would hold the sequence in, None before the prefill."""
+        if not self.num_steps:
+            return None
+        length = self.prompt_length + self.num_steps
+        return next((bucket for bucket in self.kv_cache_lengths if bucket >= length), self.kv_cache_lengths[-1])
+
+
+class StandInServeEngine:
+    """
+    Drop-in replacement of HiggsAudioServeEngine that needs neither model weights nor a GPU, for load tests of the
+    serving layer. Prompts are sized from their text and reference audio; the speech length follows the length of
+    the last user message. Generations go through the real streamer, streaming decoder and response types, and every
+    model stage costs the time given by the profile. KV cache slots and buckets are accounted like in the real engine.
+
+    Args:
+        model_name_or_path (str, optional):
+            Ignored, accepted so that the stand-in is built like the real engine.
+        audio_tokenizer_name_or_path (str, optional):
+            Ignored as well.
+        profile (Union[str, StandInProfile]):
+            The cost model, or its spec (see `StandInProfile.parse()`).
+        max_batch_size (int):
+            The number of sequences that can be decoded concurrently.
+        kv_cache_lengths (List[int]):
+            The KV cache bucket lengths reported in `kv_cache_stats()`.
+        audio_num_codebooks (int):
+            The number of codebooks of the generated audio codes.
+        seed (int, optional):
+            Seed of the cost jitter. Generated codes only depend on the request seed and text.
+        **kwargs:
+            Other HiggsAudioServeEngine arguments (device, shared_weights_dir, ...), ignored.
+    """
+
+    def __init__(
+        self,
+        model_name_or_path: Optional[str] = None,
+        audio_tokenizer_name_or_path: Optional[str] = None,
+        profile="gpu",
+        max_batch_size: int = 1,
+        kv_cache_lengths: List[int] = [1024, 4096, 8192],
+        audio_num_codebooks: int = 8,
+        audio_codebook_size: int = 1024,
+        seed: Optional[int] = None,
+        **kwargs,
+    ):
+        self.profile = StandInProfile.parse(profile) if isinstance(profile, str) else profile
+        self._rng = random.Random(seed)
+        self.tokenizer = StandInTokenizer()
+        self.audio_tokenizer = StandInAudioTokenizer(self.profile, self._rng)
+        self.audio_num_codebooks = audio_num_codebooks
+        self.audio_codebook_size = audio_codebook_size
+        self.audio_stream_bos_id = audio_codebook_size
+        self.audio_stream_eos_id = audio_codebook_size + 1
+        self.audio_tokenizer_tps = self.audio_tokenizer.tps
+        self.samples_per_token = int(self.audio_tokenizer.sampling_rate // self.audio_tokenizer_tps)
+        self.hamming_window_len = 2 * self.audio_num_codebooks * self.samples_per_token
+        self.max_batch_size = max_batch_size
+        self.kv_cache_lengths = sorted(kv_cache_lengths)
+        self._free_kv_slots = list(range(max_batch_size))
+        self._slot_sequences: List[Optional[StandInGenerationSequence]] = [None] * max_batch_size
+        self._kv_bucket_promotions = {length: 0 for length in self.kv_cache_lengths}
+        logger.info(f"Stand-in engine with profile {self.profile}")
+
+    def encode_audio(self, audio_bytes: bytes) -> torch.Tensor:
+        """Stand-in of `HiggsAudioServeEngine.encode_audio()`, codes derived from the bytes of the clip."""
+        seed = int.from_bytes(hashlib.sha1(audio_bytes).digest()[:4], "big")
+        codes = self.audio_tokenizer.encode(
+            self._num_samples(audio_bytes), self.audio_num_codebooks, self.audio_codebook_size, seed
+        )
+        return codes.squeeze(0)
+
+    def create_streaming_decoder(self, chunk_frames: int = 10) -> HiggsAudioStreamingDecoder:
+        """Create a decoder that turns streamed audio token deltas into overlap-added PCM chunks."""
+        return HiggsAudioStreamingDecoder(
+            self.audio_tokenizer,
+            num_codebooks=self.audio_num_codebooks,
+            codebook_size=self.audio_codebook_size,
+            samples_per_token=self.samples_per_token,
+            hamming_window_len=self.hamming_window_len,
+            chunk_frames=chunk_frames,
+        )
+
+    @property
+    def num_free_kv_slots(self) -> int:
+        return len(self._free_kv_slots)
+
+    def kv_cache_stats(self) -> dict:
+        """Return the number of running sequences in each KV cache bucket, and the promotions into each bucket."""
+        buckets_in_use = {length: 0 for length in self.kv_cache_lengths}
+        for sequence in list(self._slot_sequences):
+            if sequence is not None and sequence.kv_bucket is not None:
+                buckets_in_use[sequence.kv_bucket] += 1
+        return {
+            "slots": self.max_batch_size,
+            "free_slots": self.num_free_kv_slots,
+            "buckets_in_use": buckets_in_use,
+            "bucket_promotions": dict(self._kv_bucket_promotions),
+        }
+
+    def start_sequence(
+        self,
+        chat_ml_sample: ChatMLSample,
+        max_new_tokens: int,
+        seed: Optional[int] = None,
+        streamer: Any = None,
+        stop_signal: Optional[threading.Event] = None,
+        **kwargs,
+    ) -> StandInGenerationSequence:
+        """Stand-in of `HiggsAudioServeEngine.start_sequence()`, the sampling arguments are ignored."""
+        if not self._free_kv_slots:
+            raise RuntimeError(f"All {self.max_batch_size} KV cache slots are in use")
+        prepare_start = time.monotonic()
+        try:
+            prompt_length, text = self._measure_prompt(chat_ml_sample)
+        except Exception:
+            if streamer is not None:
+                streamer.end()
+            raise
+        kv_slot = self._free_kv_slots.pop(0)
+        if streamer is not None:
+            streamer.put(torch.zeros((1, prompt_length), dtype=torch.long))
+        sequence = StandInGenerationSequence(
+            kv_slot=kv_slot,
+            prompt_length=prompt_length,
+            delayed_codes=self._generate_codes(text, seed),
+            max_steps=max_new_tokens,
+            streamer=streamer,
+            stop_signal=stop_signal,
+            kv_cache_lengths=self.kv_cache_lengths,
+            timings={"prepare_inputs": time.monotonic() - prepare_start},
+        )
+        self._slot_sequences[kv_slot] = sequence
+        return sequence
+
+    def step(self, sequence: StandInGenerationSequence) -> bool:
+        """Emit one column of audio codes. Returns whether the sequence has finished."""
+        step_start = time.monotonic()
+        kv_bucket = sequence.kv_bucket
+        if sequence.num_steps:
+            self.profile.spend(self.profile.decode_step_seconds, self._rng)
+        else:
+            self.profile.spend(sequence.prompt_length / self.profile.prefill_tokens_per_second, self._rng)
+        if sequence.streamer is not None:
+            sequence.streamer.put(sequence.delayed_codes[:, sequence.num_steps])
+        stage = "decode" if sequence.num_steps else "prefill"
+        sequence.num_steps += 1
+        if kv_bucket is not None and sequence.kv_bucket != kv_bucket:
+            self._kv_bucket_promotions[sequence.kv_bucket] += 1
+        sequence.timings[stage] = sequence.timings.get(stage, 0.0) + time.monotonic() - step_start
+        return sequence.finished
+
+    def release_sequence(self, sequence: StandInGenerationSequence):
+        """End the sequence's stream and return its KV cache slot to the engine."""
+        if sequence.released:
+            return
+        sequence.released = True
+        if sequence.streamer is not None:
+            sequence.streamer.end()
+        self._slot_sequences[sequence.kv_slot] = None
+        self._free_kv_slots.append(sequence.kv_slot)
+
+    def finish_sequence(self, sequence: StandInGenerationSequence) -> HiggsAudioResponse:
+        """Release a finished sequence and decode its audio codes into a HiggsAudioResponse."""
+        kv_bucket = sequence.kv_bucket
+        self.release_sequence(sequence)
+        decode_start = time.monotonic()
+        emitted = sequence.delayed_codes[:, : sequence.num_steps]
+        if emitted.shape[1] >= self.audio_num_codebooks + 2:
+            vq_code = revert_delay_pattern(emitted).clip(0, self.audio_codebook_size - 1)[:, 1:-1]
+            audio = self.audio_tokenizer.decode(vq_code.unsqueeze(0))[0, 0]
+            generated_audio_tokens = emitted.numpy()
+            num_audio_tokens = emitted.shape[1]
+        else:
+            audio, generated_audio_tokens, num_audio_tokens = None, None, 0
+        sequence.timings["codec_decode"] = time.monotonic() - decode_start
+        return HiggsAudioResponse(
+            audio=audio,
+            generated_audio_tokens=generated_audio_tokens,
+            sampling_rate=self.audio_tokenizer.sampling_rate,
+            generated_text="",
+            generated_text_tokens=np.zeros(0, dtype=np.int64),
+            usage={
+                "prompt_tokens": sequence.prompt_length,
+                "completion_tokens": num_audio_tokens,
+                "total_tokens": sequence.prompt_length + num_audio_tokens,
+                "cached_tokens": 0,
+            },
+            timings=dict(sequence.timings),
+            kv_bucket=kv_bucket,
+        )
+
+    def generate(self, chat_ml_sample: ChatMLSample, max_new_tokens: int, **kwargs) -> HiggsAudioResponse:
+        """Run a whole generation in the calling thread, see `HiggsAudioServeEngine.generate()`."""
+        sequence = self.start_sequence(chat_ml_sample, max_new_tokens, **kwargs)
+        try:
+            while not self.step(sequence):
+                pass
+        except BaseException:
+            self.release_sequence(sequence)
+            raise
+        return self.finish_sequence(sequence)
+
+    def _measure_prompt(self, chat_ml_sample: ChatMLSample):
+        """Return the prompt length in tokens and the text to speak, encoding raw reference audio on the way."""
+        prompt_length = 0
+        text = ""
+        for message in chat_ml_sample.messages:
+            contents = message.content if isinstance(message.content, list) else [message.content]
+            for content in contents:
+                if isinstance(content, str) or isinstance(content, TextContent):
+                    content_text = content if isinstance(content, str) else content.text
+                    # About 4 characters per token
+                    prompt_length += len(content_text) // 4 + 1
+                    if message.role == "user":
+                        text = content_text
+                elif isinstance(content, AudioContent):
+                    codes = content.audio_codes
+                    if codes is None and content.raw_audio is not None:
+                        raw_audio = content.raw_audio
+                        if isinstance(raw_audio, str):
+                            raw_audio = base64.b64decode(raw_audio)
+                        codes = self.encode_audio(raw_audio)
+                    if codes is not None:
+                        prompt_length += codes.shape[-1] + 2
+        return prompt_length + 8, text
+
+    def _generate_codes(self, text: str, seed: Optional[int]) -> torch.Tensor:
+        """The delay-pattern audio codes of the speech of a text, stream bos and eos included."""
+        num_frames = max(1, round(len(text) * self.profile.audio_seconds_per_character * self.audio_tokenizer_tps))
+        key = f"{seed}|{text}" if seed is not None else f"{random.random()}|{text}"
+        generator = torch.Generator().manual_seed(int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:4], "big"))
+        codes = torch.randint(0, self.audio_codebook_size, (self.audio_num_codebooks, num_frames), generator=generator)
+        bos = torch.full((self.audio_num_codebooks, 1), self.audio_stream_bos_id)
+        eos = torch.full((self.audio_num_codebooks, 1), self.audio_stream_eos_id)
+        codes = torch.cat([bos, codes, eos], dim=1)
+        # Codebook k lags k steps behind, padded with bos before and eos after
+        num_codebooks, length = codes.shape
+        delayed = torch.full((num_codebooks, length + num_codebooks - 1), self.audio_stream_eos_id)
+        for k in range(num_codebooks):
+            delayed[k, :k] = self.audio_stream_bos_id
+            delayed[k, k : k + length] = codes[k]
+        return delayed
+
+    @staticmethod
+    def _num_samples(audio_bytes: bytes, sampling_rate: int = 24000) -> int:
+        """Length of a clip at sampling_rate, from the header of a WAV file or else assuming 128 kbit/s."""
+        if audio_bytes[:4] == b"RIFF" and audio_bytes[8:12] == b"WAVE":
+            offset = 12
+            byte_rate = None
+            while offset + 8 <= len(audio_bytes):
+                chunk_id = audio_bytes[offset : offset + 4]
+                (chunk_size,) = struct.unpack("<I", audio_bytes[offset + 4 : offset + 8])
+                if chunk_id == b"fmt ":
+                    (byte_rate,) = struct.unpack("<I", audio_bytes[offset + 16 : offset + 20])
+                elif chunk_id == b"data" and byte_rate:
+                    data_size = min(chunk_size, len(audio_bytes) - offset - 8)
+                    return int(data_size / byte_rate * sampling_rate)
+                offset += 8 + chunk_size + (chunk_size & 1)
+        return int(len(audio_bytes) / 16000 * sampling_rate)
+
+
+class StandInTranscriptionService(WhisperTranscriptionService):
+    """
+    WhisperTranscriptionService without a Whisper model. Clips are still decoded with ffmpeg, queued and micro-batched
+    by the real worker, but every forward pass costs `profile.transcribe_seconds` and yields a placeholder text.
+
+    Args:
+        profile (Union[str, StandInProfile]):
+            The cost model, or its spec (see `StandInProfile.parse()`).
+        seed (int, optional):
+            Seed of the cost jitter.
+        **kwargs:
+            Other WhisperTranscriptionService arguments (max_batch_size, max_batch_wait, max_queue_size).
+    """
+
+    def __init__(self, profile="gpu", seed: Optional[int] = None, **kwargs):
+        self.profile = StandInProfile.parse(profile) if isinstance(profile, str) else profile
+        self._rng = random.Random(seed)
+        super().__init__(None, **kwargs)
+
+    def _decode_group(self, group: List[TranscriptionRequest], language: Optional[str]):
+        self.profile.spend(self.profile.transcribe_seconds, self._rng)
+        for request in group:
+            self._complete(request, self._transcript(request))
+
+    def _transcribe_long(self, request: TranscriptionRequest):
+        # whisper.transcribe() runs one forward pass per 30 second window
+        num_windows = -(-len(request.audio) // whisper.audio.N_SAMPLES)
+        self.profile.spend(self.profile.transcribe_seconds * num_windows, self._rng)
+        self._complete(request, self._transcript(request))
+
+    @staticmethod
+    def _transcript(request: TranscriptionRequest) -> str:
+        seconds = len(request.audio) / whisper.audio.SAMPLE_RATE
+        return f"This is a stand-in transcript of a {seconds:.1f} second clip."
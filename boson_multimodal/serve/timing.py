@@ -0,0 +1,68 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+class RequestTimings:
+    """
+    Per-stage latency breakdown of one request.
+
+    Stages are accumulated, so a stage that runs several times (e.g. the decode steps of every sentence of a reply)
+    reports its total time and count. Marks record the time since the start of the request at which something happened
+    for the first time, e.g. the first audio chunk. Stages can be recorded from any thread.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+        self._durations: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._marks: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the body of the with statement as a run of the stage."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+    def add(self, name: str, seconds: float, count: int = 1):
+        """Add a run of a stage measured elsewhere."""
+        with self._lock:
+            self._durations[name] = self._durations.get(name, 0.0) + seconds
+            self._counts[name] = self._counts.get(name, 0) + count
+
+    def add_all(self, durations: Optional[Dict[str, float]], prefix: str = ""):
+        """Add the stages of a breakdown recorded by a component, e.g. `HiggsAudioResponse.timings`."""
+        for name, seconds in (durations or {}).items():
+            self.add(prefix + name, seconds)
+
+    def mark(self, name: str):
+        """Record the time since the start of the request, the first time it is called for a name."""
+        elapsed = time.monotonic() - self.start
+        with self._lock:
+            self._marks.setdefault(name, elapsed)
+
+    def as_dict(self) -> Dict[str, float]:
+        """Return the stages and marks in milliseconds, and the total time so far."""
+        with self._lock:
+            timings = {name: round(seconds * 1000, 1) for name, seconds in self._durations.items()}
+            timings.update({name: round(seconds * 1000, 1) for name, seconds in self._marks.items()})
+        timings["total"] = round((time.monotonic() - self.start) * 1000, 1)
+        return timings
+
+    def server_timing(self) -> str:
+        """Return the breakdown as a `Server-Timing` header value."""
+        with self._lock:
+            metrics = [
+                f'{name};dur={seconds * 1000:.1f};desc="x{self._counts[name]}"'
+                if self._counts[name] > 1
+                else f"{name};dur={seconds * 1000:.1f}"
+                for name, seconds in self._durations.items()
+            ]
+            metrics.extend(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self._marks.items())
+        metrics.append(f"total;dur={(time.monotonic() - self.start) * 1000:.1f}")
+        return ", ".join(metrics)
@@ -0,0 +1,241 @@
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import whisper
+from loguru import logger
+
+from .scheduler import SchedulerQueueFullError
+
+# Temperature fallback and quality thresholds of whisper.transcribe(), at its defaults
+_FALLBACK_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+_COMPRESSION_RATIO_THRESHOLD = 2.4
+_LOGPROB_THRESHOLD = -1.0
+_NO_SPEECH_THRESHOLD = 0.6
+
+
+def decode_audio_bytes(audio_bytes: bytes, sample_rate: int = whisper.audio.SAMPLE_RATE) -> np.ndarray:
+    """
+    Decode an encoded audio clip to mono float32 PCM in memory.
+    Args:
+        audio_bytes: The encoded audio (any container/codec ffmpeg understands).
+        sample_rate: The sample rate to resample to.
+    Returns:
+        The waveform as a float32 array in [-1, 1].
+    """
+    # Same conversion as whisper.load_audio(), but piping the bytes through ffmpeg instead of reading a file
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+        "-",
+    ]
+    try:
+        out = subprocess.run(cmd, input=audio_bytes, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to decode audio: {e.stderr.decode(errors='replace').strip()}") from e
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+@dataclass
+class TranscriptionRequest:
+    """A decoded clip that is waiting for, or being served by, the transcription worker."""
+
+    audio: np.ndarray
+    language: Optional[str] = None
+    future: Future = field(default_factory=Future)
+    enqueue_time: float = field(default_factory=time.monotonic)
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        return self.future.result(timeout=timeout)
+
+
+class WhisperTranscriptionService:
+    """
+    Micro-batches speech-to-text requests from concurrent callers into single Whisper forward passes.
+
+    Callers decode their audio in their own thread (`decode_audio_bytes`) and queue the waveform. A single worker
+    thread owns the Whisper model: it waits for a request, collects whatever else arrives within `max_batch_wait`
+    seconds (up to `max_batch_size` clips) and decodes clips that fit in one 30 second window as one mel batch.
+    As in `whisper.transcribe()`, clips whose greedy decode looks like a repetition loop or has a low log
+    probability are decoded again at increasing temperatures, and clips that are most likely silent come back blank.
+    Longer clips fall back to `whisper.transcribe()` on the in-memory waveform.
+
+    Args:
+        model (whisper.Whisper):
+            The loaded Whisper model.
+        max_batch_size (int):
+            The maximum number of clips decoded in one forward pass.
+        max_batch_wait (float):
+            Seconds the worker waits for more clips after the first one of a batch arrives.
+        max_queue_size (int):
+            The maximum number of clips waiting for the worker. Submitting beyond it raises
+            `SchedulerQueueFullError`. Use <= 0 for an unbounded queue.
+    """
+
+    def __init__(
+        self,
+        model: "whisper.Whisper",
+        max_batch_size: int = 8,
+        max_batch_wait: float = 0.01,
+        max_queue_size: int = 256,
+    ):
+        self.model = model
+        self.max_batch_size = max(max_batch_size, 1)
+        self.max_batch_wait = max_batch_wait
+        self.max_queue_size = max_queue_size
+        self._queue = queue.Queue(maxsize=max(max_queue_size, 0))
+        self._stats_lock = threading.Lock()
+        self._num_submitted = 0
+        self._num_rejected = 0
+        self._num_completed = 0
+        self._num_failed = 0
+        self._num_batches = 0
+        self._worker = threading.Thread(target=self._run, name="whisper-transcription", daemon=True)
+        self._worker.start()
+
+    def submit(self, audio_bytes: bytes, language: Optional[str] = None) -> TranscriptionRequest:
+        """
+        Decode a clip and queue it for transcription.
+        Args:
+            audio_bytes: The encoded audio clip.
+            language: Optional language code, detected per clip when omitted.
+        Returns:
+            The queued TranscriptionRequest. Call `result()` on it to wait for the text.
+        """
+        request = TranscriptionRequest(audio=decode_audio_bytes(audio_bytes), language=language)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._stats_lock:
+                self._num_rejected += 1
+            raise SchedulerQueueFullError(f"Transcription queue is full ({self.max_queue_size} pending clips)")
+        with self._stats_lock:
+            self._num_submitted += 1
+        return request
+
+    def transcribe(self, audio_bytes: bytes, language: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """Transcribe a single clip and block until its text is ready."""
+        return self.submit(audio_bytes, language=language).result(timeout=timeout)
+
+    def stats(self) -> dict:
+        """Return queue depth and cumulative batch accounting."""
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "submitted": self._num_submitted,
+                "rejected": self._num_rejected,
+                "completed": self._num_completed,
+                "failed": self._num_failed,
+                "batches": self._num_batches,
+                "avg_batch_size": (
+                    (self._num_completed + self._num_failed) / self._num_batches if self._num_batches else 0.0
+                ),
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker after the clips already queued have been transcribed."""
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = time.monotonic() + self.max_batch_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            with self._stats_lock:
+                self._num_batches += 1
+
+            # Clips sharing a language setting and fitting in one window are decoded together
+            groups: Dict[Optional[str], List[TranscriptionRequest]] = {}
+            for request in batch:
+                if len(request.audio) > whisper.audio.N_SAMPLES:
+                    self._transcribe_long(request)
+                else:
+                    groups.setdefault(request.language, []).append(request)
+            for language, group in groups.items():
+                self._decode_group(group, language)
+
+    def _decode_group(self, group: List[TranscriptionRequest], language: Optional[str]):
+        try:
+            mels = torch.stack(
+                [
+                    whisper.log_mel_spectrogram(whisper.pad_or_trim(request.audio), n_mels=self.model.dims.n_mels)
+                    for request in group
+                ]
+            ).to(self.model.device)
+            results = self._decode_with_fallback(mels, language)
+        except Exception as e:
+            for request in group:
+                self._fail(request, e)
+            return
+        for request, result in zip(group, results):
+            silent = result.no_speech_prob > _NO_SPEECH_THRESHOLD and result.avg_logprob < _LOGPROB_THRESHOLD
+            self._complete(request, "" if silent else result.text.strip())
+
+    def _decode_with_fallback(self, mels: torch.Tensor, language: Optional[str]) -> List["whisper.DecodingResult"]:
+        # Only the clips that fail the quality checks are decoded again, still as one batch per temperature
+        results: List[Optional["whisper.DecodingResult"]] = [None] * len(mels)
+        pending = list(range(len(mels)))
+        for temperature in _FALLBACK_TEMPERATURES:
+            options = whisper.DecodingOptions(
+                language=language, temperature=temperature, fp16=self.model.device.type == "cuda"
+            )
+            retry = []
+            for index, result in zip(pending, whisper.decode(self.model, mels[pending], options)):
+                results[index] = result
+                needs_fallback = (
+                    result.compression_ratio > _COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < _LOGPROB_THRESHOLD
+                )
+                # A clip that is probably silent is not retried, whatever its text
+                if needs_fallback and result.no_speech_prob <= _NO_SPEECH_THRESHOLD:
+                    retry.append(index)
+            pending = retry
+            if not pending:
+                break
+        return results
+
+    def _transcribe_long(self, request: TranscriptionRequest):
+        try:
+            result = self.model.transcribe(
+                request.audio, language=request.language, fp16=self.model.device.type == "cuda"
+            )
+        except Exception as e:
+            self._fail(request, e)
+        else:
+            self._complete(request, result["text"].strip())
+
+    def _complete(self, request: TranscriptionRequest, text: str):
+        with self._stats_lock:
+            self._num_completed += 1
+        request.future.set_result(text)
+
+    def _fail(self, request: TranscriptionRequest, error: Exception):
+        logger.opt(exception=error).error("Transcription failed")
+        with self._stats_lock:
+            self._num_failed += 1
+        request.future.set_exception(error)
@@ -150,6 +150,77 @@ def split_paragraph(text: str, tokenize, lang="zh", token_max_n=80, token_min_n=
     return final_utts
 
 
+class StreamingParagraphSplitter:
+    """
+    Cut streamed text into speakable units with `split_paragraph` as soon as sentences are complete.
+
+    The first complete sentence is released on its own to keep the time to first audio short. After that, complete
+    sentences are buffered until they reach `token_min_n` tokens, so later units are long enough for natural prosody.
+    """
+
+    def __init__(self, tokenize, lang="en", token_max_n=80, token_min_n=60, merge_len=20, comma_split=False):
+        self.tokenize = tokenize
+        self.lang = lang
+        self.token_max_n = token_max_n
+        self.token_min_n = token_min_n
+        self.merge_len = merge_len
+        self.comma_split = comma_split
+        self.pounc = ["。", "？", "！", "；", "：", "、", ".", "?", "!", ";"] if lang == "zh" else [".", "?", "!", ";", ":"]
+        if comma_split:
+            self.pounc.extend(["，", ","])
+        self._buffer = ""
+        self._num_released = 0
+
+    def push(self, text: str):
+        """Append streamed text, returns the units that became complete."""
+        self._buffer += text
+        end = self._complete_end()
+        if end == 0:
+            return []
+        complete = self._buffer[:end]
+        length = len(complete) if self.lang == "zh" else len(self.tokenize(complete))
+        if self._num_released > 0 and length < self.token_min_n:
+            return []
+        self._buffer = self._buffer[end:]
+        return self._split(complete)
+
+    def flush(self):
+        """Return the units left in the buffer once the text stream has ended."""
+        complete, self._buffer = self._buffer, ""
+        return self._split(complete)
+
+    def _complete_end(self) -> int:
+        # A sentence is complete once its punctuation (and closing quote) is followed by whitespace; full-width
+        # punctuation needs no whitespace after it
+        end = 0
+        for i, c in enumerate(self._buffer):
+            if c not in self.pounc:
+                continue
+            j = i + 1
+            if j < len(self._buffer) and self._buffer[j] in ['"', "”"]:
+                j += 1
+            if ord(c) > 127 or (j < len(self._buffer) and self._buffer[j].isspace()):
+                end = j
+        return end
+
+    def _split(self, text: str):
+        text = text.strip()
+        if not text or is_only_punctuation(text):
+            return []
+        units = split_paragraph(
+            text,
+            self.tokenize,
+            lang=self.lang,
+            token_max_n=self.token_max_n,
+            token_min_n=self.token_min_n,
+            merge_len=self.merge_len,
+            comma_split=self.comma_split,
+        )
+        units = [unit.strip() for unit in units if unit.strip()]
+        self._num_released += len(units)
+        return units
+
+
 def is_only_punctuation(text: str):
     # Regular expression: Match strings that consist only of punctuation marks or are empty.
     punctuation_pattern = r"^[\p{P}\p{S}]*$"
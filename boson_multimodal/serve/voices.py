@@ -0,0 +1,139 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+import torch
+from loguru import logger
+
+from .serve_engine import HiggsAudioServeEngine
+
+
+_VOICE_ID_RE = re.compile(r"^voice_[0-9a-f]{24}$")
+
+
+@dataclass
+class VoiceProfile:
+    """Metadata of a registered voice. Its reference audio codes are stored next to it."""
+
+    id: str
+    name: str
+    created_at: int
+    num_frames: int
+    duration: float
+
+
+class VoiceRegistry:
+    """
+    Stores cloned voices on disk as precomputed audio tokenizer codes.
+
+    Registering a voice runs the reference clip through `librosa.load` and the audio tokenizer once. Generation
+    requests then reference the voice by id and pass its codes as `AudioContent(audio_codes=...)`, skipping audio
+    decoding, resampling and encoding. Each voice is a directory `<root_dir>/<voice_id>/` holding `voice.json` and
+    `codes.pt`; loaded codes are kept in memory.
+
+    Args:
+        root_dir (str):
+            The directory holding the registered voices. Created if missing.
+        engine (HiggsAudioServeEngine):
+            The engine whose audio tokenizer encodes the reference clips.
+    """
+
+    def __init__(self, root_dir: str, engine: HiggsAudioServeEngine):
+        self.root_dir = root_dir
+        self.engine = engine
+        self._lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        self._codes: Dict[str, torch.Tensor] = {}
+        os.makedirs(root_dir, exist_ok=True)
+
+    def create(self, audio_bytes: bytes, name: Optional[str] = None) -> VoiceProfile:
+        """
+        Encode a reference clip and register it as a new voice.
+        Args:
+            audio_bytes: The encoded reference audio clip.
+            name: Optional human readable name.
+        Returns:
+            The new VoiceProfile.
+        """
+        voice_id = f"voice_{uuid.uuid4().hex[:24]}"
+        # Encode concurrent uploads one at a time
+        with self._encode_lock:
+            codes = self.engine.encode_audio(audio_bytes)
+        profile = VoiceProfile(
+            id=voice_id,
+            name=name or voice_id,
+            created_at=int(time.time()),
+            num_frames=codes.shape[-1],
+            duration=codes.shape[-1] * self.engine.samples_per_token / self.engine.audio_tokenizer.sampling_rate,
+        )
+
+        # Write to a temporary directory first so a voice is never visible half written
+        voice_dir = self._voice_dir(voice_id)
+        tmp_dir = f"{voice_dir}.tmp"
+        os.makedirs(tmp_dir)
+        torch.save(codes, os.path.join(tmp_dir, "codes.pt"))
+        with open(os.path.join(tmp_dir, "voice.json"), "w") as f:
+            json.dump(asdict(profile), f)
+        os.rename(tmp_dir, voice_dir)
+
+        with self._lock:
+            self._codes[voice_id] = codes
+        logger.info(f"Registered voice {voice_id} ({profile.duration:.1f}s of reference audio)")
+        return profile
+
+    def get(self, voice_id: str) -> Optional[VoiceProfile]:
+        """Return the profile of a registered voice, or None if it does not exist."""
+        if not self.exists(voice_id):
+            return None
+        with open(os.path.join(self._voice_dir(voice_id), "voice.json")) as f:
+            return VoiceProfile(**json.load(f))
+
+    def list(self) -> List[VoiceProfile]:
+        """Return all registered voices, oldest first."""
+        profiles = [self.get(voice_id) for voice_id in os.listdir(self.root_dir) if _VOICE_ID_RE.match(voice_id)]
+        return sorted((profile for profile in profiles if profile is not None), key=lambda profile: profile.created_at)
+
+    def exists(self, voice_id: str) -> bool:
+        return bool(_VOICE_ID_RE.match(voice_id)) and os.path.isfile(
+            os.path.join(self._voice_dir(voice_id), "voice.json")
+        )
+
+    def load_codes(self, voice_id: str) -> torch.Tensor:
+        """
+        Return the reference audio codes of a registered voice.
+        Args:
+            voice_id: The voice id.
+        Returns:
+            The codes as a CPU tensor of shape (num_codebooks, num_frames).
+        Raises:
+            KeyError: If the voice does not exist.
+        """
+        with self._lock:
+            codes = self._codes.get(voice_id)
+        if codes is not None:
+            return codes
+        if not self.exists(voice_id):
+            raise KeyError(voice_id)
+        codes = torch.load(os.path.join(self._voice_dir(voice_id), "codes.pt"), map_location="cpu")
+        with self._lock:
+            self._codes[voice_id] = codes
+        return codes
+
+    def delete(self, voice_id: str) -> bool:
+        """Delete a registered voice. Returns False if it does not exist."""
+        if not self.exists(voice_id):
+            return False
+        with self._lock:
+            self._codes.pop(voice_id, None)
+        shutil.rmtree(self._voice_dir(voice_id), ignore_errors=True)
+        logger.info(f"Deleted voice {voice_id}")
+        return True
+
+    def _voice_dir(self, voice_id: str) -> str:
+        return os.path.join(self.root_dir, voice_id)
@@ -0,0 +1,603 @@
+import itertools
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from ..data_types import ChatMLSample
+from .scheduler import (
+    PRIORITY_CLASSES,
+    PRIORITY_INTERACTIVE,
+    AdmissionRejectedError,
+    GenerationCancelledError,
+    SchedulerQueueFullError,
+    estimate_generation_tokens,
+)
+
+if TYPE_CHECKING:
+    from .serve_engine import HiggsAudioServeEngine, HiggsAudioResponse
+
+
+# Seconds between the cancellation checks of the dispatcher
+_CANCEL_POLL_INTERVAL = 0.05
+# Counters of the worker schedulers that the pool reports summed up
+_SUMMED_STATS = (
+    "queue_depth", "submitted", "deadline_exceeded", "cancelled", "cancelled_steps", "cancelled_saved_tokens",
+    "outstanding_tokens", "tokens_per_second", "active", "completed", "failed",
+)
+
+
+def _send(conn, lock: threading.Lock, message: tuple):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    with lock:
+        conn.send_bytes(data)
+
+
+def _picklable_error(error: BaseException) -> BaseException:
+    """The error itself if it survives a round trip through pickle, else a RuntimeError describing it."""
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _worker_main(
+    conn,
+    cpus: List[int],
+    num_threads: int,
+    engine_kwargs: Dict[str, Any],
+    scheduler_kwargs: Dict[str, Any],
+    stats_interval: float,
+    engine_class: Optional[type] = None,
+):
+    """Entry point of a worker process: pin it, load an engine and serve the dispatcher's requests."""
+    # The intra-op thread pools are sized when torch is loaded, so pin the process before importing it
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(num_threads)
+    import torch
+
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+
+    from .scheduler import HiggsAudioRequestScheduler
+    from .serve_engine import HiggsAudioServeEngine, HiggsAudioStreamer
+
+    send_lock = threading.Lock()
+    try:
+        engine = (engine_class or HiggsAudioServeEngine)(**engine_kwargs)
+        scheduler = HiggsAudioRequestScheduler(engine, **scheduler_kwargs)
+    except Exception:
+        _send(conn, send_lock, ("failed", traceback.format_exc()))
+        return
+    _send(conn, send_lock, ("ready", engine.max_batch_size))
+
+    requests = {}
+    stopping = threading.Event()
+
+    def report_stats():
+        while not stopping.wait(stats_interval):
+            try:
+                _send(conn, send_lock, ("stats", scheduler.stats(), engine.kv_cache_stats()))
+            except OSError:
+                return
+
+    def forward_delta(request_id: int, delta):
+        if delta is not None:
+            # Deltas can be views of larger tensors, which pickle whole
+            delta.text_tokens = None if delta.text_tokens is None else delta.text_tokens.clone()
+            delta.audio_tokens = None if delta.audio_tokens is None else delta.audio_tokens.clone()
+        _send(conn, send_lock, ("delta", request_id, delta))
+
+    def on_done(request_id: int, request):
+        requests.pop(request_id, None)
+        response, error = None, None
+        if request.future.cancelled():
+            error = GenerationCancelledError("Cancelled before it started")
+        elif request.future.exception() is not None:
+            error = _picklable_error(request.future.exception())
+        else:
+            response = request.future.result()
+        _send(
+            conn,
+            send_lock,
+            ("done", request_id, response, error, request.queue_wait, request.service_time, request.num_steps),
+        )
+
+    threading.Thread(target=report_stats, name="engine-worker-stats", daemon=True).start()
+    while True:
+        try:
+            message = pickle.loads(conn.recv_bytes())
+        except (EOFError, OSError):
+            # The dispatcher went away
+            break
+        kind = message[0]
+        if kind == "submit":
+            _, request_id, chat_ml_sample, submit_kwargs, streamer_kwargs = message
+            streamer = None
+            if streamer_kwargs is not None:
+                streamer = HiggsAudioStreamer(
+                    engine.tokenizer, audio_num_codebooks=engine.audio_num_codebooks, **streamer_kwargs
+                )
+                # on_delta is where the streamer hands deltas over, forward them instead of queueing them here
+                streamer.on_delta = lambda delta, request_id=request_id: forward_delta(request_id, delta)
+            try:
+                request = scheduler.submit(chat_ml_sample, streamer=streamer, **submit_kwargs)
+            except Exception as e:
+                if streamer is not None:
+                    streamer.end()
+                _send(conn, send_lock, ("done", request_id, None, _picklable_error(e), None, None, 0))
+                continue
+            requests[request_id] = request
+            request.future.add_done_callback(lambda _, request_id=request_id, request=request: on_done(request_id, request))
+        elif kind == "cancel":
+            request = requests.get(message[1])
+            if request is not None:
+                request.cancel()
+        elif kind == "shutdown":
+            break
+    stopping.set()
+    scheduler.shutdown(wait=True)
+
+
+@dataclass
+class PooledGenerationRequest:
+    """A generation request dispatched to a worker process of an EngineWorkerPool."""
+
+    future: Future
+    priority: int
+    stop_signal: threading.Event
+    worker_index: int
+    # Estimated decode steps, charged against the worker until the request is done
+    cost: float
+    streamer: Optional[Any] = None
+    enqueue_time: float = field(default_factory=time.monotonic)
+    queue_wait: Optional[float] = None
+    service_time: Optional[float] = None
+    num_steps: int = 0
+    cancel_sent: bool = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self.stop_signal.is_set()
+
+    def cancel(self):
+        """Cancel the request, the worker drops it from its queue or stops it at the next token boundary."""
+        self.stop_signal.set()
+
+    def result(self, timeout: Optional[float] = None) -> "HiggsAudioResponse":
+        return self.future.result(timeout=timeout)
+
+
+class _WorkerHandle:
+    """The dispatcher's side of a worker process."""
+
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.failure: Optional[str] = None
+        self.alive = True
+        self.max_batch_size = 0
+        self.requests: Dict[int, PooledGenerationRequest] = {}
+        self.outstanding_tokens = {priority: 0.0 for priority in PRIORITY_CLASSES.values()}
+        self.num_in_flight = {priority: 0 for priority in PRIORITY_CLASSES.values()}
+        self.num_dispatched = 0
+        self.stats: Dict[str, Any] = {}
+        self.kv_stats: Dict[str, Any] = {}
+
+    def send(self, message: tuple):
+        _send(self.conn, self.send_lock, message)
+
+
+class EngineWorkerPool:
+    """
+    Runs generations on several engine processes, for CPU hosts where one engine cannot use all the cores.
+
+    Every worker is a spawned process with its own HiggsAudioServeEngine and HiggsAudioRequestScheduler, pinned to a
+    disjoint slice of the host's CPUs with as many intra-op threads. The engines map their weights from the same
+    snapshot files (`shared_weights_dir`), so N workers cost about one model's worth of RAM plus their KV caches.
+
+    The pool is a drop-in replacement for the scheduler in the serving process: `submit()` dispatches each request to
+    the worker with the lowest projected queue delay (then the fewest requests in flight), streamed deltas and
+    responses come back over a pipe, and the admission control, queue bound and cancellation of the scheduler are
+    applied by the dispatcher. The front `engine` of the serving process only serves the tokenizers and the codec,
+    create it with `max_batch_size=0` and the same `shared_weights_dir`. A worker that dies fails its in-flight
+    requests and is restarted.
+
+    Args:
+        engine (HiggsAudioServeEngine):
+            The front engine of the serving process.
+        num_workers (int):
+            The number of worker processes.
+        engine_kwargs (dict):
+            The HiggsAudioServeEngine arguments of the workers, e.g. `device="cpu"`, `max_batch_size` and
+            `shared_weights_dir`.
+        threads_per_worker (int, optional):
+            The intra-op threads of each worker. Defaults to the number of CPUs pinned to it.
+        max_queue_size (int):
+            The maximum number of requests waiting for a KV cache slot across the pool. Use <= 0 for no bound.
+        max_queue_delay (float, optional):
+            The latency objective in seconds for the projected queue delay. None disables admission control.
+        initial_tokens_per_second (float):
+            The decode throughput of a worker assumed until it has measured it.
+        reserved_interactive_slots (int):
+            KV cache slots of each worker that bulk requests may not take.
+        bulk_step_interval (int):
+            While interactive sequences run, bulk sequences are advanced once every this many iterations.
+        on_complete (Callable[[PooledGenerationRequest, HiggsAudioResponse], None], optional):
+            Called with every completed request and its response, before its future resolves.
+        stats_interval (float):
+            Seconds between the statistics reports of the workers.
+        start_timeout (float):
+            Seconds to wait for the workers to load their engines.
+        engine_class (type, optional):
+            The engine class of the workers, e.g. a StandInServeEngine for load tests. Defaults to
+            HiggsAudioServeEngine. It is passed to the workers by reference, so it must be importable.
+    """
+
+    def __init__(
+        self,
+        engine: "HiggsAudioServeEngine",
+        num_workers: int,
+        engine_kwargs: Dict[str, Any],
+        threads_per_worker: Optional[int] = None,
+        max_queue_size: int = 64,
+        max_queue_delay: Optional[float] = None,
+        initial_tokens_per_second: float = 50.0,
+        reserved_interactive_slots: int = 0,
+        bulk_step_interval: int = 4,
+        on_complete: Optional[Callable[[PooledGenerationRequest, "HiggsAudioResponse"], None]] = None,
+        stats_interval: float = 1.0,
+        start_timeout: float = 600.0,
+        engine_class: Optional[type] = None,
+    ):
+        if num_workers < 1:
+            raise ValueError("An engine worker pool needs at least one worker")
+        self.engine = engine
+        self.num_workers = num_workers
+        self.engine_kwargs = engine_kwargs
+        self.engine_class = engine_class
+        self.max_queue_size = max_queue_size
+        self.max_queue_delay = max_queue_delay
+        self.initial_tokens_per_second = initial_tokens_per_second
+        self.reserved_interactive_slots = reserved_interactive_slots
+        self.on_complete = on_complete
+        self.stats_interval = stats_interval
+        # Admission control and the queue bound are applied by the dispatcher, the workers take everything it sends
+        self._scheduler_kwargs = dict(
+            max_queue_size=0,
+            max_queue_delay=None,
+            initial_tokens_per_second=initial_tokens_per_second,
+            reserved_interactive_slots=reserved_interactive_slots,
+            bulk_step_interval=bulk_step_interval,
+        )
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._stopping = False
+        self._num_rejected = 0
+        self._num_shed = 0
+        self._num_restarts = 0
+
+        if hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+        cpus_per_worker = max(len(cpus) // num_workers, 1)
+        self._cpu_sets = [
+            cpus[i * cpus_per_worker : (i + 1) * cpus_per_worker] if len(cpus) >= num_workers else []
+            for i in range(num_workers)
+        ]
+        self._threads_per_worker = threads_per_worker or cpus_per_worker
+
+        self._workers: List[_WorkerHandle] = [self._start_worker(index) for index in range(num_workers)]
+        deadline = time.monotonic() + start_timeout
+        for worker in self._workers:
+            if not worker.ready.wait(max(deadline - time.monotonic(), 0)) or worker.failure is not None:
+                self.shutdown(wait=False)
+                raise RuntimeError(f"Engine worker {worker.index} did not start: {worker.failure or 'timed out'}")
+        logger.info(
+            f"Started {num_workers} engine workers with {self._threads_per_worker} threads each, "
+            f"{self.max_batch_size} KV cache slots in total"
+        )
+        threading.Thread(target=self._watch_cancellations, name="engine-pool-cancel", daemon=True).start()
+
+    @property
+    def max_batch_size(self) -> int:
+        """The number of sequences decoded concurrently across the workers."""
+        return sum(worker.max_batch_size for worker in self._workers)
+
+    def submit(
+        self,
+        chat_ml_sample: ChatMLSample,
+        priority: int = PRIORITY_INTERACTIVE,
+        deadline: Optional[float] = None,
+        enforce_slo: bool = True,
+        stop_signal: Optional[threading.Event] = None,
+        **generate_kwargs,
+    ) -> PooledGenerationRequest:
+        """
+        Dispatch a generation request to a worker. Same arguments as `HiggsAudioRequestScheduler.submit()`; a
+        `streamer` is fed with the deltas forwarded by the worker.
+        """
+        if priority not in PRIORITY_CLASSES.values():
+            raise ValueError(f"Unknown priority {priority}")
+        streamer = generate_kwargs.pop("streamer", None)
+        cost = estimate_generation_tokens(
+            chat_ml_sample,
+            generate_kwargs.get("max_new_tokens", 1024),
+            num_codebooks=self.engine.audio_num_codebooks,
+        )
+        with self._lock:
+            if enforce_slo:
+                self._check_admission(priority)
+            workers = [worker for worker in self._workers if worker.alive and worker.ready.is_set()]
+            if not workers:
+                raise SchedulerQueueFullError("No engine worker is running")
+            if 0 < self.max_queue_size <= self._num_waiting():
+                self._num_rejected += 1
+                raise SchedulerQueueFullError(f"Generation queue is full ({self.max_queue_size} pending requests)")
+            # Ties go to the worker that got the fewest requests, so that sequential requests are spread too
+            worker = min(
+                workers,
+                key=lambda w: (self._projected_queue_delay(w, priority), sum(w.num_in_flight.values()), w.num_dispatched),
+            )
+            request_id = next(self._request_ids)
+            request = PooledGenerationRequest(
+                future=Future(),
+                priority=priority,
+                stop_signal=stop_signal if stop_signal is not None else threading.Event(),
+                worker_index=worker.index,
+                cost=cost,
+                streamer=streamer,
+            )
+            # Running from the start, the worker resolves it even when it is cancelled before it starts
+            request.future.set_running_or_notify_cancel()
+            worker.requests[request_id] = request
+            worker.outstanding_tokens[priority] += cost
+            worker.num_in_flight[priority] += 1
+            worker.num_dispatched += 1
+
+        streamer_kwargs = None
+        if streamer is not None:
+            streamer_kwargs = dict(skip_prompt=streamer.skip_prompt, timeout=streamer.timeout, **streamer.decode_kwargs)
+        # time.monotonic() is system-wide on Linux, deadlines keep their meaning in the worker
+        submit_kwargs = dict(priority=priority, deadline=deadline, enforce_slo=False, **generate_kwargs)
+        try:
+            worker.send(("submit", request_id, chat_ml_sample, submit_kwargs, streamer_kwargs))
+        except OSError as e:
+            self._finish(worker, request_id, None, RuntimeError(f"Engine worker {worker.index} is gone: {e}"))
+        return request
+
+    def generate(
+        self, chat_ml_sample: ChatMLSample, timeout: Optional[float] = None, **generate_kwargs
+    ) -> "HiggsAudioResponse":
+        """Submit a request and block until its response is ready."""
+        return self.submit(chat_ml_sample, **generate_kwargs).result(timeout=timeout)
+
+    def projected_queue_delay(self, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Seconds a request of the priority class submitted now is expected to wait on the least loaded worker."""
+        with self._lock:
+            return self._min_queue_delay(priority)
+
+    def check_admission(self, priority: int = PRIORITY_INTERACTIVE):
+        """Raise `AdmissionRejectedError` if a request submitted now would miss the queue delay objective."""
+        with self._lock:
+            self._check_admission(priority)
+
+    def stats(self) -> dict:
+        """Return the summed statistics of the workers, in the format of `HiggsAudioRequestScheduler.stats()`."""
+        with self._lock:
+            workers = list(self._workers)
+            stats = {name: 0 for name in _SUMMED_STATS}
+            stats["queued"] = {name: 0 for name in PRIORITY_CLASSES}
+            total_queue_wait = 0.0
+            total_service_time = 0.0
+            for worker in workers:
+                for name in _SUMMED_STATS:
+                    stats[name] += worker.stats.get(name, 0)
+                for name, num_queued in worker.stats.get("queued", {}).items():
+                    stats["queued"][name] += num_queued
+                num_served = worker.stats.get("completed", 0) + worker.stats.get("failed", 0)
+                total_queue_wait += worker.stats.get("avg_queue_wait", 0.0) * num_served
+                total_service_time += worker.stats.get("avg_service_time", 0.0) * num_served
+            num_served = stats["completed"] + stats["failed"]
+            stats.update(
+                max_queue_size=self.max_queue_size,
+                rejected=self._num_rejected,
+                shed=self._num_shed,
+                projected_queue_delay={
+                    name: round(self._min_queue_delay(priority), 3) for name, priority in PRIORITY_CLASSES.items()
+                },
+                avg_queue_wait=total_queue_wait / num_served if num_served else 0.0,
+                avg_service_time=total_service_time / num_served if num_served else 0.0,
+                workers=[
+                    {"index": w.index, "pid": w.process.pid, "alive": w.alive, "in_flight": len(w.requests)}
+                    for w in workers
+                ],
+                worker_restarts=self._num_restarts,
+            )
+            return stats
+
+    def kv_cache_stats(self) -> dict:
+        """Return the KV cache slot and bucket usage summed over the workers."""
+        with self._lock:
+            workers = list(self._workers)
+        stats = {"slots": 0, "free_slots": 0, "buckets_in_use": {}, "bucket_promotions": {}}
+        for worker in workers:
+            stats["slots"] += worker.kv_stats.get("slots", 0)
+            stats["free_slots"] += worker.kv_stats.get("free_slots", 0)
+            for name in ("buckets_in_use", "bucket_promotions"):
+                for length, count in worker.kv_stats.get(name, {}).items():
+                    stats[name][length] = stats[name].get(length, 0) + count
+        return stats
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers after the requests they already hold have been served."""
+        self._stopping = True
+        for worker in self._workers:
+            try:
+                worker.send(("shutdown",))
+            except OSError:
+                pass
+        if wait:
+            for worker in self._workers:
+                worker.process.join()
+
+    def _start_worker(self, index: int) -> _WorkerHandle:
+        conn, child_conn = self._context.Pipe(duplex=True)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                child_conn,
+                self._cpu_sets[index],
+                self._threads_per_worker,
+                self.engine_kwargs,
+                self._scheduler_kwargs,
+                self.stats_interval,
+                self.engine_class,
+            ),
+            name=f"engine-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker = _WorkerHandle(index, process, conn)
+        threading.Thread(target=self._receive, args=(worker,), name=f"engine-pool-recv-{index}", daemon=True).start()
+        return worker
+
+    def _receive(self, worker: _WorkerHandle):
+        while True:
+            try:
+                message = pickle.loads(worker.conn.recv_bytes())
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == "delta":
+                _, request_id, delta = message
+                request = worker.requests.get(request_id)
+                if request is not None and request.streamer is not None:
+                    if delta is None:
+                        request.streamer.end()
+                    else:
+                        request.streamer.on_delta(delta)
+            elif kind == "done":
+                _, request_id, response, error, queue_wait, service_time, num_steps = message
+                self._finish(worker, request_id, response, error, queue_wait, service_time, num_steps)
+            elif kind == "stats":
+                worker.stats, worker.kv_stats = message[1], message[2]
+            elif kind == "ready":
+                worker.max_batch_size = message[1]
+                worker.ready.set()
+            elif kind == "failed":
+                worker.failure = message[1]
+                logger.error(f"Engine worker {worker.index} failed to start:\n{worker.failure}")
+                worker.ready.set()
+
+        worker.alive = False
+        worker.process.join()
+        for request_id in list(worker.requests):
+            request = worker.requests.get(request_id)
+            if request is not None and request.streamer is not None:
+                request.streamer.end()
+            self._finish(
+                worker,
+                request_id,
+                None,
+                RuntimeError(f"Engine worker {worker.index} exited with code {worker.process.exitcode}"),
+            )
+        if self._stopping or worker.failure is not None:
+            return
+        logger.error(f"Engine worker {worker.index} exited with code {worker.process.exitcode}, restarting it")
+        with self._lock:
+            self._num_restarts += 1
+            self._workers[worker.index] = self._start_worker(worker.index)
+
+    def _finish(
+        self,
+        worker: _WorkerHandle,
+        request_id: int,
+        response: Optional["HiggsAudioResponse"],
+        error: Optional[BaseException],
+        queue_wait: Optional[float] = None,
+        service_time: Optional[float] = None,
+        num_steps: int = 0,
+    ):
+        with self._lock:
+            request = worker.requests.pop(request_id, None)
+            if request is None:
+                return
+            worker.outstanding_tokens[request.priority] -= request.cost
+            worker.num_in_flight[request.priority] -= 1
+        request.queue_wait = queue_wait
+        request.service_time = service_time
+        request.num_steps = num_steps
+        if error is not None:
+            request.future.set_exception(error)
+            return
+        if self.on_complete is not None:
+            try:
+                self.on_complete(request, response)
+            except Exception:
+                logger.exception("Generation completion hook failed")
+        request.future.set_result(response)
+
+    def _watch_cancellations(self):
+        # Stop signals are plain events of this process, forward the ones that get set to the workers
+        while not self._stopping:
+            time.sleep(_CANCEL_POLL_INTERVAL)
+            with self._lock:
+                cancelled = [
+                    (worker, request_id, request)
+                    for worker in self._workers
+                    for request_id, request in worker.requests.items()
+                    if request.cancelled and not request.cancel_sent
+                ]
+            for worker, request_id, request in cancelled:
+                request.cancel_sent = True
+                try:
+                    worker.send(("cancel", request_id))
+                except OSError:
+                    pass
+
+    def _num_waiting(self) -> int:
+        return sum(max(sum(w.num_in_flight.values()) - w.max_batch_size, 0) for w in self._workers if w.alive)
+
+    def _projected_queue_delay(self, worker: _WorkerHandle, priority: int) -> float:
+        # Same model as the scheduler's, with requests charged their whole estimate until they are done
+        free_slots = worker.max_batch_size - sum(worker.num_in_flight.values())
+        if priority != PRIORITY_INTERACTIVE:
+            free_slots -= self.reserved_interactive_slots
+        if free_slots > 0:
+            return 0.0
+        outstanding_tokens = sum(t for p, t in worker.outstanding_tokens.items() if p <= priority)
+        tokens_per_second = worker.stats.get("tokens_per_second") or self.initial_tokens_per_second
+        return outstanding_tokens / tokens_per_second
+
+    def _min_queue_delay(self, priority: int) -> float:
+        delays = [self._projected_queue_delay(w, priority) for w in self._workers if w.alive and w.ready.is_set()]
+        return min(delays) if delays else 0.0
+
+    def _check_admission(self, priority: int):
+        if self.max_queue_delay is None:
+            return
+        delay = self._min_queue_delay(priority)
+        if delay <= self.max_queue_delay:
+            return
+        self._num_shed += 1
+        retry_after = max(delay - self.max_queue_delay, 1.0)
+        raise AdmissionRejectedError(
+            f"Projected queue delay {delay:.1f}s exceeds the {self.max_queue_delay:.1f}s objective", retry_after
+        )
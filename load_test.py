@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+import argparse
+import base64
+import io
+import json
+import math
+import random
+import struct
+import sys
+import threading
+import time
+import wave
+from collections import Counter, defaultdict
+
+import requests
+
+VOICES = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
+TEXTS = [
+    "Hello! Thanks for calling, how can I help you today?",
+    "Your order has shipped and should arrive on Thursday.",
+    "I'm sorry, I didn't quite catch that. Could you say it again?",
+    "The meeting has been moved to three o'clock in the main conference room.",
+    "Once upon a time, in a small village by the sea, there lived an old fisherman and his daughter. "
+    "Every morning they rowed out before sunrise, and every evening they came back with stories to tell.",
+    "Please hold while I transfer you to the billing department.",
+    "Today's forecast calls for light rain in the morning, clearing up by the afternoon with a high of eighteen degrees.",
+]
+REQUEST_KINDS = ("tts", "clone", "audio_input")
+
+
+def synthetic_wav(seconds, sample_rate=24000):
+    """A speech-like test clip: a gliding tone with a syllable-rate envelope"""
+    frames = bytearray()
+    phase = 0.0
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        phase += 2 * math.pi * (140 + 40 * math.sin(2 * math.pi * 0.7 * t)) / sample_rate
+        envelope = 0.5 + 0.5 * math.sin(2 * math.pi * 4 * t)
+        frames += struct.pack("<h", int(12000 * envelope * math.sin(phase)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def load_audio(path, seconds):
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    return synthetic_wav(seconds)
+
+
+def parse_mix(spec):
+    """Parse "tts=6,clone=2,audio_input=2" into request kinds and their weights"""
+    mix = {}
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise ValueError(f"Unknown request kind '{kind}', expected one of {', '.join(REQUEST_KINDS)}")
+        mix[kind] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("The request mix needs at least one positive weight")
+    return mix
+
+
+def build_request(kind, rng, reference_audio, input_audio, stream):
+    """Return the path and JSON body of a request of the given kind"""
+    text = rng.choice(TEXTS)
+    if kind == "tts":
+        return "/v1/audio/speech", {
+            "model": "tts-1",
+            "input": text,
+            "voice": rng.choice(VOICES),
+            "response_format": "wav",
+        }
+    if kind == "clone":
+        audio = {"data": reference_audio, "format": "wav"}
+        content = f"Say verbatim: {text}"
+    else:
+        audio = {"voice": rng.choice(VOICES), "format": "wav"}
+        content = [
+            {"type": "text", "text": "Please answer the question in this recording."},
+            {"type": "input_audio", "input_audio": {"data": input_audio, "format": "wav"}},
+        ]
+    return "/v1/chat/completions", {
+        "model": "gpt-4o-audio-preview",
+        "modalities": ["text", "audio"],
+        "audio": audio,
+        "stream": stream,
+        "messages": [{"role": "user", "content": content}],
+    }
+
+
+class LoadTestResults:
+    """Outcomes of the requests of a run, recorded from the request threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.skipped = Counter()
+        self.sent = Counter()
+
+    def record(self, kind, latency, ttfb, error):
+        with self.lock:
+            if error is None:
+                self.samples[kind].append((latency, ttfb))
+            else:
+                self.errors[kind][error] += 1
+
+    def summary(self, elapsed):
+        def percentiles(values):
+            if not values:
+                return None
+            values = sorted(values)
+            result = {f"p{p}": round(values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)], 4) for p in (50, 90, 99)}
+            result["max"] = round(values[-1], 4)
+            return result
+
+        kinds = {}
+        with self.lock:
+            for kind in sorted(set(self.sent) | set(self.skipped)):
+                samples = self.samples[kind]
+                num_errors = sum(self.errors[kind].values())
+                num_done = len(samples) + num_errors
+                kinds[kind] = {
+                    "sent": self.sent[kind],
+                    "skipped": self.skipped[kind],
+                    "succeeded": len(samples),
+                    "failed": num_errors,
+                    "error_rate": round(num_errors / num_done, 4) if num_done else 0.0,
+                    "errors": dict(self.errors[kind]),
+                    "throughput_rps": round(len(samples) / elapsed, 3),
+                    "latency_seconds": percentiles([latency for latency, _ in samples]),
+                    "ttfb_seconds": percentiles([ttfb for _, ttfb in samples]),
+                }
+            all_samples = [sample for samples in self.samples.values() for sample in samples]
+            num_errors = sum(sum(errors.values()) for errors in self.errors.values())
+            num_done = len(all_samples) + num_errors
+            return {
+                "elapsed_seconds": round(elapsed, 3),
+                "sent": sum(self.sent.values()),
+                "skipped": sum(self.skipped.values()),
+                "succeeded": len(all_samples),
+                "failed": num_errors,
+                "error_rate": round(num_errors / num_done, 4) if num_done else 0.0,
+                "throughput_rps": round(len(all_samples) / elapsed, 3),
+                "latency_seconds": percentiles([latency for latency, _ in all_samples]),
+                "ttfb_seconds": percentiles([ttfb for _, ttfb in all_samples]),
+                "kinds": kinds,
+            }
+
+
+def send_request(session, server, path, body, timeout):
+    """Send a request and read the whole response. Returns (ttfb, error), ttfb in seconds from the call"""
+    start = time.monotonic()
+    ttfb = None
+    error = None
+    try:
+        with session.post(f"{server}{path}", json=body, stream=True, timeout=timeout) as response:
+            if response.status_code != 200:
+                return None, f"http_{response.status_code}"
+            if body.get("stream"):
+                for line in response.iter_lines():
+                    if ttfb is None:
+                        ttfb = time.monotonic() - start
+                    # Errors after the first byte of a streamed reply arrive as events of their own
+                    if line.startswith(b'data: {"error"'):
+                        error = "stream_error"
+            else:
+                for chunk in response.iter_content(chunk_size=None):
+                    if ttfb is None and chunk:
+                        ttfb = time.monotonic() - start
+    except requests.Timeout:
+        return ttfb, "timeout"
+    except requests.ConnectionError:
+        return ttfb, "connection_error"
+    except requests.RequestException as e:
+        return ttfb, type(e).__name__
+    return (ttfb if ttfb is not None else time.monotonic() - start), error
+
+
+def run_load_test(server, rps, duration, mix, reference_audio, input_audio, stream, max_in_flight, timeout, arrival, seed):
+    rng = random.Random(seed)
+    reference_audio = base64.b64encode(reference_audio).decode("ascii")
+    input_audio = base64.b64encode(input_audio).decode("ascii")
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+
+    results = LoadTestResults()
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    local = threading.local()
+    threads = []
+
+    def worker(kind, path, body, scheduled):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        try:
+            # Latencies count from the scheduled send time, so a slow client does not hide server queueing
+            start_delay = time.monotonic() - scheduled
+            ttfb, error = send_request(local.session, server, path, body, timeout)
+            results.record(kind, time.monotonic() - scheduled, start_delay + (ttfb or 0.0), error)
+        finally:
+            in_flight.release()
+
+    start = time.monotonic()
+    next_send = start
+    while next_send < start + duration:
+        now = time.monotonic()
+        if next_send > now:
+            time.sleep(next_send - now)
+        kind = rng.choices(kinds, weights)[0]
+        path, body = build_request(kind, rng, reference_audio, input_audio, stream)
+        if in_flight.acquire(blocking=False):
+            results.sent[kind] += 1
+            thread = threading.Thread(target=worker, args=(kind, path, body, next_send), daemon=True)
+            thread.start()
+            threads.append(thread)
+        else:
+            # Open loop: a request that finds every client slot busy is counted instead of delaying the schedule
+            results.skipped[kind] += 1
+        next_send += rng.expovariate(rps) if arrival == "poisson" else 1.0 / rps
+
+    for thread in threads:
+        thread.join()
+    return results.summary(time.monotonic() - start)
+
+
+def print_summary(summary):
+    def row(name, stats):
+        latency = stats["latency_seconds"] or {}
+        ttfb = stats["ttfb_seconds"] or {}
+        print(
+            f"  {name:<12} {stats['sent']:>6} {stats['succeeded']:>6} {stats['error_rate'] * 100:>6.1f}% "
+            f"{stats['throughput_rps']:>8.2f} "
+            f"{latency.get('p50', 0):>8.3f} {latency.get('p90', 0):>8.3f} {latency.get('p99', 0):>8.3f} "
+            f"{ttfb.get('p50', 0):>8.3f} {ttfb.get('p99', 0):>8.3f}"
+        )
+
+    print(f"\n📊 {summary['sent']} requests in {summary['elapsed_seconds']:.1f}s ({summary['skipped']} skipped at the in-flight limit)")
+    print(f"  {'kind':<12} {'sent':>6} {'ok':>6} {'errors':>7} {'ok/s':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'ttfb50':>8} {'ttfb99':>8}")
+    for kind, stats in summary["kinds"].items():
+        row(kind, stats)
+    row("total", summary)
+    for kind, stats in summary["kinds"].items():
+        for error, count in sorted(stats["errors"].items()):
+            print(f"  ⚠️  {kind}: {count} × {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay a mix of TTS, voice-cloning and audio-input requests at a target rate",
+        epilog="For runs without the models, start the service with STAND_IN_PROFILE and LLM_UPSTREAM_URL pointing at stand_in_llm.py",
+    )
+    parser.add_argument("--server", default="http://localhost:8000", help="Service base URL")
+    parser.add_argument("--rps", type=float, default=1.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to send requests for")
+    parser.add_argument("--mix", default="tts=6,clone=2,audio_input=2", help="Weights of the request kinds")
+    parser.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson", help="Inter-arrival time distribution")
+    parser.add_argument("--stream", action="store_true", help="Send chat requests with \"stream\": true")
+    parser.add_argument("--reference-audio", help="Reference clip for cloning requests (default: a synthetic 6s clip)")
+    parser.add_argument("--input-audio", help="Clip for audio-input requests (default: a synthetic 4s clip)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Client-side limit of concurrent requests")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the request mix and arrival times")
+    parser.add_argument("--json", dest="json_path", help="Also write the summary to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+        health = requests.get(f"{args.server.rstrip('/')}/health", timeout=10).json()
+    except (ValueError, requests.RequestException) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if health.get("status") != "ok":
+        print(f"⚠️  Service status is {health.get('status')}")
+    print(f"🚀 {args.rps} req/s for {args.duration:.0f}s against {args.server} (engine: {health.get('stand_in_profile') or 'model'})")
+
+    summary = run_load_test(
+        args.server.rstrip("/"), args.rps, args.duration, mix,
+        load_audio(args.reference_audio, 6.0), load_audio(args.input_audio, 4.0),
+        args.stream, args.max_in_flight, args.timeout, args.arrival, args.seed,
+    )
+    print_summary(summary)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"📁 Summary written to {args.json_path}")
+    sys.exit(0 if summary["failed"] == 0 else 1)
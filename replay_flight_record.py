@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Compared between the recorded and the replayed generations
+STAGES = ("prepare_inputs", "prefill", "decode", "codec_decode")
+
+
+def load_engine(args):
+    if args.stand_in:
+        from boson_multimodal.serve.stand_in import StandInServeEngine
+
+        return StandInServeEngine(profile=args.stand_in, kv_cache_lengths=args.kv_cache_lengths)
+    from boson_multimodal.serve.serve_engine import HiggsAudioServeEngine
+
+    return HiggsAudioServeEngine(
+        args.model,
+        args.audio_tokenizer,
+        device=args.device,
+        kv_cache_lengths=args.kv_cache_lengths,
+    )
+
+
+def print_record(record):
+    print(f"📼 {record['id']}: {record['method']} {record['path']} → {record['status']} in {record['latency_ms']:.0f}ms")
+    timings = ", ".join(f"{name}={ms}" for name, ms in record["timings"].items())
+    print(f"  request timings (ms): {timings}")
+    scheduler = record["engine"].get("scheduler")
+    if scheduler:
+        print(
+            f"  scheduler at the end: {scheduler.get('active')} active, queued {scheduler.get('queued')}, "
+            f"{scheduler.get('tokens_per_second', 0):.1f} tok/s"
+        )
+
+
+def compare(recorded, response, elapsed):
+    """Print the stage timings of the recorded generation next to the replayed one"""
+    print(f"  {'':<16} {'recorded':>10} {'replayed':>10}")
+    recorded_timings = recorded.get("timings") or {}
+    for stage in STAGES:
+        before = recorded_timings.get(stage)
+        after = (response.timings or {}).get(stage)
+        print(
+            f"  {stage:<16} {'-' if before is None else f'{before * 1000:.1f}ms':>10} "
+            f"{'-' if after is None else f'{after * 1000:.1f}ms':>10}"
+        )
+    usage = recorded.get("usage") or {}
+    print(
+        f"  {'prompt tokens':<16} {usage.get('prompt_tokens', '-'):>10} {response.usage['prompt_tokens']:>10}\n"
+        f"  {'audio tokens':<16} {usage.get('completion_tokens', '-'):>10} {response.usage['completion_tokens']:>10}\n"
+        f"  {'kv bucket':<16} {str(recorded.get('kv_bucket', '-')):>10} {str(response.kv_bucket):>10}\n"
+        f"  {'service time':<16} {(recorded.get('service_time') or 0) * 1000:>8.1f}ms {elapsed * 1000:>8.1f}ms"
+    )
+    if recorded.get("queue_wait"):
+        print(f"  recorded queue wait: {recorded['queue_wait'] * 1000:.1f}ms (a replay runs alone, without queueing)")
+
+
+def replay(args):
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    from boson_multimodal.serve.flight_recorder import deserialize_chat_ml_sample, load_flight_record
+
+    record = load_flight_record(args.record)
+    print_record(record)
+    generations = record["generations"]
+    if not generations:
+        print("⚠️  The record has no generations to replay (cache hit, or a failure before the TTS stage)")
+        return False
+    selected = range(len(generations)) if args.generation is None else [args.generation]
+
+    reference_audio = None
+    if args.reference_audio:
+        with open(args.reference_audio, "rb") as f:
+            reference_audio = f.read()
+    samples = {}
+    for index in selected:
+        samples[index] = deserialize_chat_ml_sample(generations[index]["chat_ml_sample"], reference_audio=reference_audio)
+
+    engine = load_engine(args)
+    # Lazy initialization (CUDA graphs, kernels, allocator) would otherwise dominate the profile
+    for _ in range(args.warmup):
+        index = selected[0]
+        engine.generate(samples[index], **generations[index]["generate_kwargs"])
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for index in selected:
+        recorded = generations[index]
+        if recorded.get("error"):
+            print(f"  recorded error: {recorded['error']}")
+        if recorded["generate_kwargs"].get("seed") is None:
+            print("⚠️  The generation was unseeded, the replay samples different tokens")
+        for run in range(args.repeat):
+            with profile(activities=activities, record_shapes=True, with_stack=args.with_stack) as profiler:
+                start = time.monotonic()
+                response = engine.generate(samples[index], **recorded["generate_kwargs"])
+                elapsed = time.monotonic() - start
+            print(f"\n🔁 Generation {index + 1}/{len(generations)}, run {run + 1}/{args.repeat}")
+            compare(recorded, response, elapsed)
+            sort_by = "self_cuda_time_total" if ProfilerActivity.CUDA in activities else "self_cpu_time_total"
+            print(profiler.key_averages().table(sort_by=sort_by, row_limit=args.row_limit))
+            trace_path = os.path.join(args.output_dir, f"{record['id']}-gen{index}-run{run}.json")
+            profiler.export_chrome_trace(trace_path)
+            print(f"📁 Chrome trace written to {trace_path}")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-run the generations of a flight record against a local engine under torch.profiler",
+        epilog="Records are written to FLIGHT_RECORDER_DIR by a service running with FLIGHT_RECORDER_THRESHOLD_MS set",
+    )
+    parser.add_argument("record", help="Flight record JSON file")
+    parser.add_argument("--generation", type=int, help="Replay only this generation (0-based), default all")
+    parser.add_argument("--repeat", type=int, default=1, help="Profiled runs per generation")
+    parser.add_argument("--warmup", type=int, default=1, help="Unprofiled generations run first")
+    parser.add_argument("--reference-audio", help="Clip substituted for reference audio recorded by hash only")
+    parser.add_argument("--model", default="bosonai/higgs-audio-v2-generation-3B-base", help="Model checkpoint")
+    parser.add_argument("--audio-tokenizer", default="bosonai/higgs-audio-v2-tokenizer", help="Audio tokenizer checkpoint")
+    parser.add_argument("--device", default="cuda", help="Engine device")
+    parser.add_argument("--kv-cache-lengths", type=int, nargs="+", default=[1024, 4096, 8192], help="KV cache bucket lengths")
+    parser.add_argument("--stand-in", metavar="PROFILE", help="Replay on a stand-in engine instead, see STAND_IN_PROFILE")
+    parser.add_argument("--output-dir", default="profiles", help="Directory for the Chrome traces")
+    parser.add_argument("--row-limit", type=int, default=25, help="Operators shown in the profile table")
+    parser.add_argument("--with-stack", action="store_true", help="Record Python stacks in the traces")
+    args = parser.parse_args()
+
+    try:
+        success = replay(args)
+    except (OSError, ValueError, json.JSONDecodeError) as e:
+        print(f"❌ {e}")
+        success = False
+    sys.exit(0 if success else 1)
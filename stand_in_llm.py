@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import json
+import random
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+# Sentences the replies are drawn from, so that TTS load follows realistic sentence lengths
+SENTENCES = [
+    "Sure, I can help with that.",
+    "Thanks for reaching out, let me take a look.",
+    "The short answer is yes, but there are a couple of details worth knowing.",
+    "Most people find that the second option works best for them.",
+    "It usually takes about two to three business days.",
+    "You can change this setting at any time from your account page.",
+    "Let me know if there is anything else I can do for you today.",
+    "That depends on how often you plan to use it, and on your budget.",
+    "Here is a quick summary of what we talked about.",
+    "I would recommend starting small and adjusting as you go.",
+]
+
+app = Flask(__name__)
+settings = argparse.Namespace(first_token_seconds=0.3, tokens_per_second=50.0, sentences=3, error_rate=0.0)
+
+
+def reply_for(payload):
+    """A reply that only depends on the messages and the seed, so repeated load test runs do the same work"""
+    key = json.dumps([payload.get("messages"), payload.get("seed")], sort_keys=True)
+    rng = random.Random(hashlib.sha256(key.encode("utf-8")).digest())
+    return " ".join(rng.choice(SENTENCES) for _ in range(settings.sentences))
+
+
+def split_tokens(text):
+    """Split a reply into word-sized chunks, one per streamed token"""
+    words = text.split(" ")
+    return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+
+def completion_id():
+    return f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+
+def usage_for(payload, tokens):
+    prompt_tokens = len(json.dumps(payload.get("messages", []))) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+
+
+def stream_reply(payload, tokens):
+    chunk_id = completion_id()
+    created = int(time.time())
+    model = payload.get("model", "stand-in")
+
+    def chunk(delta, finish_reason=None):
+        event = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(event)}\n\n"
+
+    time.sleep(settings.first_token_seconds)
+    yield chunk({"role": "assistant", "content": ""})
+    start = time.monotonic()
+    for i, token in enumerate(tokens):
+        # Paced against the start so that the rate holds however long the writes take
+        delay = start + i / settings.tokens_per_second - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield chunk({"content": token})
+    yield chunk({}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+
+@app.route("/openai", methods=["POST"])
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    """OpenAI-compatible chat completions with a deterministic reply, a fixed time to first token and token rate"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("messages"), list):
+        return jsonify({"error": {"message": "messages is required", "type": "invalid_request_error"}}), 400
+    if settings.error_rate > 0 and random.random() < settings.error_rate:
+        return jsonify({"error": {"message": "Injected upstream error", "type": "server_error"}}), 500
+
+    text = reply_for(payload)
+    tokens = split_tokens(text)
+    if payload.get("stream"):
+        return Response(stream_reply(payload, tokens), mimetype="text/event-stream")
+
+    time.sleep(settings.first_token_seconds + len(tokens) / settings.tokens_per_second)
+    return jsonify({
+        "id": completion_id(),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "stand-in"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": usage_for(payload, tokens),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the text LLM upstream, for deterministic load tests",
+        epilog="Point the service at it with LLM_UPSTREAM_URL=http://localhost:8001/v1/chat/completions",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind")
+    parser.add_argument("--port", type=int, default=8001, help="Port to bind")
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="Time to the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Token rate after the first token")
+    parser.add_argument("--sentences", type=int, default=3, help="Sentences per reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    args = parser.parse_args()
+
+    settings.first_token_seconds = args.first_token_ms / 1000
+    settings.tokens_per_second = args.tokens_per_second
+    settings.sentences = args.sentences
+    settings.error_rate = args.error_rate
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+import types
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+import torch
+from transformers.cache_utils import Cache
+from transformers.generation import GenerationConfig, LogitsProcessorList, StoppingCriteriaList
+
+from boson_multimodal.data_types import ChatMLSample, Message
+from boson_multimodal.model.higgs_audio.modeling_higgs_audio import GenerationMode, HiggsAudioGenerationOutput
+from boson_multimodal.serve.serve_engine import HiggsAudioServeEngine
+
+SYSTEM_PROMPT = (
+    "Generate audio following instruction.\n"
+    "<|scene_desc_start|>\n"
+    "Audio is recorded from a quiet room.\n"
+    "<|scene_desc_end|>"
+)
+STOP_STRINGS = ["<|end_of_text|>", "<|eot_id|>"]
+# (text, temperature, seed): a greedy generation and two seeded sampled ones
+CASES = [
+    ("Hello! Thanks for calling, how can I help you today?", 0.0, None),
+    ("Your order has shipped and should arrive on Thursday.", 0.7, 1234),
+    ("The meeting has been moved to three o'clock in the main conference room.", 0.7, 7),
+]
+
+
+def reference_sample(
+    self,
+    input_ids: torch.LongTensor,
+    logits_processor: LogitsProcessorList,
+    stopping_criteria: StoppingCriteriaList,
+    generation_config: GenerationConfig,
+    synced_gpus: bool,
+    streamer: Optional["BaseStreamer"],
+    past_key_values_buckets: Optional[OrderedDict[int, Cache]],
+    **model_kwargs,
+) -> Union[HiggsAudioGenerationOutput, Tuple[torch.LongTensor, List[torch.LongTensor]]]:
+    """
+    HiggsAudioModel._sample() as it was before its loop was split into _init_decode_state() / _decode_step(), kept
+    here unchanged so the check does not depend on the git history.
+    """
+    assert input_ids.shape[0] == 1, "Only support batch_size=1 in _sample()"
+    audio_out_bos_token_id = generation_config.generation_kwargs.get("audio_out_bos_token_id", None)
+
+    # torch generator for sampling
+    seed = generation_config.generation_kwargs.get("seed", None)
+    if seed is not None:
+        torch_generator = torch.Generator(device=input_ids.device).manual_seed(seed)
+    else:
+        torch_generator = None
+
+    # init values
+    pad_token_id = generation_config._pad_token_tensor
+    output_attentions = generation_config.output_attentions
+    output_hidden_states = generation_config.output_hidden_states
+    output_scores = generation_config.output_scores
+    output_logits = generation_config.output_logits
+    return_dict_in_generate = generation_config.return_dict_in_generate
+    max_length = generation_config.max_length
+    has_eos_stopping_criteria = any(hasattr(criteria, "eos_token_id") for criteria in stopping_criteria)
+    do_sample = generation_config.do_sample
+    # Used to track which past_key_va
+    self.current_past_key_values_bucket = None
+
+    # init attention / hidden states / scores tuples
+    scores = () if (return_dict_in_generate and output_scores) else None
+    raw_logits = () if (return_dict_in_generate and output_logits) else None
+
+    decoder_attentions = () if (return_dict_in_generate and output_attentions) else None
+    decoder_hidden_states = () if (return_dict_in_generate and output_hidden_states) else None
+
+    # keep track of which sequences are already finished
+    batch_size, cur_len = input_ids.shape
+    this_peer_finished = False
+    unfinished_sequences = torch.ones(batch_size, dtype=torch.long, device=input_ids.device)
+    if generation_config.use_cache:
+        model_kwargs["cache_audio_discrete_codes_mask"] = None
+
+    init_model_input = True
+    num_delay = 0
+    num_remaining_delays = None
+    audio_sequences = []
+    # A tensor to keep track of all the audio placeholder tokens.
+    input_ids_full = input_ids.clone()
+
+    # Initialize the audio variables based on the input prompt.
+    if input_ids[0][-1] == self.config.audio_out_token_idx:
+        audio_sequences = [model_kwargs["audio_out_ids"][:, model_kwargs["audio_out_ids_start"][-1] :]]
+        if self.use_delay_pattern:
+            num_delay = (
+                self.audio_num_codebooks
+                - (model_kwargs["audio_out_ids"][:, -1] == self.config.audio_stream_bos_id).sum()
+            )
+            all_eos_indices = (model_kwargs["audio_out_ids"][:, -1] == self.config.audio_stream_eos_id).nonzero()
+            if torch.numel(all_eos_indices) > 0:
+                all_eos_indices = all_eos_indices[0]
+                last_eos_idx = all_eos_indices[-1]
+                num_remaining_delays = self.audio_num_codebooks - last_eos_idx - 1
+
+    while self._has_unfinished_sequences(
+        this_peer_finished, synced_gpus, device=input_ids.device, cur_len=cur_len, max_length=max_length
+    ):
+        # Check which multimodal stage we are in
+        # FIXME: Assume single input generation
+        if input_ids[0][-1] == audio_out_bos_token_id:
+            generation_mode = GenerationMode.AUDIO_INIT
+        elif input_ids[0][-1] == self.audio_out_token_idx:
+            generation_mode = GenerationMode.AUDIO_IN_PROGRESS
+        else:
+            generation_mode = GenerationMode.TEXT
+
+        is_audio_generation_mode = generation_mode == GenerationMode.AUDIO_IN_PROGRESS
+
+        if init_model_input or not generation_config.use_cache:
+            model_inputs = {"input_ids": input_ids, **model_kwargs}
+        else:
+            model_inputs = {"input_ids": input_ids[:, -1:], **model_kwargs}
+
+            if is_audio_generation_mode and generation_config.use_cache:
+                model_inputs["audio_out_ids"] = model_kwargs["audio_out_ids"][:, -1:]
+                model_inputs["audio_out_ids_start"] = torch.tensor([0], dtype=torch.long, device=input_ids.device)
+            elif not is_audio_generation_mode:
+                del model_inputs["audio_out_ids"]
+                del model_inputs["audio_out_ids_start"]
+
+            if generation_config.use_cache:
+                if "audio_features" in model_inputs and model_inputs["audio_features"] is not None:
+                    model_inputs["audio_features"] = model_inputs["audio_features"][:0, ...]
+                    model_inputs["audio_feature_attention_mask"] = model_inputs["audio_feature_attention_mask"][
+                        :0, ...
+                    ]
+
+                if "audio_in_ids" in model_inputs and model_inputs["audio_in_ids"] is not None:
+                    model_inputs["audio_in_ids"] = None
+                    model_inputs["audio_in_ids_start"] = None
+
+        # prepare variable output controls (note: some models won't accept all output controls)
+        model_inputs.update({"output_attentions": output_attentions} if output_attentions else {})
+        model_inputs.update({"output_hidden_states": output_hidden_states} if output_hidden_states else {})
+
+        if past_key_values_buckets is not None:
+            past_key_values, self.current_past_key_values_bucket = self._prepare_kv_cache(
+                cur_len, self.current_past_key_values_bucket, past_key_values_buckets
+            )
+            if past_key_values is not None:
+                model_inputs.update({"past_key_values": past_key_values})
+            model_inputs["past_key_values_buckets"] = past_key_values_buckets
+
+        # forward pass to get next token
+        outputs = self(**model_inputs, return_dict=True)
+
+        # Update the actual sequence length after the first forward pass
+        if init_model_input and past_key_values_buckets is not None:
+            cur_len = past_key_values_buckets[self.current_past_key_values_bucket].get_seq_length().item()
+
+        # synced_gpus: don't waste resources running the code we don't need; kwargs must be updated before skipping
+        model_kwargs = self._update_model_kwargs_for_generation(
+            outputs,
+            model_kwargs,
+            is_encoder_decoder=self.config.is_encoder_decoder,
+            extend_attention_mask=True,
+        )
+
+        # After the first forward pass, we can set init_model_input to False.
+        init_model_input = False
+
+        if synced_gpus and this_peer_finished:
+            continue
+
+        if is_audio_generation_mode:
+            # In audio generation mode, we sample the audio tokens from audio logits.
+            # It might also generate the audio eos token to end the audio generation.
+            (
+                next_tokens,
+                next_audio_tokens,
+                next_audio_token_logits,
+                next_audio_token_scores,
+                num_delay,
+                num_remaining_delays,
+            ) = self._sample_audio_tokens(
+                hidden_states=outputs.audio_hidden_states,
+                audio_logits=outputs.audio_logits,
+                audio_out_ids=model_kwargs["audio_out_ids"],
+                do_sample=do_sample,
+                logits_processor=logits_processor,
+                device=input_ids.device,
+                torch_generator=torch_generator,
+                generation_config=generation_config,
+                num_delay=num_delay,
+                num_remaining_delays=num_remaining_delays,
+            )
+
+            # update generated ids, model inputs, and length for next step
+            model_kwargs["audio_out_ids"] = torch.cat(
+                [model_kwargs["audio_out_ids"], next_audio_tokens[:, None]], dim=-1
+            )
+            audio_sequences[-1] = torch.cat([audio_sequences[-1], next_audio_tokens[:, None]], dim=-1)
+
+            if streamer is not None:
+                streamer.put(next_audio_tokens.cpu())
+        else:
+            # In text generation mode, we sample the text tokens from text logits.
+            # It might also generate the audio placeholder token to start the audio generation.
+            next_tokens, next_audio_tokens, next_token_logits, next_token_scores = self._sample_text_tokens(
+                input_ids=input_ids,
+                logits=outputs.logits,
+                do_sample=do_sample,
+                logits_processor=logits_processor,
+                device=input_ids.device,
+                generation_mode=generation_mode,
+                torch_generator=torch_generator,
+            )
+
+            if streamer is not None:
+                streamer.put(next_tokens.cpu())
+
+            if next_audio_tokens is not None:
+                # If the token is audio bos token, we will generate the audio placeholder token
+                # and the corrensponding audio stream bos token to start the audio generation.
+                audio_sequences.append(next_audio_tokens[:, None])
+                if streamer is not None:
+                    streamer.put(next_audio_tokens.cpu())
+                if model_kwargs["audio_out_ids"] is None or model_kwargs["audio_out_ids"].shape[0] == 0:
+                    # Initialize audio_out_ids
+                    model_kwargs["audio_out_ids"] = next_audio_tokens[:, None]
+                    model_kwargs["audio_out_ids_start"] = torch.tensor(
+                        [0], dtype=torch.long, device=input_ids.device
+                    )
+                else:
+                    model_kwargs["audio_out_ids_start"] = torch.concat(
+                        [
+                            model_kwargs["audio_out_ids_start"],
+                            torch.tensor(
+                                [model_kwargs["audio_out_ids"].shape[1]], dtype=torch.long, device=input_ids.device
+                            ),
+                        ],
+                        dim=0,
+                    )
+                    model_kwargs["audio_out_ids"] = torch.concat(
+                        [model_kwargs["audio_out_ids"], next_audio_tokens[:, None]], dim=1
+                    )
+
+        if return_dict_in_generate:
+            if output_scores:
+                if is_audio_generation_mode:
+                    scores += (next_audio_token_scores,)
+                else:
+                    scores += (next_token_scores,)
+            if output_logits:
+                if is_audio_generation_mode:
+                    raw_logits += (next_audio_token_logits,)
+                else:
+                    raw_logits += (next_token_logits,)
+            if output_attentions:
+                decoder_attentions += (outputs.attentions,)
+            if output_hidden_states:
+                decoder_hidden_states += (outputs.hidden_states,)
+
+        # finished sentences should have their next token be a padding token
+        if has_eos_stopping_criteria:
+            next_tokens = next_tokens * unfinished_sequences + pad_token_id * (1 - unfinished_sequences)
+
+        if "tokenizer_length" in generation_config.generation_kwargs:
+            tokenizer_length = generation_config.generation_kwargs["tokenizer_length"]
+            if torch.max(next_tokens) >= tokenizer_length:
+                raise ValueError(
+                    f"Next generated token has max value {torch.max(next_tokens)} which is greater than the tokenizer's vocabulary size {tokenizer_length}, this is undesired behavior."
+                )
+
+        # update generated ids, model inputs, and length for next step
+        if not is_audio_generation_mode or next_tokens[0] != self.audio_out_token_idx:
+            # We only add one <|AUDIO_OUT|> token to the input_ids for simplicity.
+            input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
+        input_ids_full = torch.cat([input_ids_full, next_tokens[:, None]], dim=-1)
+        unfinished_sequences = unfinished_sequences & ~stopping_criteria(input_ids_full, scores)
+        this_peer_finished = unfinished_sequences.max() == 0
+        cur_len += 1
+
+        # This is needed to properly delete outputs.logits which may be very large for first iteration
+        # Otherwise a reference to outputs is kept which keeps the logits alive in the next iteration
+        del outputs
+
+    if streamer is not None:
+        streamer.end()
+
+    if return_dict_in_generate:
+        return HiggsAudioGenerationOutput(
+            sequences=input_ids,
+            audio_sequences=audio_sequences,
+            scores=scores,
+            logits=raw_logits,
+            attentions=decoder_attentions,
+            hidden_states=decoder_hidden_states,
+            past_key_values=model_kwargs.get("past_key_values"),
+        )
+    else:
+        return input_ids, audio_sequences
+
+
+def tts_sample(text):
+    return ChatMLSample(messages=[Message(role="system", content=SYSTEM_PROMPT), Message(role="user", content=text)])
+
+
+def reference_tokens(engine, text, temperature, seed, max_new_tokens):
+    """Generate through HiggsAudioModel.generate() with the reference _sample(), as the engine used to"""
+    inputs = engine._prepare_inputs(tts_sample(text))
+    prompt_length = inputs["input_ids"].shape[1]
+    kv_caches = engine.kv_cache_slots[0]
+    for kv_cache in kv_caches.values():
+        kv_cache.reset()
+    engine.model._sample = types.MethodType(reference_sample, engine.model)
+    try:
+        with torch.inference_mode():
+            outputs = engine.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                use_cache=True,
+                stop_strings=STOP_STRINGS,
+                tokenizer=engine.tokenizer,
+                do_sample=temperature != 0.0,
+                temperature=temperature,
+                top_k=None,
+                top_p=0.95,
+                past_key_values_buckets=kv_caches,
+                ras_win_len=7,
+                ras_win_max_num_repeat=2,
+                seed=seed,
+            )
+    finally:
+        del engine.model._sample
+    return outputs[0][0, prompt_length:].cpu(), [audio.cpu() for audio in outputs[1]]
+
+
+def decode_step_tokens(engine, cases, max_new_tokens):
+    """Generate the cases together through start_sequence() / step(), one token of each sequence in turn"""
+    sequences = [
+        engine.start_sequence(
+            tts_sample(text), max_new_tokens=max_new_tokens, temperature=temperature, top_p=0.95, seed=seed
+        )
+        for text, temperature, seed in cases
+    ]
+    running = list(sequences)
+    while running:
+        for sequence in list(running):
+            if engine.step(sequence):
+                running.remove(sequence)
+    results = []
+    for sequence in sequences:
+        state = sequence.state
+        results.append(
+            (state.input_ids[0, len(sequence.prompt_token_ids) :].cpu(), [audio.cpu() for audio in state.audio_sequences])
+        )
+        engine.release_sequence(sequence)
+    return results
+
+
+def same_tokens(expected, actual):
+    expected_text, expected_audio = expected
+    actual_text, actual_audio = actual
+    return (
+        torch.equal(expected_text, actual_text)
+        and len(expected_audio) == len(actual_audio)
+        and all(torch.equal(a, b) for a, b in zip(expected_audio, actual_audio))
+    )
+
+
+def describe(tokens):
+    text_tokens, audio_sequences = tokens
+    return f"{len(text_tokens)} text tokens, audio steps {[audio.shape[1] for audio in audio_sequences]}"
+
+
+def check_decode_equivalence(args):
+    print("🧪 _decode_step() vs. the monolithic _sample()")
+    print("=" * 50)
+    engine = HiggsAudioServeEngine(
+        args.model,
+        args.audio_tokenizer,
+        device=args.device,
+        kv_cache_lengths=args.kv_cache_lengths,
+        max_batch_size=len(CASES),
+    )
+
+    expected = [
+        reference_tokens(engine, text, temperature, seed, args.max_new_tokens)
+        for text, temperature, seed in CASES
+    ]
+    success = True
+    # One sequence at a time, then all of them interleaved token by token in separate KV cache slots
+    runs = [("alone", [decode_step_tokens(engine, [case], args.max_new_tokens)[0] for case in CASES])]
+    runs.append(("interleaved", decode_step_tokens(engine, CASES, args.max_new_tokens)))
+    for mode, results in runs:
+        for (text, temperature, seed), reference, result in zip(CASES, expected, results):
+            label = f"{mode}, temperature={temperature}, seed={seed}"
+            if same_tokens(reference, result):
+                print(f"✅ {label}: identical ({describe(result)})")
+            else:
+                print(f"❌ {label}: reference {describe(reference)}, got {describe(result)}")
+                success = False
+    return success
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that _init_decode_state() / _decode_step() generate the same tokens as the former _sample()"
+    )
+    parser.add_argument("--model", default="bosonai/higgs-audio-v2-generation-3B-base", help="Model checkpoint")
+    parser.add_argument("--audio-tokenizer", default="bosonai/higgs-audio-v2-tokenizer", help="Audio tokenizer checkpoint")
+    parser.add_argument("--device", default="cuda", help="Engine device")
+    parser.add_argument("--kv-cache-lengths", type=int, nargs="+", default=[1024, 4096], help="KV cache bucket lengths")
+    parser.add_argument("--max-new-tokens", type=int, default=512, help="Tokens generated per case")
+    args = parser.parse_args()
+
+    success = check_decode_equivalence(args)
+    print("\n🎉 Token streams match" if success else "\n❌ Token streams differ")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+
+import numpy as np
+import torch
+
+from boson_multimodal.data_types import ChatMLSample, Message
+from boson_multimodal.model.higgs_audio.utils import revert_delay_pattern
+from boson_multimodal.serve.serve_engine import HiggsAudioServeEngine
+
+SYSTEM_PROMPT = (
+    "Generate audio following instruction.\n"
+    "<|scene_desc_start|>\n"
+    "Audio is recorded from a quiet room.\n"
+    "<|scene_desc_end|>"
+)
+TEXT = (
+    "Once upon a time, in a small village by the sea, there lived an old fisherman and his daughter. "
+    "Every morning they rowed out before sunrise."
+)
+# Frames decoded per streamed chunk: every step, below, at and above the serving default of 10
+CHUNK_FRAMES = [1, 4, 10, 25]
+
+
+def offline_decode(engine, audio_tokens):
+    """Decode a whole audio segment at once, as HiggsAudioServeEngine.finish_sequence() does"""
+    vq_code = revert_delay_pattern(audio_tokens).clip(0, engine.audio_codebook_size - 1)[:, 1:-1]
+    with torch.inference_mode():
+        return engine.audio_tokenizer.decode(vq_code.unsqueeze(0))[0, 0]
+
+
+def streaming_decode(engine, audio_tokens, chunk_frames):
+    """Push the segment one generation step at a time, as the streaming endpoints do"""
+    decoder = engine.create_streaming_decoder(chunk_frames=chunk_frames)
+    chunks = []
+    for step in range(audio_tokens.shape[1]):
+        chunk = decoder.push(audio_tokens[:, step])
+        if chunk is not None:
+            chunks.append(chunk)
+    chunk = decoder.flush()
+    if chunk is not None:
+        chunks.append(chunk)
+    return np.concatenate(chunks), len(chunks)
+
+
+def snr_db(reference, estimate):
+    noise = np.sum((reference - estimate) ** 2)
+    if noise == 0:
+        return float("inf")
+    return 10 * np.log10(np.sum(reference**2) / noise)
+
+
+def check_streaming_decoder(args):
+    print("🧪 Streaming codec decode vs. offline decode")
+    print("=" * 50)
+    engine = HiggsAudioServeEngine(
+        args.model, args.audio_tokenizer, device=args.device, kv_cache_lengths=args.kv_cache_lengths
+    )
+    sample = ChatMLSample(messages=[Message(role="system", content=SYSTEM_PROMPT), Message(role="user", content=args.text)])
+    response = engine.generate(sample, max_new_tokens=args.max_new_tokens, temperature=0.7, seed=args.seed)
+    if response.generated_audio_tokens is None:
+        print("❌ The generation produced no audio tokens")
+        return False
+    audio_tokens = torch.from_numpy(response.generated_audio_tokens)
+    reference = offline_decode(engine, audio_tokens)
+    print(f"✅ Generated {audio_tokens.shape[1]} audio steps, {len(reference) / response.sampling_rate:.2f}s offline")
+
+    success = True
+    for chunk_frames in args.chunk_frames:
+        streamed, num_chunks = streaming_decode(engine, audio_tokens, chunk_frames)
+        if len(streamed) != len(reference):
+            print(f"❌ chunk_frames={chunk_frames}: {len(streamed)} samples streamed, {len(reference)} offline")
+            success = False
+            continue
+        max_abs_error = float(np.max(np.abs(streamed - reference)))
+        snr = snr_db(reference, streamed)
+        ok = snr >= args.min_snr and max_abs_error <= args.max_abs_error
+        print(
+            f"{'✅' if ok else '❌'} chunk_frames={chunk_frames}: {num_chunks} chunks, "
+            f"SNR {snr:.1f} dB, max abs error {max_abs_error:.4f}"
+        )
+        success = success and ok
+    return success
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that HiggsAudioStreamingDecoder matches the offline decode of the same audio tokens"
+    )
+    parser.add_argument("--text", default=TEXT, help="Text to generate the audio tokens from")
+    parser.add_argument("--seed", type=int, default=1234, help="Sampling seed of the generation")
+    parser.add_argument("--chunk-frames", type=int, nargs="+", default=CHUNK_FRAMES, help="Streamed chunk sizes to check")
+    parser.add_argument("--min-snr", type=float, default=20.0, help="Lowest accepted SNR of the stream in dB")
+    parser.add_argument("--max-abs-error", type=float, default=0.1, help="Largest accepted sample error (full scale is 1.0)")
+    parser.add_argument("--model", default="bosonai/higgs-audio-v2-generation-3B-base", help="Model checkpoint")
+    parser.add_argument("--audio-tokenizer", default="bosonai/higgs-audio-v2-tokenizer", help="Audio tokenizer checkpoint")
+    parser.add_argument("--device", default="cuda", help="Engine device")
+    parser.add_argument("--kv-cache-lengths", type=int, nargs="+", default=[1024, 4096], help="KV cache bucket lengths")
+    parser.add_argument("--max-new-tokens", type=int, default=1024, help="Tokens generated for the test segment")
+    args = parser.parse_args()
+
+    success = check_streaming_decoder(args)
+    print("\n🎉 The stream matches the offline decode" if success else "\n❌ The stream drifts from the offline decode")
+    sys.exit(0 if success else 1)